@@ -0,0 +1,303 @@
+import sys
+import os
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+
+# the synthetic ingredient names are a modifier (or none) followed by a base food, every name
+# a real word so the spaCy vectors used by DIISH aren't empty
+BASE_FOODS = [
+	'salt', 'pepper', 'butter', 'sugar', 'onion', 'garlic', 'egg', 'flour', 'milk', 'oil',
+	'water', 'cheese', 'tomato', 'chicken', 'beef', 'pork', 'lemon', 'parsley', 'cream', 'rice',
+	'potato', 'carrot', 'celery', 'bacon', 'honey', 'vinegar', 'mustard', 'cinnamon', 'nutmeg', 'ginger',
+	'basil', 'oregano', 'thyme', 'rosemary', 'cumin', 'paprika', 'chili', 'cilantro', 'mushroom', 'spinach',
+	'broccoli', 'cabbage', 'corn', 'bean', 'pea', 'lentil', 'chickpea', 'tofu', 'shrimp', 'salmon',
+	'tuna', 'cod', 'lamb', 'turkey', 'sausage', 'ham', 'yogurt', 'vanilla', 'chocolate', 'cocoa',
+	'almond', 'walnut', 'pecan', 'peanut', 'cashew', 'raisin', 'apple', 'banana', 'orange', 'lime',
+	'strawberry', 'blueberry', 'raspberry', 'cherry', 'peach', 'pear', 'pineapple', 'mango', 'coconut', 'avocado',
+	'zucchini', 'eggplant', 'cucumber', 'lettuce', 'kale', 'leek', 'shallot', 'scallion', 'radish', 'beet',
+	'pumpkin', 'squash', 'oat', 'barley', 'quinoa', 'pasta', 'noodle', 'bread', 'tortilla', 'cornstarch',
+	'yeast', 'gelatin', 'molasses', 'syrup', 'ketchup', 'mayonnaise', 'broth', 'stock', 'wine', 'beer',
+]
+MODIFIERS = [
+	'', 'red', 'green', 'yellow', 'white', 'black', 'brown', 'sweet', 'dried', 'fresh',
+	'smoked', 'ground', 'whole', 'baby', 'wild', 'sea', 'hot', 'roasted', 'frozen', 'light',
+]
+# base food -> alternate name, written to synonyms.json
+ALTERNATE_NAMES = {
+	'zucchini': 'courgette', 'eggplant': 'aubergine', 'cilantro': 'coriander', 'scallion': 'spring onion',
+	'shrimp': 'prawn', 'chickpea': 'garbanzo', 'yogurt': 'yoghurt', 'chili': 'chile',
+}
+UNITS = ['cup', 'cups', 'tablespoon', 'teaspoon', 'g', 'oz', 'pound', 'can', 'pinch', 'clove']
+PREPARATIONS = ['chopped', 'diced', 'minced', 'sliced', 'grated', 'melted', 'softened', 'to taste', 'divided', '']
+INSTRUCTIONS = [
+	'Preheat the oven to {n}0 degrees.',
+	'Add the {a} and stir for {n} minutes.',
+	'Mix the {a} with the {b} in a large bowl.',
+	'Cook the {a} over medium heat until golden, about {n} minutes.',
+	'Season with {a} and serve with the {b}.',
+	'Whisk the {a} and {b} together, then pour over the {c}.',
+	'Bake for {n}5 minutes or until set.',
+]
+
+
+def generate_synthetic_corpus(directory, n_recipes, n_ingredients=1500, zipf_exponent=1.0, seed=0):
+	"""
+	Writes a Recipe1M shaped corpus to directory/layer1.json, with the food_names.json,
+	synonyms.json and ghg_snapshot.json it needs in directory/build, so a model can be built
+	from it without the real dataset or the KB
+
+	Ingredients are drawn from a Zipf distribution (the frequency of the ingredient of rank r
+	is proportional to 1 / r ** zipf_exponent) like Recipe1M's, with 1 + Poisson(8)
+	ingredients and 2 to 7 instructions per recipe
+
+	Parameters:
+		n_ingredients: size of the vocabulary (at most len(BASE_FOODS) * len(MODIFIERS))
+	"""
+	from helper_functions import TextCleaner, build_ghg_dict, save_ghg_snapshot
+
+	rng = np.random.default_rng(seed)
+	names = [f'{modifier} {food}'.strip() for modifier in MODIFIERS for food in BASE_FOODS]
+	if n_ingredients > len(names):
+		raise ValueError(f'At most {len(names)} synthetic ingredients are supported')
+	# the plain foods first, so they're the most frequent
+	names = names[:len(BASE_FOODS)] + list(rng.permutation(names[len(BASE_FOODS):]))
+	names = names[:n_ingredients]
+	cumulative = np.cumsum(1 / np.arange(1, len(names) + 1) ** zipf_exponent)
+	cumulative /= cumulative[-1]
+
+	os.makedirs(f'{directory}/build', exist_ok=True)
+	cleaner = TextCleaner()
+	with open(f'{directory}/build/food_names.json', 'w') as f:
+		json.dump([cleaner.normalise_ingredient(name) for name in names], f)
+	synonyms = {
+		cleaner.normalise_ingredient(name.replace(food, alternate)): cleaner.normalise_ingredient(name)
+		for name in names for food, alternate in ALTERNATE_NAMES.items() if name.split()[-1] == food
+	}
+	with open(f'{directory}/build/synonyms.json', 'w') as f:
+		json.dump(synonyms, f)
+
+	print(f'Generating {n_recipes} recipes...')
+	lengths = 1 + np.minimum(rng.poisson(8, size=n_recipes), 19)
+	recipes = []
+	for i, length in enumerate(lengths):
+		# duplicates are dropped, so draw a few more than needed
+		draws = np.searchsorted(cumulative, rng.random(length + 4))
+		ids = list(dict.fromkeys(draws.tolist()))[:length]
+		ingredients = []
+		for ing in ids:
+			name = names[ing]
+			if name.split()[-1] in ALTERNATE_NAMES and rng.random() < 0.2:
+				name = name.replace(name.split()[-1], ALTERNATE_NAMES[name.split()[-1]])
+			ingredients.append({'text': f'{rng.integers(1, 5)} {UNITS[rng.integers(len(UNITS))]} {name} {PREPARATIONS[rng.integers(len(PREPARATIONS))]}'.strip()})
+		instructions = [
+			{'text': INSTRUCTIONS[rng.integers(len(INSTRUCTIONS))].format(
+				a=names[ids[rng.integers(len(ids))]], b=names[ids[rng.integers(len(ids))]],
+				c=names[ids[rng.integers(len(ids))]], n=rng.integers(1, 10))}
+			for _ in range(rng.integers(2, 8))
+		]
+		recipes.append({'id': f'{i:010x}', 'title': f'Recipe {i}', 'partition': 'train',
+			'ingredients': ingredients, 'instructions': instructions})
+	with open(f'{directory}/layer1.json', 'w') as f:
+		json.dump(recipes, f)
+
+	# lognormal kg CO2e per kg, roughly the spread of the KB's values
+	records = [{'ingredient': name, 'alternate_names': [], 'ghg': float(ghg)}
+		for name, ghg in zip(names, rng.lognormal(0.5, 1.0, size=len(names)))]
+	cleaner = TextCleaner(f'{directory}/build')
+	save_ghg_snapshot(f'{directory}/build/ghg_snapshot.json', records, build_ghg_dict(records, cleaner), source='synthetic')
+	return recipes
+
+
+def time_calls(fn, calls):
+	"""
+	Calls fn(*args) for every args in calls
+
+	Returns:
+		dict of the number of calls and their total, mean, median, 95th percentile and max
+		durations (in milliseconds) and calls per second
+	"""
+	durations = []
+	for args in calls:
+		start = time.perf_counter()
+		fn(*args)
+		durations.append(time.perf_counter() - start)
+	durations = np.array(durations) * 1000
+	return {
+		'calls': len(durations),
+		'total_s': float(durations.sum() / 1000),
+		'mean_ms': float(durations.mean()),
+		'p50_ms': float(np.percentile(durations, 50)),
+		'p95_ms': float(np.percentile(durations, 95)),
+		'max_ms': float(durations.max()),
+		'per_s': float(len(durations) / max(durations.sum() / 1000, 1e-9)),
+	}
+
+
+def build_model(directory, n_jobs=1):
+	"""
+	Builds the model from directory/layer1.json with generate_model's stages (but the KB one),
+	one stage at a time unless n_jobs is set so their timings don't interfere
+
+	Returns:
+		the build_log.jsonl records of the stages
+	"""
+	from generate_model import build_stages
+	from helper_functions import BuildGraph
+
+	cwd = os.getcwd()
+	os.chdir(directory)
+	try:
+		stages = [stage for stage in build_stages('layer1.json') if stage.name != 'food_names']
+		graph = BuildGraph(stages, log_path='build/build_log.jsonl')
+		start = time.time()
+		graph.run(n_jobs=n_jobs, force=True)
+		with open(graph.log_path, 'r') as f:
+			records = [json.loads(line) for line in f]
+		return [record for record in records if record['time'] >= start and record['status'] == 'done']
+	finally:
+		os.chdir(cwd)
+
+
+def benchmark_hot_paths(directory, recipes, n_queries=200, seed=0):
+	"""
+	Times the query paths of a model built with build_model()
+
+	Parameters:
+		recipes: the layer1.json recipes the queries are drawn from
+	"""
+	from substitution import Substitution
+	from helper_functions import Metrics
+
+	rng = np.random.default_rng(seed)
+	sample = [recipes[i] for i in rng.choice(len(recipes), size=min(n_queries, len(recipes)), replace=False)]
+	queries = [
+		([(ing['text'], bool(rng.random() < 0.5)) for ing in recipe['ingredients']], [inst['text'] for inst in recipe['instructions']])
+		for recipe in sample
+	]
+	substitution = Substitution(f'{directory}/build', metrics=Metrics(enabled=False))
+	substitution.load()
+	results = {'load_s': substitution.load_report()}
+
+	cleaner = substitution.cleaner
+	results['filter_ingredient'] = time_calls(cleaner.filter_ingredient, [(ing,) for ingredients, _ in queries for ing, _ in ingredients])
+
+	cleaned = [substitution.clean_recipe(ingredients, instructions) for ingredients, instructions in queries]
+	rs_model = substitution.rs_model
+	results['get_most_similar'] = time_calls(lambda recipe: rs_model.get_most_similar(recipe, k=100), [(recipe,) for _, recipe in cleaned])
+
+	is_model = substitution.is_model
+	ingredients = [(ing,) for filtered, _ in cleaned for name, _ in filtered for ing in name.split() if ing in is_model.dictionary.token2id]
+	results['get_top_candidates'] = time_calls(lambda ing: is_model.get_top_candidates(ing, k=5), ingredients)
+
+	similar = [
+		[index for index, _ in rs_model.get_most_similar(recipe, k=100)]
+		for _, recipe in cleaned
+	]
+	results['get_substitutable_ings'] = time_calls(lambda recipes: substitution.get_substitutable_ings(recipes, no_above=0.8), [(s,) for s in similar])
+
+	results['get_substitutions'] = time_calls(substitution.get_substitutions, queries)
+	# once more with the phases of every call recorded
+	substitution.metrics.enabled = True
+	for ingredients, instructions in queries:
+		substitution.get_substitutions(ingredients, instructions)
+	results['get_substitutions_phases'] = substitution.metrics.snapshot()
+
+	# the quantized Doc2Vec search paths against exact search
+	from generate_model import RECIPE_VECTORS
+	from helper_functions import load_array
+	from recipe_similarity_models import ExactCosineIndex, QuantizedIndex
+	vectors = load_array(f'{directory}/{RECIPE_VECTORS["doc2vec"]}')
+	queries = vectors[np.sort(rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False))]
+	exact = ExactCosineIndex(vectors)
+	results['doc2vec_exact_search'] = time_calls(lambda query: exact.search(query, k=100), [(query,) for query in queries])
+	for codec in QuantizedIndex.CODECS:
+		index = QuantizedIndex.build(vectors, codec=codec)
+		results[f'doc2vec_{codec}_search'] = time_calls(lambda query: index.search(query, k=100), [(query,) for query in queries])
+		results[f'doc2vec_{codec}_search']['recall_at_100'] = index.recall(queries, k=100)
+	return results
+
+
+def git_commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def compare(old_path, new_path):
+	"""
+	Prints how the timings of two result files differ (new / old)
+	"""
+	with open(old_path, 'r') as f:
+		old = json.load(f)
+	with open(new_path, 'r') as f:
+		new = json.load(f)
+	print(f'{old["commit"]} -> {new["commit"]} ({new["scale"]} recipes)')
+	for name in new['stages']:
+		if name in old['stages']:
+			print(f'stage {name}: {old["stages"][name]["seconds"]:.2f}s -> {new["stages"][name]["seconds"]:.2f}s '
+				f'(x{new["stages"][name]["seconds"] / max(old["stages"][name]["seconds"], 1e-9):.2f})')
+	for name, timing in new['hot_paths'].items():
+		if name in old['hot_paths'] and 'mean_ms' in timing:
+			print(f'{name}: {old["hot_paths"][name]["mean_ms"]:.3f}ms -> {timing["mean_ms"]:.3f}ms '
+				f'(x{timing["mean_ms"] / max(old["hot_paths"][name]["mean_ms"], 1e-9):.2f})')
+
+
+def main(argv):
+	"""
+	Generates a synthetic corpus, builds the model from it and times the build stages and the
+	query paths, writing the results as JSON. Run with --help for the options, or pass
+	"compare old.json new.json" to compare two result files.
+	"""
+	if argv[:1] == ['compare']:
+		compare(*argv[1:3])
+		return
+	parser = argparse.ArgumentParser(description='Benchmarks the build and the query paths on a synthetic corpus')
+	parser.add_argument('--scale', default='10k', help=f'number of recipes, {", ".join(SCALES)} or any number')
+	parser.add_argument('--ingredients', type=int, default=1500, help='number of distinct ingredients')
+	parser.add_argument('--directory', default=None, help='where the corpus and the model go (default is benchmarks/{scale})')
+	parser.add_argument('--output', default=None, help='results file (default is benchmarks/results_{scale}_{commit}.json)')
+	parser.add_argument('--queries', type=int, default=200, help='number of recipes queried')
+	parser.add_argument('--jobs', type=int, default=1, help='build stages run at a time')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--skip-build', action='store_true', help='reuse the corpus and model in the directory')
+	args = parser.parse_args(argv)
+
+	n_recipes = SCALES.get(args.scale.lower()) or int(args.scale)
+	directory = args.directory or f'benchmarks/{args.scale}'
+	commit = git_commit()
+
+	results = {
+		'commit': commit, 'scale': n_recipes, 'ingredients': args.ingredients, 'seed': args.seed,
+		'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+		'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+		'stages': dict(),
+	}
+	if args.skip_build:
+		with open(f'{directory}/layer1.json', 'r') as f:
+			recipes = json.load(f)
+	else:
+		start = time.perf_counter()
+		recipes = generate_synthetic_corpus(directory, n_recipes, n_ingredients=args.ingredients, seed=args.seed)
+		results['corpus_s'] = time.perf_counter() - start
+		results['stages'] = {record['stage']: record for record in build_model(directory, n_jobs=args.jobs)}
+	results['hot_paths'] = benchmark_hot_paths(directory, recipes, n_queries=args.queries, seed=args.seed)
+
+	output = args.output or f'benchmarks/results_{args.scale}_{(commit or "unknown")[:10]}.json'
+	os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+	with open(output, 'w') as f:
+		json.dump(results, f, indent=1)
+	for name, timing in results['hot_paths'].items():
+		if 'mean_ms' in timing:
+			print(f'{name}: {timing["mean_ms"]:.3f}ms mean, {timing["p95_ms"]:.3f}ms p95 ({timing["calls"]} calls)')
+	print(f'Results saved to {output}')
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,35 @@
+import sys
+import os
+from gensim.corpora import Dictionary
+from helper_functions import TEXT_ARTIFACTS, convert_text_artifact, dictionary_hash
+
+
+def main(argv):
+	"""
+	Converts the text (np.savetxt) artifacts in a directory to the binary format.
+	Pass in the directory (default is "build").
+	"""
+	directory = argv[0] if argv else 'build'
+
+	vocab_hash = None
+	if os.path.exists(f'{directory}/dictionary.txt'):
+		vocab_hash = dictionary_hash(Dictionary.load_from_text(f'{directory}/dictionary.txt'))
+	else:
+		print('dictionary.txt not found, artifacts will be converted without a vocabulary hash')
+
+	for text_name, (name, dtype) in TEXT_ARTIFACTS.items():
+		text_path, path = f'{directory}/{text_name}', f'{directory}/{name}'
+		if not os.path.exists(text_path):
+			continue
+		if os.path.exists(path):
+			print(f'{name} already exists, skipping {text_name}')
+			continue
+		print(f'Converting {text_name}... (this might take a while)')
+		# the doc2vec vectors don't depend on the dictionary
+		shape = convert_text_artifact(text_path, path, dtype=dtype,
+			vocab_hash=None if text_name.startswith('doc2vec') else vocab_hash)
+		print(f'{name} saved! {shape}')
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
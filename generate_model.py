@@ -1,38 +1,93 @@
 import sys
 import os
+import shutil
+import hashlib
+import time
 import requests
 import json
 import warnings
 import spacy
 import numpy as np
 from gensim.corpora import Dictionary
-from gensim.models import Word2Vec
+from gensim.models import Word2Vec, Doc2Vec
 from gensim.models.word2vec import LineSentence
 from gensim.test.utils import datapath
+from scipy import sparse
 from scipy.spatial import distance
-from itertools import combinations
-from helper_functions import TextCleaner, tokenize
+from concurrent.futures import ProcessPoolExecutor
+from helper_functions import (
+	TextCleaner, RecipeStore, tokenize, imap_ordered, save_array, create_array, load_array, load_array_or_text, read_header, dictionary_hash,
+	save_sparse, load_sparse, build_cooccurrence_counts, build_fic_counts, ppmi_vectors, normalize_sparse_rows,
+	Stage, BuildGraph, Corpus
+)
 from vectorizers import TFIDFVectorizer, Doc2VecVectorizer
+from recipe_similarity_models import IVFIndex, QuantizedIndex, InvertedIndex
+from recipe_similarity_models.ivf_index import normalize_rows
+from ingredient_substitution_models import build_top_candidates, diish_block
 
 def main(argv):
+	"""
+	Pass in the path of Recipe1M layer1.json, optionally followed by
+		--jobs N: run at most N stages at a time (default is the number of CPUs)
+		--force: run every stage, even the ones that are up to date
+
+	Only the stages whose inputs changed since they last ran are run (see build_stages())
+	"""
 	if not os.path.exists('build'):
 		os.mkdir('build')
+	n_jobs = None
+	if '--jobs' in argv:
+		i = argv.index('--jobs')
+		n_jobs = int(argv[i + 1])
+		argv = argv[:i] + argv[i + 2:]
+	force = '--force' in argv
+	argv = [arg for arg in argv if arg != '--force']
 	if not argv:
 		print('Please provide the path of Recipe1M layer1.json')
 		exit()
 	path = argv[0]
 	
 	print('---- Generating all needed files ---- this might take upwards of 4 hours')
-	generate_food_names_and_synonyms()
-	generate_filtered_recipe_dataset(path)
-	generate_dictionary()
-	generate_cooccurrence_matrix()
-	generate_word2vec_model()
-	generate_fc_matrix()
-	generate_fic_vectors()
-	generate_DIISH_matrix()
-	generate_tfidf_recipe_similarity_model_and_vectors()
-	generate_doc2vec_recipe_similarity_model_and_vectors()
+	BuildGraph(build_stages(path)).run(n_jobs=n_jobs, force=force)
+
+
+def build_stages(layer_path):
+	"""
+	Returns the stages of the build with the files they read and write. Stages that don't
+	depend on each other (e.g. word2vec, TF-IDF and Doc2Vec) run in parallel, except the ones
+	that start a process pool of their own (parallel=True), which run alone.
+	"""
+	dataset = 'build/recipes_ingredients_only.txt'
+	full_dataset = 'build/recipes_ingredients_and_instructions.txt'
+	dictionary = 'build/dictionary.txt'
+	corpus = 'build/corpus'
+	matrices = ['build/cooccurrence_matrix.csr', 'build/fc_matrix.csr']
+	return [
+		# the KB isn't hashed, delete the outputs to fetch it again
+		Stage('food_names', generate_food_names_and_synonyms,
+			outputs=['build/food_names.json', 'build/synonyms.json']),
+		Stage('filtered_dataset', generate_filtered_recipe_dataset, args=(layer_path,), parallel=True,
+			inputs=[layer_path, ADDED_RECIPES, 'build/food_names.json', 'build/synonyms.json'], outputs=[dataset, full_dataset]),
+		Stage('corpus', generate_corpus, inputs=[dataset, full_dataset], outputs=[corpus]),
+		Stage('dictionary', generate_dictionary, inputs=[corpus], outputs=[dictionary]),
+		Stage('recipe_store', generate_recipe_store, inputs=[corpus, dictionary], outputs=['build/recipe_store']),
+		Stage('cooccurrence', generate_cooccurrence_and_fc_matrices, inputs=[corpus, dictionary], outputs=matrices),
+		Stage('word2vec', generate_word2vec_model, inputs=[full_dataset], outputs=['build/word2vec.model']),
+		Stage('fic', generate_fic_matrix, inputs=[corpus, dictionary], outputs=['build/fic_matrix.csr']),
+		Stage('DIISH', generate_DIISH_matrix, parallel=True,
+			inputs=[dictionary, 'build/word2vec.model', *matrices, 'build/fic_matrix.csr'], outputs=['build/DIISH_matrix.bin']),
+		Stage('DIISH_top_candidates', generate_DIISH_top_candidates, inputs=[dictionary, 'build/DIISH_matrix.bin'],
+			outputs=['build/DIISH_top_candidate_ids.bin', 'build/DIISH_top_candidate_confidences.bin']),
+		Stage('tfidf', generate_tfidf_recipe_similarity_model_and_vectors, inputs=[corpus],
+			outputs=['build/tfidf_model_ingredients_only', RECIPE_VECTORS['tfidf'], 'build/tfidf_inverted_index']),
+		Stage('doc2vec', generate_doc2vec_model, inputs=[full_dataset], outputs=[DOC2VEC_MODEL]),
+		Stage('doc2vec_vectors', generate_doc2vec_vectors, parallel=True, inputs=[full_dataset, DOC2VEC_MODEL],
+			outputs=[RECIPE_VECTORS['doc2vec']]),
+		Stage('doc2vec_ann_index', generate_ann_index, args=('doc2vec',), inputs=[RECIPE_VECTORS['doc2vec']],
+			outputs=['build/doc2vec_ivf_index']),
+		Stage('doc2vec_int8_index', generate_quantized_index, args=('doc2vec', 'int8'), inputs=[RECIPE_VECTORS['doc2vec']],
+			outputs=['build/doc2vec_int8_index']),
+	]
 	
 
 def generate_food_names_and_synonyms():
@@ -58,67 +113,158 @@ def generate_food_names_and_synonyms():
 			json.dump(synonyms, f)
 
 
-def generate_filtered_recipe_dataset(layer_path):
+# the recipes added by update_model.py, cleaned along with Recipe1M's on every rebuild
+ADDED_RECIPES = 'build/added_recipes.json'
+
+def load_added_recipes():
+	"""
+	Returns the recipes added by update_model.py (Recipe1M formatted)
+	"""
+	if not os.path.exists(ADDED_RECIPES):
+		return []
+	with open(ADDED_RECIPES, 'r') as f:
+		return json.load(f)
+
+def save_added_recipes(recipes):
+	tmp_path = f'{ADDED_RECIPES}.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(recipes, f)
+	os.replace(tmp_path, ADDED_RECIPES)
+
+def generate_filtered_recipe_dataset(layer_path, chunk_size=1000, n_jobs=None):
 	"""
 	Pass in the path of Recipe1M's layer1.json
+
+	The recipes are cleaned in chunks of chunk_size recipes over n_jobs processes (default is
+	the number of CPUs) and written in their original order, followed by the recipes added by
+	update_model.py (see load_added_recipes()).
 	"""
 	import json
 	try:
-		cleaner = TextCleaner('build')
+		TextCleaner('build')
 	except:
 		raise FileNotFoundError('Please ensure food_names.json and synonyms.json have been generated and are in the "build" directory')
 		
 	print('Loading Recipe1M...')
 	with open(layer_path, 'r') as f:
 		data = json.load(f)
+	data += load_added_recipes()
 	print('Data loaded!')
 
-	def to_recipe_string_list(recipes, with_instructions=False):
-		"""
-		Generator that turns every recipe into a string of its ingredients
-		"""
-		for recipe in recipes:
-			recipe_ings = []
-			for ing in recipe['ingredients']:
-				filtered_ing = cleaner.filter_ingredient(ing['text'])
-				if filtered_ing:
-					recipe_ings.append(filtered_ing)
-			ing_string = " ".join(recipe_ings)
-			if with_instructions:
-				recipe_insts = []
-				for inst in recipe['instructions']:
-					recipe_insts.append(cleaner.filter_instruction(inst['text']))
-					instructions_string = " || ".join(recipe_insts)
-				yield ing_string + " @@ " + instructions_string
-			else:
-				yield ing_string
-	
-	with open('build/recipes_ingredients_and_instructions.txt', 'a') as f1:
-		with open('build/recipes_ingredients_only.txt', 'a') as f2:
-			f1.seek(0)
-			f1.truncate()
-			f2.seek(0)
-			f2.truncate()
-			i = 0
-			for rec in to_recipe_string_list(data, with_instructions=True):
-				print(f'Generating filtered recipe datasets... {int(i/1029720 * 100)}% done', end='\r')
-				ingredients = rec.split('@@')[0].strip()
+	with open('build/recipes_ingredients_and_instructions.txt', 'w') as f1:
+		with open('build/recipes_ingredients_only.txt', 'w') as f2:
+			for ingredients, rec in clean_recipes(data, chunk_size=chunk_size, n_jobs=n_jobs):
 				f1.write(rec + '\n')
 				f2.write(ingredients + '\n')
-				i += 1
-			print(f'Generating recipe datasets... 100% done')
 	print('Datasets generated!')
 
+def clean_recipes(data, directory='build', chunk_size=1000, n_jobs=None):
+	"""
+	Generator that cleans Recipe1M formatted recipes over n_jobs processes (default is the
+	number of CPUs), chunk_size recipes at a time
 
-def generate_dictionary():
+	Yields:
+		(ingredients only line, ingredients and instructions line) of every recipe, in order
+	"""
+	# only send the workers the text they need
+	chunks = (
+		[
+			([ing['text'] for ing in recipe['ingredients']], [inst['text'] for inst in recipe['instructions']])
+			for recipe in data[start:start + chunk_size]
+		]
+		for start in range(0, len(data), chunk_size)
+	)
+
+	n_recipes, rate = 0, 0
+	start_time = time.perf_counter()
+	with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_filter_worker, initargs=(directory,)) as pool:
+		for recipes in imap_ordered(pool, _filter_recipes, chunks):
+			yield from recipes
+			n_recipes += len(recipes)
+			rate = n_recipes / (time.perf_counter() - start_time)
+			print(f'Cleaning recipes... {n_recipes}/{len(data)} recipes done ({rate:.0f} recipes/s)', end='\r')
+	print(f'Cleaning recipes... {n_recipes}/{len(data)} recipes done ({rate:.0f} recipes/s)')
+
+# text cleaner of the recipe filtering worker processes
+_cleaner = None
+
+def _init_filter_worker(directory):
+	global _cleaner
+	_cleaner = TextCleaner(directory)
+
+def _filter_recipes(recipes):
+	"""
+	Turns every (ingredient texts, instruction texts) recipe into its line in
+	recipes_ingredients_only.txt and recipes_ingredients_and_instructions.txt
+	"""
+	lines = []
+	for ingredients, instructions in recipes:
+		recipe_ings = []
+		for ing in ingredients:
+			filtered_ing = _cleaner.filter_ingredient(ing)
+			if filtered_ing:
+				recipe_ings.append(filtered_ing)
+		ing_string = " ".join(recipe_ings)
+		instructions_string = " || ".join(_cleaner.filter_instruction(inst) for inst in instructions)
+		lines.append((ing_string, ing_string + " @@ " + instructions_string))
+	return lines
+
+
+def generate_corpus():
+	"""
+	Integer-encodes both datasets once (see Corpus), the later stages read them from
+	build/corpus without parsing any text
+	"""
+	print('Encoding corpus...')
 	try:
-		with open('build/recipes_ingredients_only.txt', 'r') as f:
-			recipes = f.readlines()
-			recipes = [line.split() for line in recipes]
+		with open('build/recipes_ingredients_only.txt', 'r') as f1:
+			with open('build/recipes_ingredients_and_instructions.txt', 'r') as f2:
+				corpus = Corpus.build(f1, f2)
 	except FileNotFoundError:
 		raise FileNotFoundError('Make sure to generate the dataset first using generate_filtered_recipe_dataset().')
-	
-	Dictionary(documents=recipes).save_as_text('build/dictionary.txt')
+	corpus.save('build/corpus')
+	print('Corpus saved!')
+
+def load_corpus(dictionary=None) -> Corpus:
+	"""
+	Loads (memory-maps) the corpus, checking that its ingredients are the ones of dictionary
+	if given
+	"""
+	try:
+		corpus = Corpus.load('build/corpus')
+	except FileNotFoundError:
+		raise FileNotFoundError('Make sure to generate the corpus first using generate_corpus().')
+	if dictionary is not None and dictionary_hash(corpus.vocabulary[:corpus.n_ingredients]) != dictionary_hash(dictionary):
+		raise ValueError('The corpus wasn\'t encoded with dictionary.txt, regenerate it')
+	return corpus
+
+def corpus_dictionary(corpus) -> Dictionary:
+	"""
+	Returns the gensim Dictionary of the ingredients of a corpus, the same as
+	Dictionary(documents) of recipes_ingredients_only.txt
+	"""
+	dfs, cfs = corpus.document_frequencies()
+	dictionary = Dictionary()
+	dictionary.token2id = {token: i for i, token in enumerate(corpus.vocabulary[:corpus.n_ingredients])}
+	dictionary.dfs = dict(enumerate(dfs.tolist()))
+	dictionary.cfs = dict(enumerate(cfs.tolist()))
+	dictionary.num_docs = len(corpus)
+	dictionary.num_pos = int(cfs.sum())
+	dictionary.num_nnz = int(dfs.sum())
+	return dictionary
+
+def generate_dictionary():
+	corpus_dictionary(load_corpus()).save_as_text('build/dictionary.txt')
+
+def generate_recipe_store():
+	"""
+	Saves the integer-encoded recipes and ingredient -> recipe postings used by Substitution
+	"""
+	dictionary = load_dictionary()
+	print('Generating recipe store...')
+	store = RecipeStore.from_corpus(load_corpus(dictionary))
+	store.save('build/recipe_store', vocab_hash=dictionary_hash(dictionary))
+	print('Recipe store saved!')
 
 def load_dictionary() -> Dictionary:
 	try:
@@ -139,118 +285,178 @@ def generate_word2vec_model():
 	print('Model saved!')
 
 
-def generate_cooccurrence_matrix():
+def generate_cooccurrence_and_fc_matrices(chunk_size=100000):
 	'''
-	Saves a file for each word containing the co-occurrence vector.
-	(used to speed up D execution)
+	Saves the co-occurrence matrix (used to speed up D execution) and the fc (context counts)
+	matrix as sparse matrices, both built in a single pass over the recipes
+	(see build_cooccurrence_counts())
 	'''
 	dictionary = load_dictionary()
+	corpus = load_corpus(dictionary)
+	cooccurrence, fc = build_cooccurrence_counts(corpus, dictionary.token2id, len(dictionary), chunk_size=chunk_size)
 
-	try:
-		with open('build/recipes_ingredients_only.txt', 'r') as f:
-			matrix = []
-			for i in range(len(dictionary)):
-				print(f'Generating co-occurrence matrix... {i}/{len(dictionary)} words done', end='\r')
-				word = dictionary[i]
-				vector = np.zeros(len(dictionary))
-				recipe_count = 0
-
-				for i, line in enumerate(f):
-					ings = line.split()
-					if word in ings:
-						recipe_count += 1
-						for ing in ings:
-							vector[dictionary.token2id[ing]] += 1
-
-				if recipe_count != 0:
-					vector = vector/recipe_count
-
-				matrix.append(vector)
-				f.seek(0)
-			print(f'Generating co-occurrence matrix... {len(dictionary)}/{len(dictionary)} words done')
-	except FileNotFoundError:
-		raise FileNotFoundError('Make sure to generate the dataset first.')
-	
 	print('Saving...')
-	np.savetxt('build/cooccurrence_matrix.npy', matrix)
-	print('Co-occurrence matrix saved!')
+	save_sparse('build/cooccurrence_matrix.csr', cooccurrence, vocab_hash=dictionary_hash(dictionary))
+	save_sparse('build/fc_matrix.csr', fc, vocab_hash=dictionary_hash(dictionary))
+	print('Co-occurrence and fc matrices saved!')
 
+def generate_cooccurrence_matrix():
+	# both matrices come out of the same pass
+	generate_cooccurrence_and_fc_matrices()
 
 def generate_fc_matrix():
-	"""
-	Context counts matrix
-	"""
-	dictionary = load_dictionary()
-	fc = np.zeros((len(dictionary), len(dictionary)))
-	try:
-		with open('build/recipes_ingredients_only.txt', 'r') as f:
-			for i, line in enumerate(f):
-				print(f'Generating fc matrix... {int(i/1029720 * 100)}% done', end='\r')
-				ings = line.split()
-				for a, b in combinations(ings, 2):
-					fc[dictionary.token2id[a]][dictionary.token2id[b]] += 1
-		print(f'Generating fc matrix... 100% done')
-	except FileNotFoundError:
-		raise FileNotFoundError('Make sure to generate the dataset first.')
-	
-	print('Saving...')
-	np.savetxt('build/fc_matrix.npy', fc)
-	print('Fc matrix saved!')
+	generate_cooccurrence_and_fc_matrices()
 
 
-def generate_fic_vectors():
-	if not os.path.exists('build/fic_vectors'):
-		os.mkdir('build/fic_vectors')
-
-	dictionary = load_dictionary()
-
-	with open('build/recipes_ingredients_only.txt', 'r') as f:
-		for i in range(len(dictionary)):
-			print(f'Generating fic vectors... {i}/{len(dictionary)} words done', end='\r')
-			word = dictionary[i]
-			fic = np.zeros((len(dictionary), len(dictionary)))
-			for _, line in enumerate(f):
-				ings = line.split()
-				if word in ings:
-					for context in combinations(ings, 2):
-						index = (dictionary.token2id[context[0]],dictionary.token2id[context[1]])
-						fic[index] += 1
-			np.savetxt(f'build/fic_vectors/{word}.npy', fic)
-			f.seek(0)
-	print(f'Generating fic vectors... {len(dictionary)}/{len(dictionary)} words done')
-	print('Fic vectors saved!')
-
-def get_fic_matrix():
+def generate_fic_matrix(chunk_size=20000):
+	"""
+	Saves the ingredient-in-context counts (see build_fic_counts()) as a sparse matrix
+	"""
 	dictionary = load_dictionary()
+	corpus = load_corpus(dictionary)
+	fic = build_fic_counts(corpus, dictionary.token2id, len(dictionary), chunk_size=chunk_size)
 
-	matrix = []
-	for i in range(len(dictionary)):
-		try:
-			m = np.loadtxt(f'build/fic_vectors/{dictionary[i]}.npy')
-		except:
-			raise FileNotFoundError(f'Vectors incomplete, {dictionary[i]}.npy not found')
-		matrix.append(m)
-	return np.array(matrix)
+	print('Saving...')
+	save_sparse('build/fic_matrix.csr', fic, vocab_hash=dictionary_hash(dictionary))
+	print('Fic matrix saved!')
 
 
-def generate_DIISH_matrix():
+def generate_DIISH_matrix(mode='blocked', block_size=512, n_jobs=None):
+	"""
+	Generates the DIISH score of every pair of ingredients
+
+	Parameters:
+		mode: 'blocked' computes every component as block matrix products (see diish_block()),
+			one tile of block_size x block_size ingredients at a time over n_jobs processes
+			(default is the number of CPUs). Only the tiles on and above the diagonal are computed
+			(the matrix is symmetric) and every tile is checkpointed to build/DIISH_tiles, so an
+			interrupted build picks up where it stopped.
+			'pairwise' calls DIISH for every pair of ingredients
+	"""
 	print('Initialising DIISH...')
 	diish = DIISH()
 	if diish.dictionary is None:
 		raise FileNotFoundError('dictionary.txt failed to load.')
 	print('DIISH initialised.')
 
-	DIISH_matrix = np.zeros((len(diish.dictionary), len(diish.dictionary)))
-	for i in range(len(diish.dictionary)):
-		print(f'Generating DIISH matrix... {i}/{len(diish.dictionary)} words done', end='\r')
-		for j in range(len(diish.dictionary)):
-			DIISH_matrix[i][j] = diish(diish.dictionary[i], diish.dictionary[j])
-	print(f'Generating DIISH matrix... {len(diish.dictionary)}/{len(diish.dictionary)} words done', end='\r')
+	if mode not in ('blocked', 'pairwise'):
+		raise ValueError(f'Unknown mode {mode}, expected \'blocked\' or \'pairwise\'')
+	# the float32 matrix is filled in place on disk (never held in memory) and moved into
+	# place once complete
+	n = len(diish.dictionary)
+	tmp_path = 'build/DIISH_matrix.bin.tmp'
+	DIISH_matrix = create_array(tmp_path, (n, n), np.float32, vocab_hash=dictionary_hash(diish.dictionary))
+	if mode == 'pairwise':
+		for i in range(n):
+			print(f'Generating DIISH matrix... {i}/{n} words done', end='\r')
+			for j in range(n):
+				DIISH_matrix[i, j] = diish(diish.dictionary[i], diish.dictionary[j])
+		print(f'Generating DIISH matrix... {n}/{n} words done', end='\r')
+	else:
+		generate_DIISH_tiles(diish, 'build/DIISH_tiles', DIISH_matrix, block_size=block_size, n_jobs=n_jobs)
+	DIISH_matrix.flush()
+	del DIISH_matrix
 	print('Matrix generated!')
-	print('Saving...')
-	np.savetxt('build/DIISH_matrix.npy', DIISH_matrix)
+	os.replace(tmp_path, 'build/DIISH_matrix.bin')
+	if mode == 'blocked':
+		shutil.rmtree('build/DIISH_tiles')
 	print('DIISH matrix saved!')
 
+def generate_DIISH_tiles(diish, directory, matrix, block_size=512, n_jobs=None):
+	"""
+	Computes the DIISH matrix tile by tile (see generate_DIISH_matrix()), reusing the tiles
+	already in directory that were computed from the same component vectors, and writes every
+	tile (and its transpose) into matrix, the (n, n) memory-mapped artifact
+	"""
+	if not os.path.exists(directory):
+		os.mkdir(directory)
+	print('Computing component vectors...')
+	w, s, d, p = diish.component_vectors()
+	components_hash = hashlib.sha1(b''.join(
+		np.ascontiguousarray(x).tobytes() for x in (w, s, d.indptr, d.indices, d.data, p.indptr, p.indices, p.data)
+	)).hexdigest()
+	save_array(f'{directory}/w.bin', w)
+	save_array(f'{directory}/s.bin', s)
+	save_sparse(f'{directory}/d.csr', d)
+	save_sparse(f'{directory}/p.csr', p)
+
+	n = len(diish.dictionary)
+	starts = range(0, n, block_size)
+	tiles = [(i, j) for i in starts for j in starts if j >= i]
+	todo = []
+	for i, j in tiles:
+		path = f'{directory}/{i}_{j}.bin'
+		if not os.path.exists(path):
+			todo.append((i, j))
+			continue
+		header = read_header(path)[0]
+		if header.get('components_hash') != components_hash or header.get('block_size') != block_size:
+			todo.append((i, j))
+	print(f'{len(tiles) - len(todo)}/{len(tiles)} tiles already computed')
+
+	def report(done):
+		for count, _ in enumerate(done, start=len(tiles) - len(todo) + 1):
+			print(f'Generating DIISH matrix... {count}/{len(tiles)} tiles done', end='\r')
+
+	args = [(directory, i, j, block_size, components_hash) for i, j in todo]
+	if n_jobs == 1:
+		_init_DIISH_worker(directory)
+		report(map(_DIISH_tile, args))
+	else:
+		with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_DIISH_worker, initargs=(directory,)) as pool:
+			report(pool.map(_DIISH_tile, args))
+	print(f'Generating DIISH matrix... {len(tiles)}/{len(tiles)} tiles done')
+
+	for i, j in tiles:
+		tile = load_array(f'{directory}/{i}_{j}.bin')
+		matrix[i:i + block_size, j:j + block_size] = tile
+		matrix[j:j + block_size, i:i + block_size] = tile.T
+
+# component vectors of the DIISH tile worker processes
+_DIISH_components = None
+
+def _init_DIISH_worker(directory):
+	global _DIISH_components
+	_DIISH_components = (
+		load_array(f'{directory}/w.bin'),
+		load_array(f'{directory}/s.bin'),
+		load_sparse(f'{directory}/d.csr'),
+		load_sparse(f'{directory}/p.csr')
+	)
+
+def _DIISH_tile(args):
+	directory, i, j, block_size, components_hash = args
+	tile = diish_block(*_DIISH_components, rows=slice(i, i + block_size), cols=slice(j, j + block_size))
+	save_array(f'{directory}/{i}_{j}.bin', tile, components_hash=components_hash, block_size=block_size)
+	return i, j
+
+def generate_DIISH_top_candidates(k=100):
+	"""
+	Saves the ids and confidences of the top k substitution candidates of every ingredient
+	(used by DIISHModel.get_top_candidates())
+	"""
+	dictionary = load_dictionary()
+	try:
+		matrix = load_array('build/DIISH_matrix.bin', vocab_hash=dictionary_hash(dictionary))
+	except FileNotFoundError:
+		raise FileNotFoundError('Make sure to generate the DIISH matrix first.')
+	print('Generating DIISH top candidates...')
+	ids, confidences = build_top_candidates(matrix, k=k)
+	print('Saving...')
+	save_array('build/DIISH_top_candidate_ids.bin', ids, vocab_hash=dictionary_hash(dictionary))
+	save_array('build/DIISH_top_candidate_confidences.bin', confidences, vocab_hash=dictionary_hash(dictionary))
+	print('DIISH top candidates saved!')
+
+def load_sparse_or_dense(path, vocab_hash=None):
+	"""
+	Loads the sparse matrix {path}.csr, falling back to the dense {path}.bin/.npy artifacts
+	of builds made by older versions (legacy only, convert_artifacts.py converts them to CSR)
+	"""
+	from scipy import sparse
+	if os.path.exists(f'{path}.csr'):
+		return load_sparse(f'{path}.csr', vocab_hash=vocab_hash)
+	return sparse.csr_matrix(load_array_or_text(f'{path}.bin', f'{path}.npy', vocab_hash=vocab_hash))
+
 class DIISH:
 	def __init__(self, directory='build'):
 		self.directory = directory
@@ -269,23 +475,28 @@ class DIISH:
 		except FileNotFoundError:
 			warnings.warn('word2vec.model not in directory, can\'t calculate W')
 			self.word2vec = None
+		vocab_hash = dictionary_hash(self.dictionary) if self.dictionary is not None else None
 		try:
-			self.co_occ = np.loadtxt(f'{directory}/cooccurrence_matrix.npy')
+			self.co_occ = load_sparse_or_dense(f'{directory}/cooccurrence_matrix', vocab_hash=vocab_hash)
 		except FileNotFoundError:
-			warnings.warn('cooccurrence_matrix.npy not in directory, can calculate D but will be a lot slower (provided recipes_ingredients_only.txt is in the directory)')
+			warnings.warn('cooccurrence_matrix.csr not in directory, can calculate D but will be a lot slower (provided recipes_ingredients_only.txt is in the directory)')
 			self.co_occ = None
 		try:
-			self.fc = np.loadtxt(f'{directory}/fc_matrix.npy')
+			self.fc = load_sparse_or_dense(f'{directory}/fc_matrix', vocab_hash=vocab_hash)
 		except FileNotFoundError:
-			warnings.warn('fc_matrix.npy not in directory, can\'t calculate P')
+			warnings.warn('fc_matrix.csr not in directory, can\'t calculate P')
 			self.fc = None
 		try:
-			self.fic = get_fic_matrix()
-		except FileNotFoundError as e:
-			print(e)
-			warnings.warn('Failed to load the fic matrix, can\'t calculate P')
+			self.fic = load_sparse(f'{directory}/fic_matrix.csr', vocab_hash=vocab_hash)
+		except FileNotFoundError:
+			warnings.warn('fic_matrix.csr not in directory, can\'t calculate P')
 			self.fic = None
-		
+		self.ppmi = None
+		if self.fic is not None and self.fc is not None and self.dictionary is not None:
+			# unit length PPMI vectors, so P is a sparse dot product
+			recipe_counts = [self.dictionary.dfs.get(i, 0) for i in range(len(self.dictionary))]
+			self.ppmi = normalize_sparse_rows(ppmi_vectors(self.fic, self.fc, recipe_counts))
+
 
 	def W(self, a, b):
 		if a not in self.word2vec.wv.key_to_index or b not in self.word2vec.wv.key_to_index:
@@ -303,8 +514,8 @@ class DIISH:
 
 	def D(self, a, b):
 		if not self.co_occ is None:
-			a_vector = self.co_occ[self.dictionary.token2id[a]]
-			b_vector = self.co_occ[self.dictionary.token2id[b]]	
+			a_vector = self.co_occ[self.dictionary.token2id[a]].toarray().ravel()
+			b_vector = self.co_occ[self.dictionary.token2id[b]].toarray().ravel()
 		else:
 			a_vector, b_vector = np.zeros(len(self.dictionary)), np.zeros(len(self.dictionary))
 			a_recipe_count, b_recipe_count = 0, 0
@@ -332,32 +543,35 @@ class DIISH:
 
 		return 1 - distance.cosine(a_vector, b_vector)	
 	
-	def PPMI(self, fic, fi, fc):
-		b = fi * fc
-		return np.maximum(np.log10(np.divide(fic * len(self.dictionary) * len(fc), b, out=np.zeros(fic.shape, dtype=float), where=b!=0))
-		* np.sqrt(np.maximum(fi, fc)), np.zeros(len(fc)))
+	def component_vectors(self):
+		"""
+		Returns the unit length word2vec (W), spaCy (S), co-occurrence (D) and PPMI (P) vectors
+		of every ingredient, so every component of DIISH is a dot product (see diish_block())
+		"""
+		if self.co_occ is None or self.ppmi is None or self.dictionary is None or self.word2vec is None:
+			raise FileNotFoundError('Can\'t calculate DIISH, make sure all needed files are present in the directory')
+		names = [self.dictionary[i] for i in range(len(self.dictionary))]
+		# W is 0 for ingredients word2vec doesn't know, as is S for ingredients without a spaCy vector
+		w = np.zeros((len(names), self.word2vec.wv.vector_size), dtype=np.float32)
+		for i, name in enumerate(names):
+			if name in self.word2vec.wv.key_to_index:
+				w[i] = self.word2vec.wv[name]
+		s = np.array([self.nlps[name.replace('_', ' ')].vector for name in names], dtype=np.float32)
+		return normalize_rows(w), normalize_rows(s), normalize_sparse_rows(self.co_occ), self.ppmi
 
 	def P(self, a, b):
-		if self.fic is None:
-			print('Fic matrix not loaded, can\'t calculate P')
-			return None 
-		if self.fc is None:
-			print('Fc matrix not loaded, can\'t calculate P')
-			return None 
-		
-		fic_a = self.fic[self.dictionary.token2id[a]]
-		fic_b = self.fic[self.dictionary.token2id[b]]
-
-		fi_a = self.dictionary.dfs[self.dictionary.token2id[a]]
-		fi_b = self.dictionary.dfs[self.dictionary.token2id[b]]
+		if self.ppmi is None:
+			print('Fic or fc matrix not loaded, can\'t calculate P')
+			return None
 
-		ppmi = self.PPMI(fic_a.flatten(), fi_a, self.fc.flatten()), self.PPMI(fic_b.flatten(), fi_b, self.fc.flatten())
+		ppmi_a = self.ppmi[self.dictionary.token2id[a]]
+		ppmi_b = self.ppmi[self.dictionary.token2id[b]]
 
-		if np.count_nonzero(ppmi[0]) == 0 or np.count_nonzero(ppmi[1]) == 0:
+		if ppmi_a.nnz == 0 or ppmi_b.nnz == 0:
 			return 0
-		
-		return 1 - distance.cosine(ppmi[0], ppmi[1])
-	
+
+		return float(ppmi_a.multiply(ppmi_b).sum())
+
 	def __call__(self, a, b):
 		if self.fc is None or self.fic is None or self.dictionary is None or self.word2vec is None:
 			print('Can\'t calculate DIISH, make sure all needed files are present in the directory')	
@@ -367,47 +581,213 @@ class DIISH:
 
 def generate_tfidf_recipe_similarity_model_and_vectors():
 	print('--- TFIDF Model and Vectors ---')
-	try:
-		print('Loading recipes...')
-		with open('build/recipes_ingredients_only.txt', 'r') as f:
-			data = f.readlines()
-	except FileNotFoundError:
-		raise FileNotFoundError('Make sure the datasets have been generated')
-	
-	print('Tokenizing data...')
-	data = list(tokenize(data))
+	corpus = load_corpus()
 	print('Fitting model...')
-	model = TFIDFVectorizer().fit(data)
+	model = TFIDFVectorizer().fit(dictionary=corpus_dictionary(corpus))
 	print('Saving model...')
 	model.tfidf.save('build/tfidf_model_ingredients_only')
 
 	print('Generating vectors...')
-	vecs = list(model.transform(data))
+	vecs = sparse.vstack([model.transform_counts(counts) for counts in corpus.iter_counts()], format='csr')
 	print('Saving vectors...')
-	np.savetxt('build/tfidf_vectors_ingredients_only.gz', vecs)
+	save_sparse(RECIPE_VECTORS['tfidf'], vecs, vocab_hash=dictionary_hash(model.id2word))
+	print('Building inverted index...')
+	InvertedIndex.build(vecs).save('build/tfidf_inverted_index')
 	print('Done!')
 
-def generate_doc2vec_recipe_similarity_model_and_vectors():
-	print('--- Doc2Vec Model and Vectors ---')
+def generate_doc2vec_recipe_similarity_model_and_vectors(mode='infer', n_jobs=None, chunk_size=10000):
+	"""
+	Trains the Doc2Vec model and generates the vectors of every recipe (see generate_doc2vec_model()
+	and generate_doc2vec_vectors())
+	"""
+	generate_doc2vec_model()
+	generate_doc2vec_vectors(mode=mode, n_jobs=n_jobs, chunk_size=chunk_size)
+
+DOC2VEC_MODEL = 'build/doc2vec_ingredients_and_instructions.model'
+
+def generate_doc2vec_model():
+	print('--- Doc2Vec Model ---')
 
 	print('Fitting model...')
 	doc2vec = Doc2VecVectorizer().fit(corpus_file='build/recipes_ingredients_and_instructions.txt')
 
 	print('Saving model...')
-	doc2vec.model.save('build/doc2vec_ingredients_and_instructions.model')
+	doc2vec.model.save(DOC2VEC_MODEL)
+	print('Done!')
 
-	print('Generating vectors...')
-	vecs = []
-	with open('build/recipes_ingredients_and_instructions.txt', 'r') as f:
-		for _, line in enumerate(f):
-			line = line.split()
-			vecs.append(doc2vec.model.infer_vector(line))
+def generate_doc2vec_vectors(mode='infer', n_jobs=None, chunk_size=10000, seed=1):
+	"""
+	Generates the Doc2Vec vectors of every recipe of build/recipes_ingredients_and_instructions.txt
+
+	Parameters:
+		mode: 'infer' infers the vector of every recipe the way queries are (with the given seed,
+			see Doc2VecVectorizer), over n_jobs processes (default is the number of CPUs) that each
+			memory-map the model and write the vectors of chunk_size recipes at a time straight into
+			the on-disk array. The chunks done are recorded, so an interrupted run picks up where it
+			stopped.
+			'export' saves the document vectors learnt during training instead (no inference, but
+			they aren't the vectors a query of the same recipe would get)
+	"""
+	print('--- Doc2Vec Vectors ---')
+	corpus = 'build/recipes_ingredients_and_instructions.txt'
+	path = RECIPE_VECTORS['doc2vec']
+	if not os.path.exists(DOC2VEC_MODEL):
+		raise FileNotFoundError('Make sure the Doc2Vec model has been generated')
+	model = Doc2Vec.load(DOC2VEC_MODEL, mmap='r')
+
+	print('Indexing recipes...')
+	offsets = []
+	n = 0
+	with open(corpus, 'rb') as f:
+		position = 0
+		for n, line in enumerate(f, start=1):
+			if (n - 1) % chunk_size == 0:
+				offsets.append(position)
+			position += len(line)
+
+	if mode == 'export':
+		# corpus_file training tags every recipe with its line number
+		if len(model.dv) != n:
+			raise ValueError(f'The model has {len(model.dv)} document vectors but there are {n} recipes, retrain it')
+		print('Saving vectors...')
+		save_array(path, np.asarray(model.dv.vectors[:n], dtype=np.float32))
+		print('Done!')
+		return
+	if mode != 'infer':
+		raise ValueError(f'Unknown mode {mode}, expected \'infer\' or \'export\'')
+
+	# the vectors are written to a temporary file, renamed once complete
+	partial, progress_path = f'{path}.partial', f'{path}.progress'
+	# the chunks done are only reused if neither the model nor the recipes have changed since
+	corpus_stat = os.stat(corpus)
+	state = {
+		'model_mtime_ns': os.stat(DOC2VEC_MODEL).st_mtime_ns, 'n_recipes': n,
+		'corpus_size': corpus_stat.st_size, 'corpus_mtime_ns': corpus_stat.st_mtime_ns,
+		'vector_size': model.vector_size, 'chunk_size': chunk_size, 'seed': seed
+	}
+	done = set()
+	if os.path.exists(partial) and os.path.exists(progress_path):
+		with open(progress_path, 'r') as f:
+			progress = json.load(f)
+		if all(progress.get(key) == value for key, value in state.items()):
+			done = set(progress['done'])
+	if not done:
+		create_array(partial, (n, model.vector_size), np.float32)
+	del model
+	print(f'{len(done)}/{len(offsets)} chunks already inferred')
+
+	def report(chunks):
+		for chunk in chunks:
+			done.add(chunk)
+			with open(f'{progress_path}.tmp', 'w') as f:
+				json.dump({**state, 'done': sorted(done)}, f)
+			os.replace(f'{progress_path}.tmp', progress_path)
+			print(f'Generating vectors... {len(done)}/{len(offsets)} chunks done', end='\r')
+
+	args = [(corpus, chunk, chunk * chunk_size, offset, min(chunk_size, n - chunk * chunk_size))
+		for chunk, offset in enumerate(offsets) if chunk not in done]
+	initargs = (DOC2VEC_MODEL, partial, seed)
+	if n_jobs == 1:
+		_init_doc2vec_worker(*initargs)
+		report(map(_infer_doc2vec_chunk, args))
+	else:
+		with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_doc2vec_worker, initargs=initargs) as pool:
+			report(pool.map(_infer_doc2vec_chunk, args))
+	print(f'Generating vectors... {len(offsets)}/{len(offsets)} chunks done')
+
+	os.replace(partial, path)
+	os.remove(progress_path)
+	print('Done!')
 
-	print('Saving vectors...')
-	np.savetxt('build/doc2vec_vectors_ingredients_and_instructions.gz', vecs)
+# model and output vectors of the Doc2Vec inference worker processes
+_doc2vec_worker = None
+
+def _init_doc2vec_worker(model_path, vectors_path, seed):
+	global _doc2vec_worker
+	vectorizer = Doc2VecVectorizer(seed=seed)
+	# the model's arrays are memory-mapped, so the workers share their pages
+	vectorizer.model = Doc2Vec.load(model_path, mmap='r')
+	_doc2vec_worker = (vectorizer, load_array(vectors_path, writable=True))
+
+def _infer_doc2vec_chunk(args):
+	corpus, chunk, start, offset, n = args
+	vectorizer, vectors = _doc2vec_worker
+	with open(corpus, 'rb') as f:
+		f.seek(offset)
+		for i in range(n):
+			vectors[start + i] = vectorizer.infer(f.readline().decode('utf-8').split())
+	vectors.flush()
+	return chunk
+
+RECIPE_VECTORS = {
+	'tfidf': 'build/tfidf_vectors_ingredients_only.csr',
+	'doc2vec': 'build/doc2vec_vectors_ingredients_and_instructions.bin',
+}
+
+def load_recipe_vectors(model, dense=False):
+	"""
+	Loads the recipe vectors of a recipe similarity model ('tfidf' vectors are sparse, unless
+	dense is set, 'doc2vec' ones memory-mapped)
+	"""
+	if model == 'tfidf':
+		vectors = load_sparse(RECIPE_VECTORS[model])
+		return vectors.toarray() if dense else vectors
+	return load_array(RECIPE_VECTORS[model])
 
+def generate_ann_index(model='doc2vec', n_lists=None, n_probe=8):
+	"""
+	Builds the approximate nearest neighbour index over the recipe vectors of a recipe
+	similarity model ('doc2vec' or 'tfidf') and saves it to build/{model}_ivf_index (used with
+	search='ann'). The TF-IDF vectors are densified for it (as for the quantized indexes), so
+	it's only meant for small builds: TF-IDF is otherwise searched exactly through its
+	inverted index, from the sparse vectors.
+	"""
+	print(f'--- {model} ANN index ---')
+	try:
+		vectors = load_recipe_vectors(model, dense=True)
+	except FileNotFoundError:
+		raise FileNotFoundError(f'Make sure the {model} vectors have been generated')
+
+	print('Building index...')
+	index = IVFIndex.build(vectors, n_lists=n_lists, n_probe=n_probe)
+	print(f'Index built! ({index.n_lists} lists)')
+
+	# estimate the recall of a few n_probe settings on a sample of the vectors
+	# (probing every list is an exact search)
+	sample = np.random.default_rng(1).choice(len(vectors), size=min(100, len(vectors)), replace=False)
+	exact = [set(index.search(vectors[i], k=10, n_probe=index.n_lists)[0]) for i in sample]
+	for probe in sorted({max(1, n_probe // 4), n_probe, n_probe * 4}):
+		hits = sum(len(e.intersection(index.search(vectors[i], k=10, n_probe=probe)[0])) for i, e in zip(sample, exact))
+		print(f'n_probe={probe}: recall@10 ~{hits / (10 * len(sample)):.3f}')
+
+	print('Saving index...')
+	index.save(f'build/{model}_ivf_index')
 	print('Done!')
 
-if __name__ == '__main__':
-	main(sys.argv)
+def generate_quantized_index(model='doc2vec', codec='int8', rerank=4):
+	"""
+	Quantizes the recipe vectors of a recipe similarity model ('tfidf' or 'doc2vec') to codec
+	('float16' or 'int8') and saves them to build/{model}_{codec}_index (used with
+	search=codec, see QuantizedIndex)
+	"""
+	print(f'--- {model} {codec} index ---')
+	try:
+		vectors = load_recipe_vectors(model, dense=True)
+	except FileNotFoundError:
+		raise FileNotFoundError(f'Make sure the {model} vectors have been generated')
+
+	print('Quantizing vectors...')
+	index = QuantizedIndex.build(vectors, codec=codec, rerank=rerank)
+
+	# recall of a few rerank settings against exact search on a sample of the vectors
+	sample = np.random.default_rng(1).choice(len(vectors), size=min(100, len(vectors)), replace=False)
+	queries = vectors[np.sort(sample)]
+	for factor in sorted({1, rerank, rerank * 4}):
+		print(f'rerank={factor}: recall@10 ~{index.recall(queries, k=10, rerank=factor):.3f}')
 
+	print('Saving index...')
+	index.save(f'build/{model}_{codec}_index')
+	print('Done!')
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -1,4 +1,18 @@
+from collections import deque
 from .text_cleaning import TextCleaner
+from .phrase_matcher import PhraseMatcher
+from .artifacts import (
+	save_array, append_array, create_array, load_array, load_array_or_text, read_header, dictionary_hash,
+	convert_text_artifact, TEXT_ARTIFACTS, save_sparse, load_sparse
+)
+from .recipe_store import RecipeStore
+from .corpus import Corpus
+from .ghg_store import (
+	KB_URL, fetch_ghg_records, build_ghg_dict, save_ghg_snapshot, load_ghg_snapshot, refresh_ghg_snapshot, ghg_array
+)
+from .build_graph import Stage, BuildGraph
+from .metrics import Metrics, memory_usage
+from .cooccurrence import build_cooccurrence_counts, count_cooccurrences, normalise_cooccurrence, build_fic_counts, ppmi_vectors, normalize_sparse_rows
 
 def split_array_ranges(length, k):
 	"""
@@ -16,4 +30,22 @@ def split_array_ranges(length, k):
 	return chunks
 
 def tokenize(recipes):
-	return list(map(str.split, recipes))
\ No newline at end of file
+	return list(map(str.split, recipes))
+
+def imap_ordered(executor, fn, iterable, max_pending=None):
+	"""
+	Like executor.map(fn, iterable), but only keeps max_pending tasks (default is twice the
+	number of workers) in flight at a time, so iterable is consumed lazily
+
+	Yields:
+		the results in the order of iterable
+	"""
+	if max_pending is None:
+		max_pending = 2 * (getattr(executor, '_max_workers', None) or 1)
+	pending = deque()
+	for item in iterable:
+		pending.append(executor.submit(fn, item))
+		if len(pending) >= max_pending:
+			yield pending.popleft().result()
+	while pending:
+		yield pending.popleft().result()
\ No newline at end of file
@@ -0,0 +1,259 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+import warnings
+import numpy as np
+
+# Binary artifact layout:
+#   8 bytes   magic
+#   4 bytes   little-endian uint32 header length (n)
+#   n bytes   utf-8 JSON header {"version", "dtype", "shape", "vocab_hash", ...}
+#   padding   up to the next ALIGNMENT boundary
+#   data      the array in C order
+MAGIC = b'ISUBART\x00'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+# text artifact (written by older versions) -> the artifact it's converted to, along with the
+# dtype it's stored as. The sparse ones are converted to CSR matrices (.csr, see save_sparse()),
+# which is what the build writes now.
+TEXT_ARTIFACTS = {
+	'tfidf_vectors_ingredients_only.gz': ('tfidf_vectors_ingredients_only.csr', 'float32'),
+	'doc2vec_vectors_ingredients_and_instructions.gz': ('doc2vec_vectors_ingredients_and_instructions.bin', 'float32'),
+	'DIISH_matrix.npy': ('DIISH_matrix.bin', 'float32'),
+	'fc_matrix.npy': ('fc_matrix.csr', 'float64'),
+	'cooccurrence_matrix.npy': ('cooccurrence_matrix.csr', 'float64'),
+}
+
+
+def dictionary_hash(dictionary):
+	"""
+	Returns a hash of a gensim Dictionary's vocabulary (tokens in id order), used to
+	make sure an artifact is only ever read alongside the dictionary it was built with
+	"""
+	h = hashlib.sha1()
+	for i in range(len(dictionary)):
+		h.update(dictionary[i].encode('utf-8'))
+		h.update(b'\n')
+	return h.hexdigest()
+
+
+def _data_offset(header_length):
+	offset = len(MAGIC) + 4 + header_length
+	return offset + (-offset % ALIGNMENT)
+
+
+def _encode_header(dtype, shape, vocab_hash, metadata):
+	header = dict(metadata)
+	header.update({
+		'version': FORMAT_VERSION,
+		'dtype': np.dtype(dtype).str,
+		'shape': [int(x) for x in shape],
+		'vocab_hash': vocab_hash,
+	})
+	return json.dumps(header).encode('utf-8')
+
+
+def _write_header(f, header):
+	f.write(MAGIC)
+	f.write(struct.pack('<I', len(header)))
+	f.write(header)
+	f.write(b'\x00' * (_data_offset(len(header)) - f.tell()))
+
+
+def read_header(path):
+	"""
+	Reads the header of a binary artifact
+
+	Returns:
+		(header dict, byte offset of the data)
+	"""
+	with open(path, 'rb') as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError(f'{path} is not a binary artifact')
+		(length,) = struct.unpack('<I', f.read(4))
+		header = json.loads(f.read(length).decode('utf-8'))
+	if header['version'] > FORMAT_VERSION:
+		raise ValueError(f'{path} was written with artifact format version {header["version"]}, '
+			f'only versions up to {FORMAT_VERSION} are supported')
+	return header, _data_offset(length)
+
+
+def save_array(path, array, vocab_hash=None, **metadata):
+	"""
+	Saves an array as a binary artifact. The file is written to a temporary path first
+	and then moved into place so readers never see a partially written artifact.
+
+	Parameters:
+		path: destination file
+		array: anything np.asarray accepts
+		vocab_hash: hash of the dictionary the array was built with (see dictionary_hash())
+		metadata: any extra JSON-serialisable values to store in the header
+	"""
+	array = np.ascontiguousarray(array)
+	header = _encode_header(array.dtype, array.shape, vocab_hash, metadata)
+	tmp_path = f'{path}.tmp'
+	with open(tmp_path, 'wb') as f:
+		_write_header(f, header)
+		array.tofile(f)
+	os.replace(tmp_path, path)
+
+
+def append_array(path, rows):
+	"""
+	Appends rows to a binary artifact (along its first axis). The artifact is rewritten to a
+	temporary path and moved into place, so processes that have it memory-mapped keep
+	reading the old version.
+	"""
+	header, offset = read_header(path)
+	dtype = np.dtype(header['dtype'])
+	rows = np.ascontiguousarray(rows, dtype=dtype)
+	if tuple(header['shape'][1:]) != rows.shape[1:]:
+		raise ValueError(f'Can\'t append rows of shape {rows.shape[1:]} to {path} ({tuple(header["shape"])})')
+	header['shape'] = [header['shape'][0] + len(rows)] + header['shape'][1:]
+	tmp_path = f'{path}.tmp'
+	with open(tmp_path, 'wb') as f:
+		_write_header(f, json.dumps(header).encode('utf-8'))
+		with open(path, 'rb') as old:
+			old.seek(offset)
+			shutil.copyfileobj(old, f, 1 << 24)
+		rows.tofile(f)
+	os.replace(tmp_path, path)
+
+
+def create_array(path, shape, dtype, vocab_hash=None, **metadata):
+	"""
+	Creates a binary artifact of the given shape (zero-filled, without writing the zeros) to
+	be filled in place, e.g. by several processes each opening it with load_array(writable=True)
+
+	Returns:
+		writable np.memmap of the data
+	"""
+	header = _encode_header(dtype, shape, vocab_hash, metadata)
+	with open(path, 'wb') as f:
+		_write_header(f, header)
+		offset = f.tell()
+		f.truncate(offset + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+	return np.memmap(path, dtype=dtype, mode='r+', offset=offset, shape=tuple(shape))
+
+
+def load_array(path, vocab_hash=None, mmap=True, writable=False):
+	"""
+	Loads a binary artifact
+
+	Parameters:
+		path: the artifact file
+		vocab_hash: if given, the artifact must have been built with this dictionary hash
+		mmap: memory-map the file read-only (zero-copy, pages are shared between processes)
+			rather than reading it into memory
+		writable: memory-map the file read-write instead (changes are written to the file)
+
+	Returns:
+		np.memmap if mmap else np.ndarray
+	"""
+	header, offset = read_header(path)
+	if vocab_hash is not None and header['vocab_hash'] is not None and header['vocab_hash'] != vocab_hash:
+		raise ValueError(f'{path} was built with a different dictionary, regenerate it or the dictionary')
+	dtype = np.dtype(header['dtype'])
+	shape = tuple(header['shape'])
+	if mmap:
+		if 0 in shape:
+			return np.zeros(shape, dtype=dtype)
+		return np.memmap(path, dtype=dtype, mode='r+' if writable else 'r', offset=offset, shape=shape)
+	with open(path, 'rb') as f:
+		f.seek(offset)
+		return np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def load_array_or_text(path, text_path=None, vocab_hash=None, mmap=True):
+	"""
+	Loads a binary artifact, falling back to the old np.savetxt version of it if only that exists
+
+	Parameters:
+		path: the binary artifact file
+		text_path: the text artifact file to fall back to
+		vocab_hash, mmap: see load_array()
+	"""
+	if os.path.exists(path):
+		return load_array(path, vocab_hash=vocab_hash, mmap=mmap)
+	if text_path is not None and os.path.exists(text_path):
+		warnings.warn(f'{path} not found, loading {text_path} instead. '
+			'Run convert_artifacts.py to convert it to the (much faster to load) binary format')
+		return np.loadtxt(text_path, ndmin=2)
+	raise FileNotFoundError(f'{path} not found')
+
+
+def convert_text_artifact(text_path, path, dtype='float64', vocab_hash=None):
+	"""
+	Converts an artifact written with np.savetxt to the binary format, or to a CSR matrix
+	(see save_sparse()) if path ends with .csr, in which case the text is read one row at a
+	time so the dense matrix is never held in memory
+
+	Returns:
+		the shape of the artifact
+	"""
+	if not path.endswith('.csr'):
+		array = np.loadtxt(text_path, dtype=dtype, ndmin=2)
+		save_array(path, array, vocab_hash=vocab_hash, source=os.path.basename(text_path))
+		return array.shape
+	from scipy import sparse
+	indptr, indices, data = [np.zeros(1, dtype=np.int64)], [], []
+	n_rows, n_cols, nnz = 0, 0, 0
+	with (gzip.open if text_path.endswith('.gz') else open)(text_path, 'rt') as f:
+		for line in f:
+			row = np.array(line.split(), dtype=dtype)
+			nonzero = np.flatnonzero(row)
+			indices.append(nonzero)
+			data.append(row[nonzero])
+			nnz += len(nonzero)
+			indptr.append(np.array([nnz], dtype=np.int64))
+			n_rows, n_cols = n_rows + 1, max(n_cols, len(row))
+	matrix = sparse.csr_matrix((
+		np.concatenate(data) if data else np.zeros(0, dtype=dtype),
+		np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64),
+		np.concatenate(indptr)
+	), shape=(n_rows, n_cols))
+	save_sparse(path, matrix, vocab_hash=vocab_hash, source=os.path.basename(text_path))
+	return matrix.shape
+
+
+def save_sparse(path, matrix, vocab_hash=None, **metadata):
+	"""
+	Saves a scipy.sparse matrix as a CSR matrix in the directory path
+	(indptr.bin, indices.bin and data.bin, each a binary artifact). The column indices are
+	stored as int32 unless there are more columns than int32 can index.
+	"""
+	matrix = matrix.tocsr()
+	matrix.sum_duplicates()
+	if not os.path.exists(path):
+		os.mkdir(path)
+	save_array(f'{path}/indptr.bin', matrix.indptr.astype(np.int64), vocab_hash=vocab_hash)
+	index_dtype = np.int64 if matrix.shape[1] > np.iinfo(np.int32).max else np.int32
+	save_array(f'{path}/indices.bin', matrix.indices.astype(index_dtype), vocab_hash=vocab_hash)
+	# data.bin is written last so its header (with the matrix shape) marks the matrix as complete
+	save_array(f'{path}/data.bin', matrix.data, vocab_hash=vocab_hash, sparse_shape=list(matrix.shape), **metadata)
+
+
+def load_sparse(path, vocab_hash=None, mmap=True):
+	"""
+	Loads a CSR matrix saved with save_sparse()
+
+	Parameters:
+		path: the matrix directory
+		vocab_hash, mmap: see load_array()
+
+	Returns:
+		scipy.sparse.csr_matrix (backed by the memory-mapped arrays if mmap)
+	"""
+	from scipy import sparse
+	if not os.path.exists(f'{path}/data.bin'):
+		raise FileNotFoundError(f'{path} not found')
+	header, _ = read_header(f'{path}/data.bin')
+	return sparse.csr_matrix((
+		load_array(f'{path}/data.bin', vocab_hash=vocab_hash, mmap=mmap),
+		load_array(f'{path}/indices.bin', vocab_hash=vocab_hash, mmap=mmap),
+		load_array(f'{path}/indptr.bin', vocab_hash=vocab_hash, mmap=mmap)
+	), shape=tuple(header['sparse_shape']), copy=False)
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import sys
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+
+
+class Stage:
+	"""
+	A step of the build: a function that reads the files inputs and writes the files (or
+	directories) outputs
+	"""
+	def __init__(self, name, function, inputs=(), outputs=(), args=(), parallel=False):
+		"""
+		Parameters:
+			name: unique name of the stage
+			function: module-level function (it's run in a separate process)
+			inputs, outputs: paths of the files and directories the stage reads and writes
+			args: arguments function is called with
+			parallel: function takes an n_jobs keyword argument, the number of worker
+				processes it may start. It's given all of the graph's and runs alone.
+		"""
+		self.name = name
+		self.function = function
+		self.inputs = list(inputs)
+		self.outputs = list(outputs)
+		self.args = tuple(args)
+		self.parallel = parallel
+
+
+def _paths(path):
+	"""
+	Returns the files of path (path itself if it's a file), sorted
+	"""
+	if not os.path.isdir(path):
+		return [path]
+	files = []
+	for root, _, names in os.walk(path):
+		files.extend(os.path.join(root, name) for name in names)
+	return sorted(files)
+
+
+def _peak_memory_mb(children=False):
+	"""
+	Returns the peak resident memory of the process, or with children set, the largest one of
+	the child processes it has waited for (the worker pools of a stage)
+	"""
+	import resource
+	peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+	# kilobytes on Linux, bytes on macOS
+	return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _run_stage(function, args, kwargs, conn):
+	start = time.perf_counter()
+	try:
+		function(*args, **kwargs)
+		conn.send({
+			'ok': True, 'seconds': time.perf_counter() - start,
+			'peak_memory_mb': _peak_memory_mb(), 'children_peak_memory_mb': _peak_memory_mb(children=True)
+		})
+	except BaseException as e:
+		conn.send({'ok': False, 'error': repr(e), 'seconds': time.perf_counter() - start})
+		raise
+	finally:
+		conn.close()
+
+
+class BuildGraph:
+	"""
+	Runs stages in dependency order (a stage depends on the stages that output its inputs),
+	independent stages in parallel processes, n_jobs worker processes at most: a stage takes
+	one, a parallel one all of them. A stage is skipped if the content hashes of
+	its inputs and outputs are the ones recorded in the manifest after it last ran.
+	Every stage that runs appends a JSON record (seconds, peak memory of the stage and of its
+	largest worker process, input throughput) to the log.
+	"""
+	def __init__(self, stages, manifest_path='build/manifest.json', log_path='build/build_log.jsonl'):
+		self.stages = {stage.name: stage for stage in stages}
+		if len(self.stages) != len(stages):
+			raise ValueError('The names of the stages aren\'t unique')
+		self.manifest_path = manifest_path
+		self.log_path = log_path
+		producers = dict()
+		for stage in stages:
+			for output in stage.outputs:
+				if output in producers:
+					raise ValueError(f'{output} is an output of both {producers[output]} and {stage.name}')
+				producers[output] = stage.name
+		self.dependencies = {
+			stage.name: {producers[path] for path in stage.inputs if path in producers} - {stage.name}
+			for stage in stages
+		}
+		self.check_cycles()
+		self.manifest = {'files': dict(), 'stages': dict()}
+		if os.path.exists(manifest_path):
+			with open(manifest_path, 'r') as f:
+				self.manifest = json.load(f)
+
+	def check_cycles(self):
+		"""
+		Raises ValueError if stages depend on each other (they could never run)
+		"""
+		remaining = dict(self.dependencies)
+		while remaining:
+			ready = [name for name, dependencies in remaining.items() if not dependencies & remaining.keys()]
+			if not ready:
+				raise ValueError(f'The stages {", ".join(sorted(remaining))} depend on each other')
+			for name in ready:
+				del remaining[name]
+
+	def hash(self, path):
+		"""
+		Returns the content hash of a file or directory (None if it doesn't exist). The hash of
+		every file is cached in the manifest by size and modification time.
+		"""
+		if not os.path.exists(path):
+			return None
+		h = hashlib.sha1()
+		for file in _paths(path):
+			stat = os.stat(file)
+			cached = self.manifest['files'].get(file)
+			if cached is None or cached['size'] != stat.st_size or cached['mtime_ns'] != stat.st_mtime_ns:
+				file_hash = hashlib.sha1()
+				with open(file, 'rb') as f:
+					for block in iter(lambda: f.read(1 << 24), b''):
+						file_hash.update(block)
+				cached = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash.hexdigest()}
+				self.manifest['files'][file] = cached
+			h.update(os.path.relpath(file, path).encode('utf-8'))
+			h.update(cached['hash'].encode('utf-8'))
+		return h.hexdigest()
+
+	def size(self, paths):
+		return sum(os.path.getsize(file) for path in paths if os.path.exists(path) for file in _paths(path))
+
+	def is_up_to_date(self, stage):
+		"""
+		A stage is up to date if its inputs and outputs have the hashes recorded after it last ran
+		(with the same args), or if it has no inputs, no record and all of its outputs exist
+		(a fetch whose outputs were made outside of the graph, e.g. before there was a manifest)
+		"""
+		record = self.manifest['stages'].get(stage.name)
+		if record is None and not stage.inputs:
+			return all(os.path.exists(path) for path in stage.outputs)
+		if record is None or record.get('args') != repr(stage.args):
+			return False
+		return all(record['inputs'].get(path) == self.hash(path) for path in stage.inputs) and \
+			all(record['outputs'].get(path) == self.hash(path) is not None for path in stage.outputs)
+
+	def record(self, stage):
+		self.manifest['stages'][stage.name] = {
+			'args': repr(stage.args),
+			'inputs': {path: self.hash(path) for path in stage.inputs},
+			'outputs': {path: self.hash(path) for path in stage.outputs},
+		}
+
+	def save_manifest(self):
+		tmp_path = f'{self.manifest_path}.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(self.manifest, f, indent=1)
+		os.replace(tmp_path, self.manifest_path)
+
+	def log(self, record):
+		print(f'[{record["stage"]}] {record["status"]}' + (
+			f' in {record["seconds"]:.1f}s, peak memory {record["peak_memory_mb"]:.0f} MB '
+			f'(workers {record["children_peak_memory_mb"]:.0f} MB), '
+			f'{record["input_mb_per_s"]:.1f} MB/s' if record['status'] == 'done' else ''))
+		with open(self.log_path, 'a') as f:
+			f.write(json.dumps(record) + '\n')
+
+	def run(self, n_jobs=None, force=False):
+		"""
+		Runs the stages that aren't up to date with at most n_jobs worker processes (default is
+		the number of CPUs): up to n_jobs stages at a time, a parallel stage running alone with
+		n_jobs=n_jobs so the machine isn't oversubscribed
+
+		Parameters:
+			force: run every stage
+		"""
+		n_jobs = n_jobs or os.cpu_count() or 1
+		pending = set(self.stages)
+		done = set()
+		running = dict()
+		failed = None
+		while pending or running:
+			ready = [name for name in sorted(pending) if self.dependencies[name] <= done]
+			skipped = False
+			for name in ready:
+				stage = self.stages[name]
+				if failed is not None:
+					break
+				if not force and self.is_up_to_date(stage):
+					pending.remove(name)
+					if name not in self.manifest['stages']:
+						self.record(stage)
+					done.add(name)
+					skipped = True
+					self.log({'stage': name, 'status': 'skipped', 'time': time.time()})
+					continue
+				# the worker processes of the running stages
+				busy = sum(n_jobs if self.stages[other].parallel else 1 for other in running)
+				if busy + (n_jobs if stage.parallel else 1) > n_jobs and running:
+					break
+				pending.remove(name)
+				print(f'[{name}] started')
+				kwargs = {'n_jobs': n_jobs} if stage.parallel else {}
+				receiver, sender = multiprocessing.Pipe(duplex=False)
+				process = multiprocessing.Process(
+					target=_run_stage, args=(stage.function, stage.args, kwargs, sender), name=name)
+				process.start()
+				sender.close()
+				running[name] = (process, receiver, self.size(stage.inputs))
+			if not running:
+				if failed is not None or not pending:
+					break
+				if not skipped:
+					raise RuntimeError(f'The stages {", ".join(sorted(pending))} can\'t run')
+				# only skipped stages were ready, schedule the stages they unblocked
+				continue
+
+			finished = wait([process.sentinel for process, _, _ in running.values()])
+			for name in [name for name, (process, _, _) in running.items() if process.sentinel in finished]:
+				process, receiver, input_size = running.pop(name)
+				process.join()
+				result = receiver.recv() if receiver.poll() else {'ok': False, 'error': f'exit code {process.exitcode}'}
+				stage = self.stages[name]
+				if not result['ok']:
+					failed = failed or name
+					self.log({'stage': name, 'status': 'failed', 'error': result['error'], 'time': time.time()})
+					continue
+				self.record(stage)
+				self.save_manifest()
+				done.add(name)
+				self.log({
+					'stage': name, 'status': 'done', 'time': time.time(),
+					'seconds': result['seconds'], 'peak_memory_mb': result['peak_memory_mb'],
+					'children_peak_memory_mb': result['children_peak_memory_mb'],
+					'input_bytes': input_size, 'output_bytes': self.size(stage.outputs),
+					'input_mb_per_s': input_size / (1024 * 1024) / max(result['seconds'], 1e-9),
+				})
+		self.save_manifest()
+		if failed is not None:
+			raise RuntimeError(f'Stage {failed} failed, see {self.log_path}')
@@ -0,0 +1,208 @@
+import numpy as np
+from scipy import sparse
+from .corpus import Corpus
+
+
+def iter_count_chunks(lines, token2id, n_ingredients, chunk_size=100000):
+	"""
+	Encodes recipe strings (lines of recipes_ingredients_only.txt) chunk by chunk. lines can
+	also be a Corpus, whose ingredient ids are used as they are (token2id isn't needed)
+
+	Yields:
+		(chunk_size, n_ingredients) CSR matrices holding how many times every ingredient
+		occurs in every recipe of the chunk
+	"""
+	if isinstance(lines, Corpus):
+		if lines.n_ingredients != n_ingredients:
+			raise ValueError(f'The corpus has {lines.n_ingredients} ingredients but there are {n_ingredients}')
+		yield from lines.iter_counts(chunk_size)
+		return
+
+	rows, cols = [], []
+	n_recipes = 0
+
+	def to_matrix():
+		counts = sparse.csr_matrix(
+			(np.ones(len(cols), dtype=np.int32), (np.array(rows, dtype=np.int32), np.array(cols, dtype=np.int32))),
+			shape=(n_recipes, n_ingredients)
+		)
+		counts.sum_duplicates()
+		return counts
+
+	for line in lines:
+		for ing in line.split():
+			rows.append(n_recipes)
+			cols.append(token2id[ing])
+		n_recipes += 1
+		if n_recipes == chunk_size:
+			yield to_matrix()
+			rows, cols = [], []
+			n_recipes = 0
+	if n_recipes:
+		yield to_matrix()
+
+
+def build_cooccurrence_counts(lines, token2id, n_ingredients, chunk_size=100000, verbose=True):
+	"""
+	Builds the co-occurrence and fc (context counts) matrices in a single pass over the
+	recipes, from the recipe x ingredient count matrix X of every chunk (and its 0/1
+	incidence matrix B):
+
+		co-occurrence[a] = (B^T X)[a] / (number of recipes a occurs in), i.e. the average
+			ingredient counts of the recipes a occurs in
+		fc[a, b] = (X^T X)[a, b], i.e. the number of times a and b occur together in a
+			recipe (in either order), with fc[a, a] = the number of pairs of repeated a's
+
+	Only one chunk of chunk_size recipes is held in memory at a time.
+
+	Returns:
+		(co-occurrence, fc): float64 and int64 CSR matrices of shape (n_ingredients, n_ingredients)
+	"""
+	cooccurrence, fc, recipe_counts = count_cooccurrences(lines, token2id, n_ingredients, chunk_size=chunk_size, verbose=verbose)
+	return normalise_cooccurrence(cooccurrence, recipe_counts), fc
+
+
+def count_cooccurrences(lines, token2id, n_ingredients, chunk_size=100000, verbose=True):
+	"""
+	Counts what build_cooccurrence_counts() is built from
+
+	Returns:
+		(B^T X, fc, the number of recipes every ingredient occurs in)
+	"""
+	cooccurrence = sparse.csr_matrix((n_ingredients, n_ingredients), dtype=np.int64)
+	fc = sparse.csr_matrix((n_ingredients, n_ingredients), dtype=np.int64)
+	recipe_counts = np.zeros(n_ingredients, dtype=np.int64)
+	occurrences = np.zeros(n_ingredients, dtype=np.int64)
+	n_recipes = 0
+
+	for counts in iter_count_chunks(lines, token2id, n_ingredients, chunk_size=chunk_size):
+		counts = counts.astype(np.int64)
+		incidence = counts.copy()
+		incidence.data[:] = 1
+		cooccurrence = cooccurrence + incidence.T @ counts
+		fc = fc + counts.T @ counts
+		recipe_counts += np.asarray(incidence.sum(axis=0)).ravel()
+		occurrences += np.asarray(counts.sum(axis=0)).ravel()
+		n_recipes += counts.shape[0]
+		if verbose:
+			print(f'Counting co-occurrences... {n_recipes} recipes done', end='\r')
+	if verbose:
+		print(f'Counting co-occurrences... {n_recipes} recipes done')
+
+	# X^T X counts a * a for every ingredient occurring a times, but there are only a(a-1)/2 pairs
+	fc = fc.tolil()
+	fc.setdiag((fc.diagonal() - occurrences) // 2)
+	fc = fc.tocsr()
+	fc.eliminate_zeros()
+	return cooccurrence.tocsr(), fc, recipe_counts
+
+
+def normalise_cooccurrence(counts, recipe_counts):
+	"""
+	Divides every row of B^T X by the number of recipes its ingredient occurs in
+	"""
+	scale = np.divide(1, recipe_counts, out=np.zeros(len(recipe_counts)), where=np.asarray(recipe_counts) != 0)
+	cooccurrence = sparse.csr_matrix(sparse.diags(scale) @ sparse.csr_matrix(counts, dtype=np.float64))
+	cooccurrence.eliminate_zeros()
+	return cooccurrence
+
+
+def context_counts(counts):
+	"""
+	Turns a recipe x ingredient count matrix into a recipe x context count matrix, a context
+	being an unordered pair of ingredients (a, b), a <= b, with id a * n_ingredients + b.
+	A recipe contains the context (a, b) count(a) * count(b) times, or count(a) choose 2
+	times if a == b (the same counts as the upper triangle of fc).
+
+	Returns:
+		(n_recipes, n_ingredients ** 2) int64 CSR matrix
+	"""
+	counts = sparse.csr_matrix(counts, dtype=np.int64)
+	counts.sum_duplicates()
+	n_recipes, n_ingredients = counts.shape
+	lengths = np.diff(counts.indptr)
+	rows = np.repeat(np.arange(n_recipes), lengths)
+	positions = np.arange(counts.nnz) - counts.indptr[rows]
+
+	# pair every element of a row with itself and the elements after it
+	# (indices are sorted, so the first ingredient of a pair is never the larger one)
+	n_pairs = lengths[rows] - positions
+	first = np.repeat(np.arange(counts.nnz), n_pairs)
+	offsets = np.arange(len(first)) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+	second = first + offsets
+	values = np.where(
+		offsets == 0,
+		counts.data[first] * (counts.data[first] - 1) // 2,
+		counts.data[first] * counts.data[second]
+	)
+	contexts = counts.indices[first].astype(np.int64) * n_ingredients + counts.indices[second]
+	matrix = sparse.csr_matrix((values, (rows[first], contexts)), shape=(n_recipes, n_ingredients ** 2))
+	matrix.eliminate_zeros()
+	return matrix
+
+
+def build_fic_counts(lines, token2id, n_ingredients, chunk_size=20000, verbose=True):
+	"""
+	Builds the ingredient-in-context counts in a single pass over the recipes:
+	fic[i, c] is the number of times the context c (see context_counts()) occurs in the
+	recipes ingredient i occurs in, i.e. B^T Y for the recipe x ingredient incidence
+	matrix B and recipe x context count matrix Y of every chunk.
+
+	Returns:
+		(n_ingredients, n_ingredients ** 2) int64 CSR matrix
+	"""
+	fic = sparse.csr_matrix((n_ingredients, n_ingredients ** 2), dtype=np.int64)
+	n_recipes = 0
+	for counts in iter_count_chunks(lines, token2id, n_ingredients, chunk_size=chunk_size):
+		incidence = sparse.csr_matrix(counts, dtype=np.int64)
+		incidence.data[:] = 1
+		fic = fic + incidence.T @ context_counts(counts)
+		n_recipes += counts.shape[0]
+		if verbose:
+			print(f'Counting ingredients in context... {n_recipes} recipes done', end='\r')
+	if verbose:
+		print(f'Counting ingredients in context... {n_recipes} recipes done')
+	return fic.tocsr()
+
+
+def ppmi_vectors(fic, fc, recipe_counts):
+	"""
+	Computes the (sparse) PPMI vector of every ingredient over the contexts:
+
+		PPMI(i, c) = max(log10(fic[i, c] * n_ingredients ** 3 / (fi * fc[c])) * sqrt(max(fi, fc[c])), 0)
+
+	where fi is the number of recipes ingredient i occurs in. Only the non-zero counts of
+	fic are touched (PPMI is 0 wherever fic is).
+
+	Parameters:
+		fic: (n_ingredients, n_ingredients ** 2) ingredient-in-context counts (see build_fic_counts())
+		fc: (n_ingredients, n_ingredients) context counts (see build_cooccurrence_counts())
+		recipe_counts: the number of recipes every ingredient occurs in
+
+	Returns:
+		(n_ingredients, n_ingredients ** 2) float64 CSR matrix
+	"""
+	fic = sparse.csr_matrix(fic)
+	fc = sparse.csr_matrix(fc)
+	n_ingredients = fic.shape[0]
+	rows = np.repeat(np.arange(n_ingredients), np.diff(fic.indptr))
+	fi = np.asarray(recipe_counts, dtype=np.float64)[rows]
+	columns = np.asarray(fic.indices, dtype=np.int64)
+	fc_values = np.asarray(fc[columns // n_ingredients, columns % n_ingredients], dtype=np.float64).ravel()
+	with np.errstate(divide='ignore', invalid='ignore'):
+		values = np.log10(fic.data * float(n_ingredients) ** 3 / (fi * fc_values)) * np.sqrt(np.maximum(fi, fc_values))
+	values = np.where(np.isfinite(values), np.maximum(values, 0), 0)
+	# copies, fic's arrays can be read-only memmaps and eliminate_zeros() works in place
+	ppmi = sparse.csr_matrix((values, np.array(fic.indices), np.array(fic.indptr)), shape=fic.shape)
+	ppmi.eliminate_zeros()
+	return ppmi
+
+
+def normalize_sparse_rows(matrix):
+	"""
+	Returns the rows of a sparse matrix scaled to unit length (all-zero rows stay zero)
+	"""
+	matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+	norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+	scale = np.divide(1, norms, out=np.zeros(len(norms)), where=norms != 0)
+	return sparse.csr_matrix(sparse.diags(scale) @ matrix)
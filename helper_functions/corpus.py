@@ -0,0 +1,189 @@
+import os
+from array import array
+import numpy as np
+from scipy import sparse
+from .artifacts import save_array, load_array, read_header, dictionary_hash
+
+
+class Corpus:
+	"""
+	The recipe corpora, integer-encoded once so they can be read without any parsing: the
+	token ids of the ingredients of recipe i are indices[indptr[i]:indptr[i+1]] and, if the
+	instructions were encoded, the ids of its instruction tokens (the part of its line of
+	recipes_ingredients_and_instructions.txt after @@) are
+	instruction_indices[instruction_indptr[i]:instruction_indptr[i+1]].
+
+	The vocabulary is saved with the corpus. The ingredients come first, with the ids a gensim
+	Dictionary built from recipes_ingredients_only.txt gives them (the ids of dictionary.txt),
+	followed by the words that only occur in instructions.
+	"""
+	def __init__(self, vocabulary, n_ingredients, indptr, indices, instruction_indptr=None, instruction_indices=None):
+		"""
+		Parameters:
+			vocabulary: the token of every id
+			n_ingredients: the number of ingredients (ids below it)
+			indptr, indices: the ingredients of every recipe in CSR layout
+			instruction_indptr, instruction_indices: the instructions of every recipe in CSR
+				layout (optional)
+		"""
+		self.vocabulary = vocabulary
+		self.n_ingredients = n_ingredients
+		self.indptr = indptr
+		self.indices = indices
+		self.instruction_indptr = instruction_indptr
+		self.instruction_indices = instruction_indices
+		self.token2id = {token: i for i, token in enumerate(vocabulary)}
+
+	def __len__(self):
+		return len(self.indptr) - 1
+
+	@property
+	def has_instructions(self):
+		return self.instruction_indptr is not None
+
+	@classmethod
+	def build(cls, ingredient_lines, lines=None):
+		"""
+		Encodes the corpora
+
+		Parameters:
+			ingredient_lines: iterable of the lines of recipes_ingredients_only.txt
+			lines: the lines of recipes_ingredients_and_instructions.txt (optional), read
+				after ingredient_lines
+		"""
+		corpus = cls([], 0, np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32))
+		return corpus.append(ingredient_lines, lines, new_ingredients=True)
+
+	def append(self, ingredient_lines, lines=None, new_ingredients=False):
+		"""
+		Returns a corpus with the recipes in ingredient_lines (and lines) added after the
+		recipes of this one. New instruction words are added to the vocabulary, new ingredients
+		only if new_ingredients is set (and the corpus has no instruction words yet).
+		"""
+		vocabulary = list(self.vocabulary)
+		token2id = dict(self.token2id)
+		n_ingredients = self.n_ingredients
+		if new_ingredients and len(vocabulary) > n_ingredients:
+			raise ValueError('New ingredients can\'t be added once the instructions have been encoded')
+		if lines is None and self.has_instructions:
+			raise ValueError('The instructions of the new recipes are needed')
+
+		def encode(tokens, new_tokens):
+			if new_tokens:
+				# new tokens get ids in sorted order, like gensim's Dictionary.doc2bow()
+				for token in sorted(set(tokens).difference(token2id)):
+					token2id[token] = len(vocabulary)
+					vocabulary.append(token)
+			return [token2id[token] for token in tokens]
+
+		lengths, indices = array('q'), array('i')
+		for line in ingredient_lines:
+			ids = encode(line.split(), new_ingredients)
+			indices.extend(ids)
+			lengths.append(len(ids))
+		if new_ingredients:
+			n_ingredients = len(vocabulary)
+		indptr = np.concatenate([self.indptr, self.indptr[-1] + np.cumsum(np.frombuffer(lengths, dtype=np.int64))])
+		indices = np.concatenate([self.indices, np.frombuffer(indices, dtype=np.int32)])
+
+		instruction_indptr, instruction_indices = None, None
+		if lines is not None:
+			if len(self) and not self.has_instructions:
+				raise ValueError('The instructions of the recipes already in the corpus weren\'t encoded')
+			lengths, instruction_indices = array('q'), array('i')
+			for i, line in enumerate(lines):
+				tokens = line.split()
+				# the line is the recipe's ingredients, @@ and its instructions
+				ids = encode(tokens[int(indptr[len(self) + i + 1] - indptr[len(self) + i]) + 1:], True)
+				instruction_indices.extend(ids)
+				lengths.append(len(ids))
+			if len(lengths) != len(indptr) - 1 - len(self):
+				raise ValueError('The corpora don\'t have the same number of recipes')
+			old_indptr = self.instruction_indptr if self.has_instructions else np.zeros(1, dtype=np.int64)
+			old_indices = self.instruction_indices if self.has_instructions else np.zeros(0, dtype=np.int32)
+			instruction_indptr = np.concatenate([old_indptr, old_indptr[-1] + np.cumsum(np.frombuffer(lengths, dtype=np.int64))])
+			instruction_indices = np.concatenate([old_indices, np.frombuffer(instruction_indices, dtype=np.int32)])
+		return Corpus(vocabulary, n_ingredients, indptr, indices, instruction_indptr, instruction_indices)
+
+	def save(self, path):
+		"""
+		Saves the corpus into the directory path
+		"""
+		if not os.path.exists(path):
+			os.mkdir(path)
+		with open(f'{path}/vocabulary.txt', 'w') as f:
+			f.writelines(token + '\n' for token in self.vocabulary)
+		vocab_hash = dictionary_hash(self.vocabulary)
+		save_array(f'{path}/indptr.bin', self.indptr, vocab_hash=vocab_hash, n_ingredients=self.n_ingredients)
+		save_array(f'{path}/indices.bin', self.indices, vocab_hash=vocab_hash)
+		for name in ('instruction_indptr', 'instruction_indices'):
+			if self.has_instructions:
+				save_array(f'{path}/{name}.bin', getattr(self, name), vocab_hash=vocab_hash)
+			elif os.path.exists(f'{path}/{name}.bin'):
+				os.remove(f'{path}/{name}.bin')
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Loads (memory-maps) a corpus saved with save()
+		"""
+		with open(f'{path}/vocabulary.txt', 'r') as f:
+			vocabulary = f.read().split('\n')[:-1]
+		vocab_hash = dictionary_hash(vocabulary)
+		arrays = dict()
+		for name in ('indptr', 'indices', 'instruction_indptr', 'instruction_indices'):
+			if os.path.exists(f'{path}/{name}.bin'):
+				arrays[name] = load_array(f'{path}/{name}.bin', vocab_hash=vocab_hash)
+		n_ingredients = read_header(f'{path}/indptr.bin')[0]['n_ingredients']
+		return cls(vocabulary, n_ingredients, **arrays)
+
+	def recipe(self, index):
+		"""
+		Returns the ingredient ids of a recipe
+		"""
+		return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+	def instructions(self, index):
+		"""
+		Returns the instruction token ids of a recipe
+		"""
+		return self.instruction_indices[self.instruction_indptr[index]:self.instruction_indptr[index + 1]]
+
+	def tokens(self, index):
+		"""
+		Returns the ingredient names of a recipe
+		"""
+		return [self.vocabulary[i] for i in self.recipe(index)]
+
+	def counts(self, start=0, end=None):
+		"""
+		Returns the (end - start, n_ingredients) CSR matrix holding how many times every
+		ingredient occurs in every recipe from start to end
+		"""
+		end = len(self) if end is None else min(end, len(self))
+		indptr = self.indptr[start:end + 1]
+		counts = sparse.csr_matrix(
+			(np.ones(indptr[-1] - indptr[0], dtype=np.int32), np.array(self.indices[indptr[0]:indptr[-1]]), indptr - indptr[0]),
+			shape=(end - start, self.n_ingredients)
+		)
+		counts.sum_duplicates()
+		return counts
+
+	def iter_counts(self, chunk_size=100000):
+		"""
+		Yields:
+			the counts() of chunk_size recipes at a time
+		"""
+		for start in range(0, len(self), chunk_size):
+			yield self.counts(start, start + chunk_size)
+
+	def document_frequencies(self, chunk_size=100000):
+		"""
+		Returns:
+			(number of recipes every ingredient occurs in, number of times it occurs)
+		"""
+		dfs = np.zeros(self.n_ingredients, dtype=np.int64)
+		for counts in self.iter_counts(chunk_size):
+			dfs += np.bincount(counts.indices, minlength=self.n_ingredients)
+		cfs = np.bincount(self.indices, minlength=self.n_ingredients).astype(np.int64)
+		return dfs, cfs
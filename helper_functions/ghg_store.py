@@ -0,0 +1,117 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+KB_URL = 'https://ecarekb.schlegel-online.de'
+SNAPSHOT_VERSION = 1
+
+
+def fetch_ghg_records(cleaner, base_url=KB_URL, n_workers=16, timeout=30):
+	"""
+	Fetches the ghg value of every ingredient in the KB, n_workers requests at a time over a
+	pool of at most n_workers connections
+
+	Parameters:
+		cleaner: TextCleaner used to skip the ingredients that aren't defined (as
+			generate_ghg_dict() always has)
+		base_url: the KB (or a stand-in for it)
+
+	Returns:
+		list of {'ingredient', 'alternate_names', 'ghg'} dicts, in the KB's order
+	"""
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=1, pool_maxsize=n_workers, pool_block=True, max_retries=3)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+
+	ids = session.get(f'{base_url}/foodon_ids', timeout=timeout).json()
+	ids = [ing for ing in ids if cleaner.filter_ingredient(ing['ingredient'])]
+
+	def fetch(ing):
+		req = session.get(f'{base_url}/ingredient?ingredient={"+".join(ing["ingredient"].split())}', timeout=timeout)
+		req.raise_for_status()
+		return {'ingredient': ing['ingredient'], 'alternate_names': ing['alternate_names'], 'ghg': req.json()['ghg']}
+
+	with ThreadPoolExecutor(max_workers=n_workers) as pool:
+		records = list(pool.map(fetch, ids))
+	session.close()
+	return records
+
+
+def build_ghg_dict(records, cleaner):
+	"""
+	Maps every (filtered) ingredient name and alternate name of the records to its ghg value,
+	an ingredient's own name taking precedence over another's alternate name
+	"""
+	ghg = dict()
+	for record in records:
+		name = cleaner.filter_ingredient(record['ingredient'])
+		if not name:
+			continue
+		ghg[name] = record['ghg']
+		for alt_name in record['alternate_names']:
+			alt_name_f = cleaner.filter_ingredient(alt_name)
+			if alt_name_f and alt_name_f not in ghg:
+				ghg[alt_name_f] = record['ghg']
+	return ghg
+
+
+def save_ghg_snapshot(path, records, ghg, source=KB_URL):
+	"""
+	Saves the KB records and the ghg dictionary built from them. The file is written to a
+	temporary path first and then moved into place so readers never see a partial snapshot.
+	"""
+	snapshot = {
+		'version': SNAPSHOT_VERSION,
+		'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+		'source': source,
+		'records': records,
+		'ghg': ghg,
+	}
+	tmp_path = f'{path}.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(snapshot, f)
+	os.replace(tmp_path, path)
+
+
+def load_ghg_snapshot(path):
+	"""
+	Loads a snapshot saved with save_ghg_snapshot()
+
+	Returns:
+		the snapshot dict ('version', 'fetched_at', 'source', 'records', 'ghg')
+	"""
+	with open(path, 'r') as f:
+		snapshot = json.load(f)
+	if snapshot['version'] > SNAPSHOT_VERSION:
+		raise ValueError(f'{path} was written with ghg snapshot version {snapshot["version"]}, '
+			f'only versions up to {SNAPSHOT_VERSION} are supported')
+	return snapshot
+
+
+def refresh_ghg_snapshot(path, cleaner, base_url=KB_URL, n_workers=16):
+	"""
+	Fetches the KB (see fetch_ghg_records()) and saves it as a snapshot to path
+
+	Returns:
+		the ghg dictionary
+	"""
+	records = fetch_ghg_records(cleaner, base_url=base_url, n_workers=n_workers)
+	ghg = build_ghg_dict(records, cleaner)
+	save_ghg_snapshot(path, records, ghg, source=base_url)
+	return ghg
+
+
+def ghg_array(ghg, names):
+	"""
+	Returns the ghg values aligned to ingredient ids (0 for ingredients without one)
+
+	Parameters:
+		ghg: dict of ingredient name -> ghg value
+		names: the ingredient name of every id
+	"""
+	return np.array([ghg.get(name, 0.0) for name in names], dtype=np.float64)
@@ -0,0 +1,140 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+
+# upper bounds (in seconds) of the latency histogram buckets, the last bucket is unbounded
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# returned by phase() when disabled, so an uninstrumented call only pays for a with statement
+_DISABLED = nullcontext()
+
+
+class _Timer:
+	__slots__ = ('metrics', 'name', 'start')
+
+	def __init__(self, metrics, name):
+		self.metrics = metrics
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		self.metrics.observe(self.name, time.perf_counter() - self.start)
+		return False
+
+
+class Metrics:
+	"""
+	Latency histograms of named phases and counters, e.g.
+
+		with metrics.phase('similarity'):
+			...
+		metrics.count('candidates_considered', 5)
+
+	A disabled instance records nothing. snapshot() and prometheus() export what has been
+	recorded so far.
+	"""
+	def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS, prefix='substitution'):
+		self.enabled = enabled
+		self.buckets = tuple(buckets)
+		self.prefix = prefix
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			# phase -> [count of every bucket (non-cumulative), sum of the durations, count]
+			self.histograms = dict()
+			self.counters = dict()
+
+	def phase(self, name):
+		"""
+		Context manager that records the duration of its block in the histogram of name
+		"""
+		if not self.enabled:
+			return _DISABLED
+		return _Timer(self, name)
+
+	def observe(self, name, seconds):
+		if not self.enabled:
+			return
+		with self.lock:
+			histogram = self.histograms.get(name)
+			if histogram is None:
+				histogram = self.histograms[name] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+			histogram[0][bisect_left(self.buckets, seconds)] += 1
+			histogram[1] += seconds
+			histogram[2] += 1
+
+	def count(self, name, n=1):
+		if not self.enabled:
+			return
+		with self.lock:
+			self.counters[name] = self.counters.get(name, 0) + n
+
+	def snapshot(self):
+		"""
+		Returns:
+			{'histograms': {phase: {'buckets': [[upper bound, cumulative count], ...], 'sum', 'count'}},
+			'counters': {name: value}}, the last bucket's upper bound being None (infinity)
+		"""
+		with self.lock:
+			histograms = dict()
+			for name, (counts, total, count) in self.histograms.items():
+				cumulative, buckets = 0, []
+				for bound, n in zip(self.buckets + (None,), counts):
+					cumulative += n
+					buckets.append([bound, cumulative])
+				histograms[name] = {'buckets': buckets, 'sum': total, 'count': count}
+			return {'histograms': histograms, 'counters': dict(self.counters)}
+
+	def prometheus(self):
+		"""
+		Returns the snapshot in the Prometheus text exposition format
+		"""
+		snapshot = self.snapshot()
+		lines = [
+			f'# HELP {self.prefix}_phase_seconds Duration of every phase of a substitution request',
+			f'# TYPE {self.prefix}_phase_seconds histogram',
+		]
+		for name, histogram in sorted(snapshot['histograms'].items()):
+			for bound, cumulative in histogram['buckets']:
+				le = '+Inf' if bound is None else repr(bound)
+				lines.append(f'{self.prefix}_phase_seconds_bucket{{phase="{name}",le="{le}"}} {cumulative}')
+			lines.append(f'{self.prefix}_phase_seconds_sum{{phase="{name}"}} {histogram["sum"]}')
+			lines.append(f'{self.prefix}_phase_seconds_count{{phase="{name}"}} {histogram["count"]}')
+		for name, value in sorted(snapshot['counters'].items()):
+			lines.append(f'# TYPE {self.prefix}_{name}_total counter')
+			lines.append(f'{self.prefix}_{name}_total {value}')
+		return '\n'.join(lines) + '\n'
+
+
+def memory_usage(pid='self'):
+	"""
+	Returns the memory of a process in MB, read from /proc/{pid}/smaps_rollup (Linux):
+	{'rss', 'pss', 'shared', 'private', 'swap'}, shared being the resident pages other processes
+	map too (e.g. the model pages pre-forked server workers share) and private the ones only
+	this process maps, what every additional worker costs. pss counts every page divided by the
+	number of processes sharing it. None if it can't be read.
+	"""
+	try:
+		with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+			lines = f.readlines()
+	except OSError:
+		return None
+	kb = dict()
+	for line in lines:
+		name, _, value = line.partition(':')
+		value = value.split()
+		if len(value) == 2 and value[1] == 'kB':
+			kb[name] = int(value[0])
+	return {
+		'rss': kb.get('Rss', 0) / 1024,
+		'pss': kb.get('Pss', 0) / 1024,
+		'shared': (kb.get('Shared_Clean', 0) + kb.get('Shared_Dirty', 0)) / 1024,
+		'private': (kb.get('Private_Clean', 0) + kb.get('Private_Dirty', 0)) / 1024,
+		'swap': kb.get('Swap', 0) / 1024,
+	}
@@ -0,0 +1,71 @@
+class PhraseMatcher:
+	"""
+	Token trie over the (lemmatised) ingredient names and their synonyms, matching the
+	longest name at every position of a list of tokens in a single left to right scan
+	"""
+	# key of the trie node entry holding the name a phrase resolves to
+	END = None
+
+	def __init__(self, phrases):
+		"""
+		Parameters:
+			phrases: dict of phrase (tokens joined with '_') -> the name it resolves to
+		"""
+		self.trie = dict()
+		# two word phrases by their reversed tokens, so "oil olive" resolves to olive_oil
+		self.reversed_pairs = dict()
+		for phrase, name in phrases.items():
+			tokens = phrase.split('_')
+			node = self.trie
+			for token in tokens:
+				node = node.setdefault(token, dict())
+			node[self.END] = name
+			if len(tokens) == 2:
+				self.reversed_pairs[(tokens[1], tokens[0])] = name
+
+	@classmethod
+	def from_names(cls, food_names, synonyms):
+		"""
+		Builds the matcher of food_names.json and synonyms.json, a food name taking precedence
+		over a synonym of the same spelling
+		"""
+		phrases = dict(synonyms)
+		phrases.update((name, name) for name in food_names)
+		return cls(phrases)
+
+	def match(self, tokens, keep_unmatched=False):
+		"""
+		Replaces the names in tokens by what they resolve to. At every position the longest
+		name is taken, then a reversed two word name, then a single word name.
+
+		Parameters:
+			tokens: list of lemmatised words
+			keep_unmatched: keep the words that aren't part of a name (otherwise they're dropped)
+
+		Returns:
+			list of names (and unmatched words)
+		"""
+		matched = []
+		i, n = 0, len(tokens)
+		while i < n:
+			node = self.trie.get(tokens[i])
+			single = node.get(self.END) if node is not None else None
+			name, end = None, i
+			j = i + 1
+			while node is not None and j < n:
+				node = node.get(tokens[j])
+				j += 1
+				if node is not None and self.END in node:
+					name, end = node[self.END], j
+			if name is None and i + 1 < n:
+				name = self.reversed_pairs.get((tokens[i], tokens[i + 1]))
+				end = i + 2
+			if name is None:
+				name = single
+				end = i + 1
+				if name is None and keep_unmatched:
+					name = tokens[i]
+			if name is not None:
+				matched.append(name)
+			i = end
+		return matched
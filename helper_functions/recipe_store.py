@@ -0,0 +1,185 @@
+import os
+import numpy as np
+from .artifacts import save_array, load_array, dictionary_hash
+
+
+class RecipeStore:
+	"""
+	Integer-encoded recipes (ingredient ids in CSR layout: the ingredients of recipe i are
+	indices[indptr[i]:indptr[i+1]], in their original order) along with an
+	ingredient -> recipe postings index (the sorted ids of the recipes an ingredient
+	occurs in are postings[postings_indptr[j]:postings_indptr[j+1]])
+	"""
+	def __init__(self, indptr, indices, postings_indptr, postings, names):
+		"""
+		Parameters:
+			indptr, indices: the recipes in CSR layout
+			postings_indptr, postings: the postings index in CSR layout
+			names: the ingredient name of every id
+		"""
+		self.indptr = indptr
+		self.indices = indices
+		self.postings_indptr = postings_indptr
+		self.postings = postings
+		self.names = names
+		self.token2id = {name: i for i, name in enumerate(names)}
+		# the rank of every id when the names are sorted
+		self.name_ranks = np.empty(len(names), dtype=np.int64)
+		self.name_ranks[sorted(range(len(names)), key=names.__getitem__)] = np.arange(len(names))
+
+	def __len__(self):
+		return len(self.indptr) - 1
+
+	@classmethod
+	def build(cls, lines, dictionary):
+		"""
+		Builds the store from recipe strings (lines of recipes_ingredients_only.txt)
+
+		Parameters:
+			lines: iterable of space separated ingredient strings
+			dictionary: gensim Dictionary containing every ingredient in lines
+		"""
+		indptr, indices = cls.encode_lines(lines, dictionary)
+		postings_indptr, postings = cls.build_postings(indptr, indices, len(dictionary))
+		return cls(indptr, indices, postings_indptr, postings, [dictionary[i] for i in range(len(dictionary))])
+
+	@classmethod
+	def from_corpus(cls, corpus):
+		"""
+		Builds the store from the ingredients of a Corpus (its arrays are used as they are)
+		"""
+		postings_indptr, postings = cls.build_postings(corpus.indptr, corpus.indices, corpus.n_ingredients)
+		return cls(corpus.indptr, corpus.indices, postings_indptr, postings, corpus.vocabulary[:corpus.n_ingredients])
+
+	@staticmethod
+	def encode_lines(lines, dictionary):
+		"""
+		Encodes recipe strings as ingredient ids in CSR layout
+
+		Returns:
+			(indptr, indices)
+		"""
+		lengths, indices = [], []
+		for line in lines:
+			ids = [dictionary.token2id[ing] for ing in line.split()]
+			lengths.append(len(ids))
+			indices.append(np.array(ids, dtype=np.int32))
+		indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+		np.cumsum(lengths, out=indptr[1:])
+		indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+		return indptr, indices
+
+	def append(self, lines, dictionary):
+		"""
+		Returns a store with the recipe strings in lines added after the recipes of this one
+		"""
+		new_indptr, new_indices = self.encode_lines(lines, dictionary)
+		indptr = np.concatenate([self.indptr, self.indptr[-1] + new_indptr[1:]])
+		indices = np.concatenate([self.indices, new_indices])
+		postings_indptr, postings = self.build_postings(indptr, indices, len(self.names))
+		return RecipeStore(indptr, indices, postings_indptr, postings, self.names)
+
+	@staticmethod
+	def build_postings(indptr, indices, n_ingredients):
+		"""
+		Builds the ingredient -> recipe postings index of recipes in CSR layout
+		"""
+		recipes = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+		order = np.lexsort((recipes, indices))
+		ings, recipes = indices[order], recipes[order]
+		# drop repeated ingredients within a recipe
+		unique = np.ones(len(ings), dtype=bool)
+		unique[1:] = (ings[1:] != ings[:-1]) | (recipes[1:] != recipes[:-1])
+		postings_indptr = np.zeros(n_ingredients + 1, dtype=np.int64)
+		np.cumsum(np.bincount(ings[unique], minlength=n_ingredients), out=postings_indptr[1:])
+		return postings_indptr, recipes[unique]
+
+	def save(self, path, vocab_hash=None):
+		"""
+		Saves the store into the directory path
+		"""
+		if not os.path.exists(path):
+			os.mkdir(path)
+		save_array(f'{path}/indptr.bin', self.indptr, vocab_hash=vocab_hash)
+		save_array(f'{path}/indices.bin', self.indices, vocab_hash=vocab_hash)
+		save_array(f'{path}/postings_indptr.bin', self.postings_indptr, vocab_hash=vocab_hash)
+		save_array(f'{path}/postings.bin', self.postings, vocab_hash=vocab_hash)
+
+	@classmethod
+	def load(cls, path, dictionary):
+		"""
+		Loads (memory-maps) a store saved with save()
+		"""
+		vocab_hash = dictionary_hash(dictionary)
+		return cls(
+			load_array(f'{path}/indptr.bin', vocab_hash=vocab_hash),
+			load_array(f'{path}/indices.bin', vocab_hash=vocab_hash),
+			load_array(f'{path}/postings_indptr.bin', vocab_hash=vocab_hash),
+			load_array(f'{path}/postings.bin', vocab_hash=vocab_hash),
+			[dictionary[i] for i in range(len(dictionary))]
+		)
+
+	def encode(self, tokens):
+		"""
+		Returns the ids of tokens (-1 for unknown ingredients)
+		"""
+		return np.array([self.token2id.get(token, -1) for token in tokens], dtype=np.int32)
+
+	def recipe(self, index):
+		"""
+		Returns the ingredient ids of a recipe
+		"""
+		return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+	def tokens(self, index):
+		"""
+		Returns the ingredient names of a recipe
+		"""
+		return [self.names[i] for i in self.recipe(index)]
+
+	def ingredients_of(self, recipe_ids):
+		"""
+		Returns the (recipe, ingredient id) pairs of the recipes in recipe_ids, every
+		ingredient of a recipe once
+
+		Returns:
+			(positions of the recipes in recipe_ids, ingredient ids), sorted by position then
+			ingredient name (the order gensim's Dictionary assigns ids in)
+		"""
+		recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+		starts = self.indptr[recipe_ids]
+		lengths = self.indptr[recipe_ids + 1] - starts
+		positions = np.repeat(np.arange(len(recipe_ids)), lengths)
+		# the index of every ingredient in self.indices
+		offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+		ids = self.indices[np.repeat(starts, lengths) + offsets].astype(np.int64)
+		order = np.lexsort((self.name_ranks[ids], positions))
+		positions, ids = positions[order], ids[order]
+		unique = np.ones(len(ids), dtype=bool)
+		unique[1:] = (ids[1:] != ids[:-1]) | (positions[1:] != positions[:-1])
+		return positions[unique], ids[unique]
+
+	def recipes_with(self, ingredient_id):
+		"""
+		Returns the sorted ids of the recipes an ingredient occurs in
+		"""
+		return self.postings[self.postings_indptr[ingredient_id]:self.postings_indptr[ingredient_id + 1]]
+
+	def contains_all(self, recipe_ids, ingredient_ids):
+		"""
+		Returns a mask of the recipes in recipe_ids that contain every ingredient in
+		ingredient_ids (i.e. are a superset of it)
+		"""
+		recipe_ids = np.asarray(recipe_ids)
+		mask = np.ones(len(recipe_ids), dtype=bool)
+		ingredient_ids = np.unique(ingredient_ids)
+		if len(ingredient_ids) and ingredient_ids[0] < 0:
+			# no recipe contains an unknown ingredient
+			return ~mask
+		for ingredient_id in ingredient_ids:
+			postings = self.recipes_with(ingredient_id)
+			if len(postings) == 0:
+				return ~mask
+			pos = np.minimum(np.searchsorted(postings, recipe_ids), len(postings) - 1)
+			mask &= postings[pos] == recipe_ids
+		return mask
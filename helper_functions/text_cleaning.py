@@ -4,16 +4,29 @@ import regex as re
 from nltk.stem import WordNetLemmatizer
 from nltk.corpus import stopwords
 from nltk import download
+from .phrase_matcher import PhraseMatcher
 download('wordnet')
 download('stopwords')
 
+# compiled once rather than on every call
+SEPARATORS = str.maketrans('-,/', '   ')
+# punctuation except parentheses
+INGREDIENT_PUNCTUATION = str.maketrans('', '', string.punctuation.replace('()', ""))
+PUNCTUATION = str.maketrans('', '', string.punctuation)
+PARENTHESISED = re.compile(r'\(.*\)')
+PARENTHESISED_LAZY = re.compile(r'\(.*?\)')
+FRACTIONS = re.compile(r'\d/\d')
+DIGITS = re.compile(r'\d')
+
 
 class TextCleaner:
-	def __init__(self, directory=None):
+	def __init__(self, directory=None, lemma_cache_size=100000):
 		"""
 		Parameters:
 			directory: path to food_names.json and synonyms.json (set to None if
 			you need to use without preloading)
+			lemma_cache_size: number of lemmas kept, the cache being cleared once it's full
+			(the cleaner also cleans client input, so the words it sees aren't bounded)
 		"""
 		if directory:
 			self.directory = directory
@@ -25,8 +38,21 @@ class TextCleaner:
 				self.synonyms = json.load(f)
 
 			self.all_names = set(self.food_names).union(self.synonyms.keys())
+			self.matcher = PhraseMatcher.from_names(self.food_names, self.synonyms)
 
 		self.lemmatizer = WordNetLemmatizer()
+		self.stopwords = set(stopwords.words('english'))
+		# word -> lemma, the lemmatizer is the slowest part of cleaning
+		self.lemmas = dict()
+		self.lemma_cache_size = lemma_cache_size
+
+	def lemmatize(self, word):
+		lemma = self.lemmas.get(word)
+		if lemma is None:
+			if len(self.lemmas) >= self.lemma_cache_size:
+				self.lemmas.clear()
+			lemma = self.lemmas[word] = self.lemmatizer.lemmatize(word)
+		return lemma
 
 	def normalise_ingredient(self, name):
 		if type(name) is not str:
@@ -34,8 +60,8 @@ class TextCleaner:
 		name = name.lower()
 		name = name.replace('-', ' ')
 		# remove parenthesised items
-		name = re.sub(r'\(.*\)', "", name)
-		name = [self.lemmatizer.lemmatize(word) for word in name.split()]
+		name = PARENTHESISED.sub("", name)
+		name = [self.lemmatize(word) for word in name.split()]
 
 		return "_".join(name)
 
@@ -45,114 +71,38 @@ class TextCleaner:
 		return self.synonyms[ing]
 
 	def filter_ingredient(self, ing):
-		ing = ing.lower()
-		ing = ing.replace('-', ' ')
-		ing = ing.replace(',', ' ')
-		ing = ing.replace('/', ' ')
+		ing = ing.lower().translate(SEPARATORS)
 
 		# remove punctuation except parentheses and dashes
-		ing = ing.translate(str.maketrans(
-			'', '', string.punctuation.replace('()', "")))
+		ing = ing.translate(INGREDIENT_PUNCTUATION)
 
 		# remove parenthesised items
-		ing = re.sub(r'\(.*?\)', "", ing)
+		ing = PARENTHESISED_LAZY.sub("", ing)
 
 		# remove fractions
-		ing = re.sub(r'\d/\d', "", ing)
+		ing = FRACTIONS.sub("", ing)
 
 		# remove digits
-		ing = re.sub(r'\d', "", ing)
+		ing = DIGITS.sub("", ing)
 
 		# lemmatize words
-		words = [self.lemmatizer.lemmatize(word) for word in ing.split()]
-
-
-		# the following loop ensures multi-word ingredient names
-		# are included without including the subwords
-		ing = ''
-		i = 0
-		while i < len(words) - 2:
-			if f'{words[i]}_{words[i+1]}_{words[i+2]}' in self.all_names:
-				ing += self.get_name(f'{words[i]}_{words[i+1]}_{words[i+2]}') + ' '
-				i += 2
-			elif f'{words[i]}_{words[i+1]}' in self.all_names:
-				ing += self.get_name(f'{words[i]}_{words[i+1]}') + ' '
-				i += 1
-			elif f'{words[i+1]}_{words[i]}' in self.all_names:
-				ing += self.get_name(f'{words[i+1]}_{words[i]}') + ' '
-				i += 1
-			elif words[i] in self.all_names:
-				ing += self.get_name(words[i]) + " "
-			i += 1
-		# if there are 2 remaining words
-		if i == len(words) - 2:
-			if f'{words[i]}_{words[i+1]}' in self.all_names:
-				ing += self.get_name(f'{words[i]}_{words[i+1]}')
-			elif f'{words[i+1]}_{words[i]}' in self.all_names:
-				ing += self.get_name(f'{words[i+1]}_{words[i]}')
-			else:
-				if words[i] in self.all_names:
-					ing += self.get_name(words[i]) + ' '
-				if words[i+1] in self.all_names:
-					ing += self.get_name(words[i+1])
-
-		# if there's 1 remaining word
-		if i == len(words) - 1:
-			if words[i] in self.all_names:
-				ing += self.get_name(words[i])
-
-		return " ".join(ing.split())
+		words = [self.lemmatize(word) for word in ing.split()]
 
+		# multi-word ingredient names are matched without including the subwords
+		return " ".join(self.matcher.match(words))
 
-	def filter_instruction(self, ins: str):
-		ins = ins.lower()
 
-		ins = ins.replace('-', ' ')
-		ins = ins.replace(',', ' ')
-		ins = ins.replace('/', ' ')
+	def filter_instruction(self, ins: str):
+		ins = ins.lower().translate(SEPARATORS)
 
 		# remove punctuation
-		ins = ins.translate(str.maketrans('', '', string.punctuation))
+		ins = ins.translate(PUNCTUATION)
 
 		# remove digits
-		ins = re.sub(r'\d', "", ins)
+		ins = DIGITS.sub("", ins)
 
 		# lemmatize words and remove stopwords
-		sw = set(stopwords.words('english'))
-		words = [self.lemmatizer.lemmatize(word) for word in ins.split() if word not in sw]
-
-		ins = ''
-		i = 0
-		while i < len(words) - 2:
-			if f'{words[i]}_{words[i+1]}_{words[i+2]}' in self.all_names:
-				ins += self.get_name(f'{words[i]}_{words[i+1]}_{words[i+2]}') + ' '
-				i += 2
-			elif f'{words[i]}_{words[i+1]}' in self.all_names:
-				ins += self.get_name(f'{words[i]}_{words[i+1]}') + ' '
-				i += 1
-			elif f'{words[i+1]}_{words[i]}' in self.all_names:
-				ins += self.get_name(f'{words[i+1]}_{words[i]}') + ' '
-				i += 1
-			elif words[i] in self.all_names:
-				ins += self.get_name(words[i]) + " "
-			else:
-				ins += words[i] + " "
-			i += 1
-
-		# if there are 2 remaining words
-		if i == len(words) - 2:
-			if f'{words[i]}_{words[i+1]}' in self.all_names:
-				ins += self.get_name(f'{words[i]}_{words[i+1]}')
-			elif f'{words[i+1]}_{words[i]}' in self.all_names:
-				ins += self.get_name(f'{words[i+1]}_{words[i]}')
-			elif f'{words[i+1]}_{words[i]}' in self.all_names:
-				ins += self.get_name(f'{words[i+1]}_{words[i]}')
-			else:
-				ins += " ".join(words[-2:])
-
-		# if there's a remaining word
-		if i == len(words) - 1:
-			if words[i] in self.all_names:
-				ins += self.get_name(words[i])
-
-		return " ".join(ins.split())
+		words = [self.lemmatize(word) for word in ins.split() if word not in self.stopwords]
+
+		# normalise the ingredient names, keeping the other words
+		return " ".join(self.matcher.match(words, keep_unmatched=True))
@@ -1,2 +1,2 @@
-from .diish_model import DIISHModel
+from .diish_model import DIISHModel, build_top_candidates, diish_block
 from .ingredient_substitution import IngredientSubstitution
@@ -1,7 +1,59 @@
 # pylint: disable=import-error
 from .ingredient_substitution import IngredientSubstitution
+import os
 import numpy as np
 from gensim.corpora import Dictionary
+from helper_functions import load_array, load_array_or_text, dictionary_hash
+
+
+def build_top_candidates(matrix, k=100, start=0, block_size=1024):
+	"""
+	Builds the top-k candidate table of a DIISH matrix (or of rows start.. of it)
+
+	Every row is sorted by descending score (ties keep the lower id first), the ingredient
+	itself and NaN scores are dropped and the scores are scaled to confidences (/4.5).
+
+	Returns:
+		(ids, confidences): int32 and float32 arrays of shape (len(matrix), k), padded with
+		-1 and NaN for rows with fewer than k valid candidates
+	"""
+	n_rows, n_cols = np.shape(matrix)
+	k = min(k, n_cols - 1)
+	ids = np.full((n_rows, k), -1, dtype=np.int32)
+	confidences = np.full((n_rows, k), np.nan, dtype=np.float32)
+	for block_start in range(0, n_rows, block_size):
+		block = np.array(matrix[block_start:block_start + block_size], dtype=np.float64)
+		rows = np.arange(len(block))
+		block[rows, rows + start + block_start] = np.nan
+		valid = ~np.isnan(block)
+		order = np.argsort(-np.where(valid, block, -np.inf), axis=1, kind='stable')[:, :k]
+		order_valid = valid[rows[:, np.newaxis], order]
+		ids[block_start:block_start + len(block)] = np.where(order_valid, order, -1)
+		confidences[block_start:block_start + len(block)] = np.where(
+			order_valid, block[rows[:, np.newaxis], order] / 4.5, np.nan)
+	return ids, confidences
+
+
+def diish_block(w, s, d, p, rows=slice(None), cols=slice(None)):
+	"""
+	Computes the DIISH scores of the ingredients rows against the ingredients cols as a block,
+	W + S^2 + 0.5 * D^0.25 + 2 * P^0.5, every component being a cosine similarity
+
+	Parameters:
+		w, s: unit length (dense) word2vec and spaCy vectors of every ingredient (zero if missing)
+		d, p: unit length (sparse) co-occurrence and PPMI vectors of every ingredient
+		rows, cols: slices (or index arrays) of the ingredients
+
+	Returns:
+		(len(rows), len(cols)) float64 array
+	"""
+	W = np.asarray(w[rows], dtype=np.float64) @ np.asarray(w[cols], dtype=np.float64).T
+	S = np.asarray(s[rows], dtype=np.float64) @ np.asarray(s[cols], dtype=np.float64).T
+	# D and P are cosines of non-negative vectors, the clip only guards against rounding
+	D = np.clip((d[rows] @ d[cols].T).toarray(), 0, None)
+	P = np.clip((p[rows] @ p[cols].T).toarray(), 0, None)
+	return W + S ** 2 + 0.5 * D ** 0.25 + 2 * P ** 0.5
+
 
 class DIISHModel(IngredientSubstitution):
 	"""
@@ -9,10 +61,36 @@ class DIISHModel(IngredientSubstitution):
 	"""
 	def __init__(self, directory):
 		super().__init__(directory)
-		self.matrix = np.loadtxt(f'{self.directory}/DIISH_matrix.npy')
 		self.dictionary = Dictionary.load_from_text(f'{self.directory}/dictionary.txt')
+		vocab_hash = dictionary_hash(self.dictionary)
+		self.matrix = load_array_or_text(
+			f'{self.directory}/DIISH_matrix.bin',
+			f'{self.directory}/DIISH_matrix.npy',
+			vocab_hash=vocab_hash
+		)
+		self.names = [self.dictionary[i] for i in range(len(self.dictionary))]
+
+		# candidate table generated by generate_DIISH_top_candidates(), rows missing from it
+		# are computed from the matrix on first use and cached
+		self.top_ids, self.top_confidences = None, None
+		if os.path.exists(f'{self.directory}/DIISH_top_candidate_ids.bin'):
+			self.top_ids = load_array(f'{self.directory}/DIISH_top_candidate_ids.bin', vocab_hash=vocab_hash)
+			self.top_confidences = load_array(f'{self.directory}/DIISH_top_candidate_confidences.bin', vocab_hash=vocab_hash)
+		self.cache = dict()
+
+	def get_candidate_ids(self, index, k=10):
+		"""
+		Returns the ids and confidences of the top k candidates of the ingredient with id index
+		"""
+		if self.top_ids is not None and k <= self.top_ids.shape[1]:
+			ids, confidences = self.top_ids[index, :k], self.top_confidences[index, :k]
+		else:
+			if index not in self.cache or self.cache[index][0].shape[1] < k:
+				self.cache[index] = build_top_candidates(self.matrix[index:index + 1], k=max(k, 100), start=index)
+			ids, confidences = self.cache[index][0][0, :k], self.cache[index][1][0, :k]
+		valid = ids >= 0
+		return ids[valid], confidences[valid]
 
 	def get_top_candidates(self, ingredient, k=10):
-		scores = self.matrix[self.dictionary.token2id[ingredient]]
-		scores = [(self.dictionary[i], score/4.5) for i, score in enumerate(scores) if score == score]
-		return sorted(scores, key=lambda x: x[1], reverse=True)[1:k+1]
+		ids, confidences = self.get_candidate_ids(self.dictionary.token2id[ingredient], k)
+		return [(self.names[i], float(confidence)) for i, confidence in zip(ids, confidences)]
@@ -2,3 +2,7 @@ from .tfidf_similarity import TFIDFSimilarity
 from .doc2vec_similarity import Doc2VecSimilarity
 from .knn_vectors_similarity import kNNVectorsSimilarity
 from .recipe_similarity import RecipeSimilarity
+from .ivf_index import IVFIndex
+from .exact_index import ExactCosineIndex
+from .quantized_index import QuantizedIndex
+from .inverted_index import InvertedIndex
@@ -1,18 +1,27 @@
 from .knn_vectors_similarity import kNNVectorsSimilarity
 from vectorizers import Doc2VecVectorizer
-from sklearn.neighbors import NearestNeighbors
-from helper_functions import split_array_ranges, tokenize
-
-import numpy as np
+from helper_functions import load_array_or_text
 
 
 class Doc2VecSimilarity(kNNVectorsSimilarity):
-	def __init__(self, directory):
-		super().__init__(directory)
-		self.vectorizer = Doc2VecVectorizer(f'{self.directory}/doc2vec_ingredients_and_instructions.model')
-		print('Loading vectors... (this might take a while)')
-		self.vectors = np.loadtxt(f'{self.directory}/doc2vec_vectors_ingredients_and_instructions.gz')
-		# self.vectors = self.vectorizer.model.dv.vectors
+	def __init__(self, directory, search='auto', epochs=None, seed=1, cache_size=10000):
+		"""
+		Parameters:
+			epochs, seed, cache_size: how query vectors are inferred (see Doc2VecVectorizer), by
+				default deterministically and with the 10000 most recently used ones cached, so
+				the same recipe always gets the same neighbours
+		"""
+		super().__init__(directory, search=search)
+		self.vectorizer = Doc2VecVectorizer(
+			f'{self.directory}/doc2vec_ingredients_and_instructions.model',
+			epochs=epochs, seed=seed, cache_size=cache_size
+		)
+		print('Loading vectors...')
+		self.vectors = load_array_or_text(
+			f'{self.directory}/doc2vec_vectors_ingredients_and_instructions.bin',
+			f'{self.directory}/doc2vec_vectors_ingredients_and_instructions.gz'
+		)
 		print('Vectors loaded!')
+		self.load_index(f'{self.directory}/doc2vec_ivf_index', f'{self.directory}/doc2vec_{search}_index')
 
 	
\ No newline at end of file
@@ -0,0 +1,83 @@
+from .ivf_index import normalize_rows
+
+import numpy as np
+
+
+class ExactCosineIndex:
+	"""
+	Exact cosine distance kNN over a fixed set of vectors.
+
+	The vectors are normalised once (as float32) when the index is created, so a batch
+	of queries is answered with a matrix multiply per block of block_size vectors and an
+	np.argpartition top-k, keeping only a running (queries, k) list of the best so far.
+	"""
+	def __init__(self, vectors, block_size=65536):
+		"""
+		Parameters:
+			vectors: (n, dim) array (can be a memmap, it's normalised block by block)
+			block_size: number of vectors scored per matrix multiply
+		"""
+		self.block_size = block_size
+		self.vectors = np.empty(np.shape(vectors), dtype=np.float32)
+		for start in range(0, len(vectors), block_size):
+			self.vectors[start:start + block_size] = normalize_rows(vectors[start:start + block_size])
+
+	def __len__(self):
+		return len(self.vectors)
+
+	def search(self, query, k=10):
+		"""
+		Finds the k nearest neighbours of a query vector
+
+		Returns:
+			(ids, cosine distances) sorted by distance
+		"""
+		ids, distances = self.search_batch(np.asarray(query)[np.newaxis], k=k)
+		return ids[0], distances[0]
+
+	def search_batch(self, queries, k=10):
+		"""
+		Finds the k nearest neighbours of every row of queries
+
+		Returns:
+			(ids, cosine distances), both (len(queries), k) and sorted by distance per row
+		"""
+		queries = normalize_rows(queries)
+		ids, sims = block_top_k(
+			lambda start, end: queries @ self.vectors[start:end].T,
+			len(self.vectors), len(queries), k, self.block_size)
+		return ids, 1 - sims
+
+
+def block_top_k(score_block, n, n_queries, k, block_size):
+	"""
+	Finds the k highest scoring of n vectors for every query, block_size vectors at a time,
+	keeping only a running (n_queries, k) list of the best so far
+
+	Parameters:
+		score_block: function of (start, end) returning the (n_queries, end - start) scores
+			of the vectors start to end
+
+	Returns:
+		(ids, scores), both (n_queries, k) and sorted by score (ties broken by the lower id) per row
+	"""
+	k = min(k, n)
+	rows = np.arange(n_queries)[:, np.newaxis]
+
+	best_ids = np.empty((n_queries, 0), dtype=np.int64)
+	best_sims = np.empty((n_queries, 0), dtype=np.float32)
+	for start in range(0, n, block_size):
+		sims = score_block(start, min(start + block_size, n))
+		if k < sims.shape[1]:
+			top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+			sims = sims[rows, top]
+		else:
+			top = np.broadcast_to(np.arange(sims.shape[1]), sims.shape)
+		best_ids = np.concatenate([best_ids, top + start], axis=1)
+		best_sims = np.concatenate([best_sims, sims], axis=1)
+		if best_ids.shape[1] > k:
+			top = np.argpartition(-best_sims, k - 1, axis=1)[:, :k]
+			best_ids, best_sims = best_ids[rows, top], best_sims[rows, top]
+
+	order = np.lexsort((best_ids, -best_sims), axis=1)
+	return best_ids[rows, order], best_sims[rows, order]
@@ -0,0 +1,133 @@
+from helper_functions import save_array, load_array, save_sparse, load_sparse
+
+import os
+import numpy as np
+from scipy import sparse
+
+
+class InvertedIndex:
+	"""
+	Exact cosine distance kNN over sparse, unit length vectors (TF-IDF) through an
+	ingredient -> recipe postings index, so a query only touches the recipes that share an
+	ingredient with it.
+
+	The query's ingredients are processed from the highest possible contribution to the lowest
+	(MaxScore): the postings of every ingredient are added to the candidate scores until the
+	k-th best score exceeds what the remaining ingredients could add up to. The remaining
+	ingredients, usually the most common ones with the longest postings, then only update the
+	candidates left (a binary search per candidate) and candidates that can't reach the top k
+	are dropped.
+	"""
+	def __init__(self, postings, max_weights):
+		"""
+		Parameters:
+			postings: (n_ingredients, n_recipes) CSR matrix, the sorted ids of the recipes
+				ingredient j occurs in are postings.indices[postings.indptr[j]:postings.indptr[j+1]]
+				and the ingredient's weights in them are postings.data[...]
+			max_weights: (n_ingredients,) the highest weight in every posting list
+		"""
+		self.postings = postings
+		self.max_weights = max_weights
+
+	def __len__(self):
+		return self.postings.shape[1]
+
+	@classmethod
+	def build(cls, vectors):
+		"""
+		Builds the index of the rows of a (n_recipes, n_ingredients) sparse matrix
+		"""
+		postings = sparse.csr_matrix(vectors.T, dtype=np.float32)
+		postings.sum_duplicates()
+		postings.sort_indices()
+		max_weights = np.zeros(postings.shape[0], dtype=np.float32)
+		nonempty = np.diff(postings.indptr) > 0
+		if postings.nnz:
+			max_weights[nonempty] = np.maximum.reduceat(postings.data, postings.indptr[:-1][nonempty])
+		return cls(postings, max_weights)
+
+	def save(self, path):
+		"""
+		Saves the index into the directory path
+		"""
+		if not os.path.exists(path):
+			os.mkdir(path)
+		save_array(f'{path}/max_weights.bin', self.max_weights)
+		save_sparse(f'{path}/postings', self.postings)
+
+	@classmethod
+	def load(cls, path):
+		"""
+		Loads (memory-maps) an index saved with save()
+		"""
+		return cls(load_sparse(f'{path}/postings'), load_array(f'{path}/max_weights.bin', mmap=False))
+
+	def search(self, query, k=10):
+		"""
+		Finds the k nearest neighbours of a query vector (dense or a 1 row sparse matrix)
+
+		Returns:
+			(ids, cosine distances) sorted by distance (ties broken by the lower id). Recipes
+			that share no ingredient with the query come last, by id, at distance 1.
+		"""
+		if sparse.issparse(query):
+			query = sparse.csr_matrix(query)
+			terms, weights = query.indices, query.data
+		else:
+			query = np.asarray(query, dtype=np.float32).ravel()
+			terms = np.flatnonzero(query)
+			weights = query[terms]
+		norm = np.linalg.norm(weights)
+		if norm:
+			weights = weights / norm
+		k = min(k, len(self))
+
+		bounds = weights * self.max_weights[terms]
+		order = np.argsort(-bounds, kind='stable')
+		remaining = float(bounds.sum())
+		ids = np.zeros(0, dtype=np.int64)
+		scores = np.zeros(0, dtype=np.float32)
+		collecting = True
+		indptr, indices, data = self.postings.indptr, self.postings.indices, self.postings.data
+		for t in order:
+			# (rounding can take it just below 0, which would drop the k-th candidate)
+			remaining = max(remaining - float(bounds[t]), 0.0)
+			start, end = indptr[terms[t]], indptr[terms[t] + 1]
+			if collecting:
+				merged = np.concatenate([ids, indices[start:end]])
+				ids, inverse = np.unique(merged, return_inverse=True)
+				scores = np.bincount(inverse, weights=np.concatenate([scores, weights[t] * data[start:end]]),
+					minlength=len(ids)).astype(np.float32)
+			elif len(ids):
+				posting = indices[start:end]
+				positions = np.minimum(np.searchsorted(posting, ids), max(len(posting) - 1, 0))
+				found = posting[positions] == ids if len(posting) else np.zeros(len(ids), dtype=bool)
+				scores[found] += weights[t] * data[start:end][positions[found]]
+
+			if len(ids) >= k > 0:
+				threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+				# recipes that haven't been seen yet can't score more than remaining
+				if threshold > remaining:
+					collecting = False
+				if not collecting:
+					keep = scores + remaining >= threshold
+					ids, scores = ids[keep], scores[keep]
+
+		top = np.lexsort((ids, -scores))[:k]
+		ids, distances = ids[top], 1 - scores[top]
+		if len(ids) < k:
+			# pad with the recipes that share nothing with the query, like exact search would
+			rest = np.setdiff1d(np.arange(k + len(ids)), ids)[:k - len(ids)]
+			ids = np.concatenate([ids, rest])
+			distances = np.concatenate([distances, np.ones(len(rest), dtype=distances.dtype)])
+		return ids, distances
+
+	def search_batch(self, queries, k=10):
+		"""
+		Finds the k nearest neighbours of every row of queries
+
+		Returns:
+			(ids, cosine distances) lists with one array per query
+		"""
+		results = [self.search(queries[i], k=k) for i in range(queries.shape[0])]
+		return [ids for ids, _ in results], [distances for _, distances in results]
@@ -0,0 +1,171 @@
+from helper_functions import save_array, load_array, read_header
+from sklearn.cluster import MiniBatchKMeans
+
+import os
+import numpy as np
+
+
+def normalize_rows(vectors):
+	"""
+	Returns the rows of vectors scaled to unit length as float32 (all-zero rows stay zero)
+	"""
+	vectors = np.asarray(vectors, dtype=np.float32)
+	norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+	return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms != 0)
+
+
+class IVFIndex:
+	"""
+	Inverted file (IVF) approximate nearest neighbour index over cosine distance.
+
+	The vectors are clustered with k-means into n_lists lists, stored contiguously per list.
+	A query is only compared against the vectors of the n_probe lists whose centroids are
+	closest to it, so n_probe is the recall/latency knob (n_probe = n_lists is exact).
+	"""
+	def __init__(self, centroids, offsets, ids, vectors, n_probe=8):
+		"""
+		Parameters:
+			centroids: (n_lists, dim) unit length list centroids
+			offsets: (n_lists + 1,) start of every list in ids/vectors
+			ids: the original row index of every stored vector
+			vectors: the unit length vectors, ordered by list
+			n_probe: default number of lists scanned per query
+		"""
+		self.centroids = centroids
+		self.offsets = offsets
+		self.ids = ids
+		self.vectors = vectors
+		self.n_probe = n_probe
+
+	def __len__(self):
+		return len(self.ids)
+
+	@property
+	def n_lists(self):
+		return len(self.centroids)
+
+	@classmethod
+	def build(cls, vectors, n_lists=None, n_probe=8, sample_size=100000, chunk_size=100000, seed=1):
+		"""
+		Builds an index over the rows of vectors
+
+		Parameters:
+			vectors: (n, dim) array (can be a memmap, it's read in chunks)
+			n_lists: number of k-means lists (default is 4 * sqrt(n))
+			sample_size: number of vectors k-means is trained on
+			chunk_size: number of vectors assigned to lists at a time
+		"""
+		n = len(vectors)
+		if n_lists is None:
+			n_lists = int(4 * np.sqrt(n))
+		n_lists = max(1, min(n_lists, n))
+
+		rng = np.random.default_rng(seed)
+		sample = np.sort(rng.choice(n, size=min(n, max(sample_size, n_lists)), replace=False))
+		kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=seed, n_init=3,
+			batch_size=max(1024, 4 * n_lists)).fit(normalize_rows(vectors[sample]))
+		centroids = normalize_rows(kmeans.cluster_centers_)
+
+		assignments = np.empty(n, dtype=np.int32)
+		for start in range(0, n, chunk_size):
+			chunk = normalize_rows(vectors[start:start + chunk_size])
+			assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+
+		ids = np.argsort(assignments, kind='stable').astype(np.int32)
+		offsets = np.zeros(n_lists + 1, dtype=np.int64)
+		np.cumsum(np.bincount(assignments, minlength=n_lists), out=offsets[1:])
+
+		ordered = np.empty((n, vectors.shape[1]), dtype=np.float32)
+		for start in range(0, n, chunk_size):
+			ordered[start:start + chunk_size] = normalize_rows(vectors[ids[start:start + chunk_size]])
+		return cls(centroids, offsets, ids, ordered, n_probe=n_probe)
+
+	def add(self, vectors, ids):
+		"""
+		Adds vectors to the lists of their closest centroids (the centroids are kept as they
+		are, rebuild the index once the vectors drift away from them)
+
+		Parameters:
+			vectors: (n, dim) array
+			ids: the row index of every vector
+		"""
+		if len(vectors) == 0:
+			return self
+		vectors = normalize_rows(vectors)
+		assignments = np.concatenate([
+			np.repeat(np.arange(self.n_lists, dtype=np.int32), np.diff(self.offsets)),
+			np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+		])
+		# the new vectors go at the end of their lists
+		order = np.argsort(assignments, kind='stable')
+		self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=self.ids.dtype)])[order]
+		self.vectors = np.concatenate([self.vectors, vectors])[order]
+		self.offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+		np.cumsum(np.bincount(assignments, minlength=self.n_lists), out=self.offsets[1:])
+		return self
+
+	def save(self, path):
+		"""
+		Saves the index into the directory path
+		"""
+		if not os.path.exists(path):
+			os.mkdir(path)
+		save_array(f'{path}/centroids.bin', self.centroids, n_probe=self.n_probe)
+		save_array(f'{path}/offsets.bin', self.offsets)
+		save_array(f'{path}/ids.bin', self.ids)
+		save_array(f'{path}/vectors.bin', self.vectors)
+
+	@classmethod
+	def load(cls, path, n_probe=None):
+		"""
+		Loads (memory-maps) an index saved with save()
+		"""
+		centroids = load_array(f'{path}/centroids.bin', mmap=False)
+		offsets = load_array(f'{path}/offsets.bin', mmap=False)
+		ids = load_array(f'{path}/ids.bin')
+		vectors = load_array(f'{path}/vectors.bin')
+		if n_probe is None:
+			n_probe = read_header(f'{path}/centroids.bin')[0].get('n_probe', 8)
+		return cls(centroids, offsets, ids, vectors, n_probe=n_probe)
+
+	def search(self, query, k=10, n_probe=None):
+		"""
+		Finds the (approximate) k nearest neighbours of a query vector
+
+		Returns:
+			(ids, cosine distances) sorted by distance
+		"""
+		n_probe = min(n_probe or self.n_probe, self.n_lists)
+		query = normalize_rows(query)
+
+		centroid_sims = self.centroids @ query
+		lists = np.argpartition(-centroid_sims, n_probe - 1)[:n_probe] if n_probe < self.n_lists else range(self.n_lists)
+
+		candidate_ids, candidate_sims = [], []
+		for l in lists:
+			start, end = self.offsets[l], self.offsets[l + 1]
+			if start == end:
+				continue
+			candidate_ids.append(self.ids[start:end])
+			candidate_sims.append(self.vectors[start:end] @ query)
+		if not candidate_ids:
+			return np.array([], dtype=np.int32), np.array([], dtype=np.float32)
+		candidate_ids = np.concatenate(candidate_ids)
+		candidate_sims = np.concatenate(candidate_sims)
+
+		if k < len(candidate_sims):
+			top = np.argpartition(-candidate_sims, k - 1)[:k]
+		else:
+			top = np.arange(len(candidate_sims))
+		top = top[np.argsort(-candidate_sims[top], kind='stable')]
+		return candidate_ids[top], 1 - candidate_sims[top]
+
+	def search_batch(self, queries, k=10, n_probe=None):
+		"""
+		Finds the (approximate) k nearest neighbours of every row of queries
+
+		Returns:
+			(ids, cosine distances) lists with one array per query
+		"""
+		results = [self.search(query, k=k, n_probe=n_probe) for query in queries]
+		return [ids for ids, _ in results], [distances for _, distances in results]
@@ -1,8 +1,11 @@
 from .recipe_similarity import RecipeSimilarity
-from vectorizers import Doc2VecVectorizer
-from helper_functions import split_array_ranges, tokenize
+from .ivf_index import IVFIndex
+from .exact_index import ExactCosineIndex
+from .quantized_index import QuantizedIndex
+from helper_functions import split_array_ranges
 from sklearn.neighbors import NearestNeighbors
 
+import os
 import numpy as np
 
 
@@ -10,14 +13,64 @@ class kNNVectorsSimilarity(RecipeSimilarity):
 	"""
 	Interface for vector-based, kNN recipe similarity implementations
 	"""
-	def __init__(self, directory):
+	def __init__(self, directory, search='auto'):
+		"""
+		Parameters:
+			directory (str): the path to the model files
+			search (str): how the vectors are searched
+				'ann': the approximate nearest neighbour index built by generate_ann_index()
+					(opt-in: its recall depends on n_probe, see generate_ann_index())
+				'exact': exact search over the vectors, normalised once at load time
+				'float16', 'int8': search over compressed codes of the vectors re-ranked against
+					the (memory-mapped) vectors (see QuantizedIndex), the codes generated by
+					generate_quantized_index() or, failing that, quantized at load time
+				'brute': brute force sklearn kNN over n_clusters chunks of the vectors
+				'auto': 'exact' (default)
+		"""
 		super().__init__(directory)
 		self.vectorizer = None
 		self.vectors = []
+		self.search = search
+		self.index = None
 
-	def get_most_similar(self, recipe: [str], k = 10, n_clusters = 10):
+	def load_index(self, path, quantized_path=None):
+		"""
+		Sets up the index the search mode calls for (must be called after the vectors are loaded)
+
+		Parameters:
+			path: the ANN index directory
+			quantized_path: the quantized index directory of the search mode's codec
+		"""
+		if self.search in QuantizedIndex.CODECS:
+			if quantized_path is not None and os.path.exists(quantized_path):
+				self.index = QuantizedIndex.load(quantized_path, self.vectors)
+			else:
+				print('Quantizing vectors...')
+				self.index = QuantizedIndex.build(self.vectors, codec=self.search)
+		elif self.search == 'ann':
+			try:
+				self.index = IVFIndex.load(path)
+			except FileNotFoundError:
+				raise FileNotFoundError(f'{path} not found, build it with generate_ann_index()')
+		elif self.search in ('exact', 'auto'):
+			print('Normalising vectors...')
+			self.index = ExactCosineIndex(self.vectors)
+
+	def vectorize(self, recipes: [[str]]):
+		"""
+		Returns the query vectors of recipes, one row per recipe, in the layout the index searches
+		"""
+		return np.array(list(self.vectorizer.transform(recipes)))
+
+	def get_most_similar(self, recipe: [str], k = 10, n_clusters = 10, n_probe = None):
 		# get vector of recipe
-		docvec = next(self.vectorizer.transform([recipe]))
+		docvec = self.vectorize([recipe])[0]
+
+		if self.index is not None:
+			# n_probe only applies to the ANN index
+			kwargs = {} if n_probe is None else {'n_probe': n_probe}
+			indicies, distances = self.index.search(docvec, k=k, **kwargs)
+			return list(zip(indicies, distances))
 
 		# cut data to n_clusters number of clusters
 		similar_recipes = []
@@ -31,4 +84,20 @@ class kNNVectorsSimilarity(RecipeSimilarity):
 				similar_recipes.append(x)
 		return sorted(similar_recipes, key=lambda x: x[1])[:k]
 
+	def get_most_similar_batch(self, recipes: [[str]], k = 10):
+		"""
+		Finds the k most similar recipes of every recipe in recipes, vectorising and
+		searching them together
+
+		Returns:
+			a list of get_most_similar(recipe, k) results
+		"""
+		if self.index is None:
+			return super().get_most_similar_batch(recipes, k=k)
+		if not recipes:
+			return []
+		docvecs = self.vectorize(recipes)
+		indicies, distances = self.index.search_batch(docvecs, k=k)
+		return [list(zip(i, d)) for i, d in zip(indicies, distances)]
+
 	
\ No newline at end of file
@@ -0,0 +1,150 @@
+from .ivf_index import normalize_rows
+from .exact_index import block_top_k
+from helper_functions import save_array, load_array, read_header
+
+import os
+import numpy as np
+
+
+class QuantizedIndex:
+	"""
+	Cosine distance kNN over compressed copies of the vectors, re-ranked against the exact ones.
+
+	The unit length vectors are stored as float16 (half the size of float32) or int8 codes
+	(a quarter), quantized per dimension between the dimension's min and max. A query is
+	scored against the codes to get a short list of the rerank * k best vectors, which are
+	then read from the exact vectors (usually a memmap, so only the short list is paged in)
+	and re-scored, so the returned distances are exact.
+	"""
+	CODECS = ('float16', 'int8')
+
+	def __init__(self, codes, vectors, scale=None, offset=None, rerank=4, block_size=16384):
+		"""
+		Parameters:
+			codes: (n, dim) float16 or int8 codes of the unit length vectors
+			vectors: the exact (n, dim) vectors, not necessarily normalised
+			scale, offset: (dim,) int8 quantization parameters, a component is
+				offset + scale * (code + 128)
+			rerank: number of candidates re-ranked per returned neighbour
+			block_size: number of codes scored per matrix multiply
+		"""
+		self.codes = codes
+		self.vectors = vectors
+		self.scale = scale
+		self.offset = offset
+		self.rerank = rerank
+		self.block_size = block_size
+
+	def __len__(self):
+		return len(self.codes)
+
+	@property
+	def codec(self):
+		return 'int8' if self.codes.dtype == np.int8 else 'float16'
+
+	@classmethod
+	def build(cls, vectors, codec='int8', rerank=4, chunk_size=65536):
+		"""
+		Quantizes the rows of vectors (can be a memmap, it's read in chunks)
+		"""
+		if codec not in cls.CODECS:
+			raise ValueError(f'Unknown codec {codec}, expected one of {", ".join(cls.CODECS)}')
+		n, dim = vectors.shape
+		if codec == 'float16':
+			codes = np.empty((n, dim), dtype=np.float16)
+			for start in range(0, n, chunk_size):
+				codes[start:start + chunk_size] = normalize_rows(vectors[start:start + chunk_size])
+			return cls(codes, vectors, rerank=rerank)
+
+		low, high = np.full(dim, np.inf, dtype=np.float32), np.full(dim, -np.inf, dtype=np.float32)
+		for start in range(0, n, chunk_size):
+			chunk = normalize_rows(vectors[start:start + chunk_size])
+			low, high = np.minimum(low, chunk.min(axis=0)), np.maximum(high, chunk.max(axis=0))
+		scale = np.where(high > low, (high - low) / 255, 1).astype(np.float32)
+		codes = np.empty((n, dim), dtype=np.int8)
+		for start in range(0, n, chunk_size):
+			chunk = normalize_rows(vectors[start:start + chunk_size])
+			codes[start:start + chunk_size] = np.clip(np.rint((chunk - low) / scale), 0, 255) - 128
+		return cls(codes, vectors, scale=scale, offset=low, rerank=rerank)
+
+	def save(self, path):
+		"""
+		Saves the codes into the directory path (the exact vectors are saved elsewhere)
+		"""
+		if not os.path.exists(path):
+			os.mkdir(path)
+		save_array(f'{path}/codes.bin', self.codes, rerank=self.rerank)
+		if self.scale is not None:
+			save_array(f'{path}/scale.bin', self.scale)
+			save_array(f'{path}/offset.bin', self.offset)
+
+	@classmethod
+	def load(cls, path, vectors, rerank=None):
+		"""
+		Loads (memory-maps) an index saved with save()
+
+		Parameters:
+			vectors: the exact vectors the index was built from
+		"""
+		codes = load_array(f'{path}/codes.bin')
+		if len(codes) != len(vectors):
+			raise ValueError(f'{path} has {len(codes)} vectors but there are {len(vectors)}, rebuild it')
+		scale, offset = None, None
+		if codes.dtype == np.int8:
+			scale = load_array(f'{path}/scale.bin', mmap=False)
+			offset = load_array(f'{path}/offset.bin', mmap=False)
+		if rerank is None:
+			rerank = read_header(f'{path}/codes.bin')[0].get('rerank', 4)
+		return cls(codes, vectors, scale=scale, offset=offset, rerank=rerank)
+
+	def search(self, query, k=10, rerank=None):
+		"""
+		Finds the (approximate) k nearest neighbours of a query vector
+
+		Returns:
+			(ids, cosine distances) sorted by distance
+		"""
+		ids, distances = self.search_batch(np.asarray(query)[np.newaxis], k=k, rerank=rerank)
+		return ids[0], distances[0]
+
+	def search_batch(self, queries, k=10, rerank=None):
+		"""
+		Finds the (approximate) k nearest neighbours of every row of queries
+
+		Returns:
+			(ids, cosine distances), both (len(queries), k) and sorted by distance per row
+		"""
+		queries = normalize_rows(queries)
+		k = min(k, len(self.codes))
+		if self.scale is not None:
+			# the offset and the +128 add the same amount to every vector's score
+			queries_scaled = queries * self.scale
+			score_block = lambda start, end: queries_scaled @ self.codes[start:end].T.astype(np.float32)
+		else:
+			score_block = lambda start, end: queries @ self.codes[start:end].T.astype(np.float32)
+		candidates, _ = block_top_k(score_block, len(self.codes), len(queries), k * (rerank or self.rerank), self.block_size)
+
+		# read every candidate once, in order
+		unique, inverse = np.unique(candidates, return_inverse=True)
+		sims = (queries @ normalize_rows(self.vectors[unique]).T)[np.arange(len(queries))[:, np.newaxis], inverse.reshape(candidates.shape)]
+		rows = np.arange(len(queries))[:, np.newaxis]
+		order = np.lexsort((candidates, -sims), axis=1)[:, :k]
+		return candidates[rows, order], 1 - sims[rows, order]
+
+	def exact_search_batch(self, queries, k=10):
+		"""
+		Exact search over the exact vectors, block by block (used to measure recall)
+		"""
+		queries = normalize_rows(queries)
+		ids, sims = block_top_k(
+			lambda start, end: queries @ normalize_rows(self.vectors[start:end]).T,
+			len(self.vectors), len(queries), k, self.block_size)
+		return ids, 1 - sims
+
+	def recall(self, queries, k=10, rerank=None):
+		"""
+		Returns the fraction of the exact k nearest neighbours of queries that search_batch() finds
+		"""
+		exact, _ = self.exact_search_batch(queries, k=k)
+		found, _ = self.search_batch(queries, k=k, rerank=rerank)
+		return sum(len(set(e).intersection(f)) for e, f in zip(exact, found)) / exact.size
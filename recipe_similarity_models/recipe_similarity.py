@@ -6,4 +6,10 @@ class RecipeSimilarity:
 		self.directory = directory
 
 	def get_most_similar(self, recipe: [str], k = 10, n_clusters = 10):
-		raise NotImplementedError('get_most_similar is not implemented')
\ No newline at end of file
+		raise NotImplementedError('get_most_similar is not implemented')
+
+	def get_most_similar_batch(self, recipes: [[str]], k = 10):
+		"""
+		Returns get_most_similar(recipe, k) for every recipe in recipes
+		"""
+		return [self.get_most_similar(recipe, k=k) for recipe in recipes]
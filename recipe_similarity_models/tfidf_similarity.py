@@ -1,21 +1,55 @@
 from .knn_vectors_similarity import kNNVectorsSimilarity
+from .inverted_index import InvertedIndex
 from vectorizers import TFIDFVectorizer
-from sklearn.neighbors import NearestNeighbors
-from helper_functions import split_array_ranges, tokenize
+from helper_functions import load_array_or_text, load_sparse, dictionary_hash
 
+import os
 import numpy as np
+from scipy import sparse
 
 
 class TFIDFSimilarity(kNNVectorsSimilarity):
-	def __init__(self, directory):
-		super().__init__(directory)
+	def __init__(self, directory, search='auto'):
+		"""
+		Parameters:
+			search (str): 'inverted' searches the sparse vectors through the ingredient -> recipe
+				postings index generated by generate_tfidf_recipe_similarity_model_and_vectors()
+				(built at load time if it hasn't been, see InvertedIndex), 'auto' is 'inverted'.
+				The other modes (see kNNVectorsSimilarity) search dense copies of the vectors
+		"""
+		super().__init__(directory, search=search)
 		self.vectorizer = TFIDFVectorizer(
 			model_path=f'{self.directory}/tfidf_model_ingredients_only',
 			dict_path=f'{self.directory}/dictionary.txt'
 		)
-		print('Loading vectors... (this might take a while)')
-		self.vectors = np.loadtxt(f'{self.directory}/tfidf_vectors_ingredients_only.gz')
+		print('Loading vectors...')
+		vocab_hash = dictionary_hash(self.vectorizer.id2word)
+		if os.path.exists(f'{self.directory}/tfidf_vectors_ingredients_only.csr'):
+			self.vectors = load_sparse(f'{self.directory}/tfidf_vectors_ingredients_only.csr', vocab_hash=vocab_hash)
+		else:
+			# legacy: dense vectors of builds made before they were stored as CSR
+			self.vectors = sparse.csr_matrix(load_array_or_text(
+				f'{self.directory}/tfidf_vectors_ingredients_only.bin',
+				f'{self.directory}/tfidf_vectors_ingredients_only.gz',
+				vocab_hash=vocab_hash
+			), dtype=np.float32)
 		print('Vectors loaded!')
+		if search in ('auto', 'inverted'):
+			self.search = 'inverted'
+			if os.path.exists(f'{self.directory}/tfidf_inverted_index'):
+				self.index = InvertedIndex.load(f'{self.directory}/tfidf_inverted_index')
+			else:
+				print('Building inverted index...')
+				self.index = InvertedIndex.build(self.vectors)
+		else:
+			self.vectors = self.vectors.toarray()
+			self.load_index(f'{self.directory}/tfidf_ivf_index', f'{self.directory}/tfidf_{search}_index')
 
-
-	
\ No newline at end of file
+	def vectorize(self, recipes: [[str]]):
+		"""
+		Returns the TF-IDF vectors of recipes, as a CSR matrix for the inverted index (a recipe
+		only has a handful of ingredients) and dense for the other search modes
+		"""
+		if self.search == 'inverted':
+			return self.vectorizer.transform_sparse(recipes)
+		return super().vectorize(recipes)
@@ -0,0 +1,23 @@
+import sys
+import time
+from helper_functions import TextCleaner, KB_URL, refresh_ghg_snapshot
+
+
+def main(argv):
+	"""
+	Fetches the ghg value of every ingredient from the KB and saves them to ghg_snapshot.json.
+	Pass in the directory (default is "build") and, optionally, the URL of the KB
+	(e.g. a local stand-in for it).
+	"""
+	directory = argv[0] if argv else 'build'
+	base_url = argv[1] if len(argv) > 1 else KB_URL
+
+	cleaner = TextCleaner(directory)
+	print(f'Fetching ghg values from {base_url}...')
+	start = time.perf_counter()
+	ghg = refresh_ghg_snapshot(f'{directory}/ghg_snapshot.json', cleaner, base_url=base_url)
+	print(f'{len(ghg)} ghg values saved to {directory}/ghg_snapshot.json ({time.perf_counter() - start:.1f}s)')
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
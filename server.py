@@ -0,0 +1,299 @@
+import sys
+import os
+import gc
+import json
+import time
+import math
+import signal
+import socket
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from substitution import Substitution
+from helper_functions import Metrics, memory_usage
+
+
+class MicroBatcher:
+	"""
+	Coalesces the calls that arrive within window seconds of each other (up to max_batch_size
+	of them) into one call of batch_fn, run in an executor so the event loop never blocks
+	"""
+	def __init__(self, batch_fn, executor, window=0.005, max_batch_size=64):
+		"""
+		Parameters:
+			batch_fn: function of (key, list of items) returning the list of their results,
+				only items with the same key are batched together
+			executor: the executor batch_fn runs in
+		"""
+		self.batch_fn = batch_fn
+		self.executor = executor
+		self.window = window
+		self.max_batch_size = max_batch_size
+		self.pending = dict()
+
+	async def submit(self, key, item):
+		"""
+		Queues item and returns its result once its batch has run
+		"""
+		future = asyncio.get_running_loop().create_future()
+		if key not in self.pending:
+			self.pending[key] = []
+			asyncio.get_running_loop().call_later(self.window, self.flush, key)
+		self.pending[key].append((item, future))
+		if len(self.pending[key]) >= self.max_batch_size:
+			self.flush(key)
+		return await future
+
+	def flush(self, key):
+		batch = self.pending.pop(key, None)
+		if batch:
+			asyncio.ensure_future(self.run(key, batch))
+
+	async def run(self, key, batch):
+		loop = asyncio.get_running_loop()
+		items = [item for item, _ in batch]
+		try:
+			results = await loop.run_in_executor(self.executor, self.batch_fn, key, items)
+		except Exception as e:
+			if len(batch) == 1:
+				batch[0][1].set_exception(e)
+				return
+			# run the items one by one so one bad item doesn't fail the others
+			for item, future in batch:
+				await self.run(key, [(item, future)])
+			return
+		for (_, future), result in zip(batch, results):
+			if not future.done():
+				future.set_result(result)
+
+
+class SubstitutionServer:
+	"""
+	JSON over HTTP front-end of a Substitution instance, loaded once and shared by every client
+
+	Endpoints:
+		POST /substitutions: {"ingredients": [[name, is_high_carbon], ...], "instructions": [...],
+			"k_similar_recipes", "k_top_candidates", "important_threshold", "total_ghg"}
+			(everything but ingredients is optional) -> get_substitutions() result
+		POST /substitutions/is_model_only: {"ingredients", "k_top_candidates", "total_ghg"}
+			-> get_substitutions_is_model_only() result
+		GET /health: {"status": "ok", "requests": ..., "batches": ..., "load_times": ..., "pid": ...,
+			"memory": memory_usage() of the process}
+		GET /metrics: the latency histogram of every phase of a request and the counters of
+			substitution.metrics, in the Prometheus text format (empty if it's disabled), followed
+			by the memory of the process
+	"""
+	def __init__(self, substitution: Substitution, window=0.005, max_batch_size=64):
+		self.substitution = substitution
+		# a single thread, so the models are never used concurrently
+		self.executor = ThreadPoolExecutor(max_workers=1)
+		self.batcher = MicroBatcher(self.run_batch, self.executor, window=window, max_batch_size=max_batch_size)
+		self.n_requests, self.n_batches = 0, 0
+
+	def run_batch(self, key, items):
+		self.n_batches += 1
+		endpoint, params = key[0], dict(key[1:])
+		if endpoint == 'is_model_only':
+			return [
+				self.substitution.get_substitutions_is_model_only(ingredients, total_ghg=total_ghg, **params)
+				for ingredients, _, total_ghg in items
+			]
+		return self.substitution.get_substitutions_batch(
+			[ingredients for ingredients, _, _ in items],
+			instructions=[instructions for _, instructions, _ in items],
+			total_ghgs=[total_ghg for _, _, total_ghg in items],
+			**params)
+
+	async def handle(self, method, path, body):
+		"""
+		Returns (status, response dict, or str for plain text) of a request
+		"""
+		if method == 'GET' and path == '/health':
+			return 200, {'status': 'ok', 'requests': self.n_requests, 'batches': self.n_batches,
+				'load_times': self.substitution.load_report(), 'pid': os.getpid(), 'memory': memory_usage()}
+		if method == 'GET' and path == '/metrics':
+			lines = []
+			memory = memory_usage()
+			if memory is not None:
+				lines.append('# TYPE process_memory_bytes gauge')
+				for kind, mb in memory.items():
+					lines.append(f'process_memory_bytes{{kind="{kind}"}} {int(mb * 1024 * 1024)}')
+			return 200, self.substitution.metrics.prometheus() + ''.join(line + '\n' for line in lines)
+		if method != 'POST' or path not in ('/substitutions', '/substitutions/is_model_only'):
+			return 404, {'error': f'{method} {path} not found'}
+		try:
+			request = json.loads(body or b'{}')
+			ingredients = [(str(ing), bool(hc)) for ing, hc in request['ingredients']]
+			instructions = [str(inst) for inst in request.get('instructions', [])]
+			total_ghg = float(request.get('total_ghg', -1))
+			if not math.isfinite(total_ghg):
+				raise ValueError(f'total_ghg must be finite, got {total_ghg}')
+			if path == '/substitutions':
+				key = ('substitutions',
+					('k_similar_recipes', int(request.get('k_similar_recipes', 100))),
+					('k_top_candidates', int(request.get('k_top_candidates', 5))),
+					('important_threshold', float(request.get('important_threshold', 0.8))))
+			else:
+				key = ('is_model_only', ('k_top_candidates', int(request.get('k_top_candidates', 5))))
+		except (ValueError, KeyError, TypeError) as e:
+			return 400, {'error': f'invalid request: {e!r}'}
+		self.n_requests += 1
+		try:
+			return 200, await self.batcher.submit(key, (ingredients, instructions, total_ghg))
+		except KeyError as e:
+			# unknown ingredient
+			return 400, {'error': f'unknown ingredient {e}'}
+		except Exception as e:
+			return 500, {'error': repr(e)}
+
+	async def serve_client(self, reader, writer):
+		try:
+			while True:
+				request_line = await reader.readline()
+				if not request_line:
+					break
+				method, path, _ = request_line.decode('latin-1').split(' ', 2)
+				headers = dict()
+				while True:
+					line = await reader.readline()
+					if line in (b'\r\n', b'\n', b''):
+						break
+					name, _, value = line.decode('latin-1').partition(':')
+					headers[name.strip().lower()] = value.strip()
+				keep_alive = headers.get('connection', '').lower() != 'close'
+				length = headers.get('content-length', '0')
+				if length.isascii() and length.isdigit():
+					body = await reader.readexactly(int(length))
+					status, response = await self.handle(method, path, body)
+				else:
+					# the end of the body is unknown, so the connection can't be reused
+					status, response = 400, {'error': f'invalid Content-Length: {length!r}'}
+					keep_alive = False
+				if isinstance(response, str):
+					payload, content_type = response.encode('utf-8'), 'text/plain; version=0.0.4'
+				else:
+					payload, content_type = json.dumps(response, default=float).encode('utf-8'), 'application/json'
+				writer.write(
+					f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+					f'Content-Type: {content_type}\r\n'
+					f'Content-Length: {len(payload)}\r\n'
+					f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + payload)
+				await writer.drain()
+				if not keep_alive:
+					break
+		except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	async def serve(self, host='127.0.0.1', port=8000, sock=None):
+		"""
+		Serves on host:port, or on the listening socket sock if given
+		"""
+		if sock is not None:
+			server = await asyncio.start_server(self.serve_client, sock=sock)
+		else:
+			server = await asyncio.start_server(self.serve_client, host, port)
+			print(f'Serving on http://{host}:{port}')
+		async with server:
+			await server.serve_forever()
+
+
+def serve_prefork(substitution: Substitution, n_workers, host='127.0.0.1', port=8000, report_interval=60):
+	"""
+	Loads every component of substitution, then forks n_workers processes that serve the same
+	socket (Linux/macOS only). The models are loaded (and the binary artifacts memory-mapped)
+	once, before forking, so the workers share their pages rather than each holding a copy: a
+	page only becomes private to a worker when it writes to it.
+
+	Every report_interval seconds (never if 0) the private and shared memory of every worker is
+	printed (see memory_usage()), the private memory being what every additional worker costs.
+	"""
+	substitution.load()
+	# the garbage collector would otherwise write to (and so copy) every object loaded so far
+	gc.collect()
+	gc.freeze()
+	sock = socket.create_server((host, port))
+	print(f'Serving on http://{host}:{port} with {n_workers} workers')
+
+	pids = []
+	for _ in range(n_workers):
+		pid = os.fork()
+		if pid == 0:
+			try:
+				asyncio.run(SubstitutionServer(substitution).serve(sock=sock))
+			except KeyboardInterrupt:
+				pass
+			finally:
+				os._exit(0)
+		pids.append(pid)
+
+	next_report = time.monotonic() + report_interval
+	try:
+		while pids:
+			pid, _ = os.waitpid(-1, os.WNOHANG)
+			if pid:
+				print(f'Worker {pid} exited')
+				pids.remove(pid)
+				continue
+			time.sleep(0.5)
+			if report_interval and time.monotonic() >= next_report:
+				print(memory_report(pids))
+				next_report = time.monotonic() + report_interval
+	except KeyboardInterrupt:
+		pass
+	finally:
+		for pid in pids:
+			try:
+				os.kill(pid, signal.SIGTERM)
+				os.waitpid(pid, 0)
+			except (ProcessLookupError, ChildProcessError):
+				pass
+		sock.close()
+
+
+def memory_report(pids):
+	"""
+	Returns a table of the memory (in MB) of the processes pids
+	"""
+	lines = [f'{"pid":>8} {"private":>10} {"shared":>10} {"pss":>10} {"rss":>10}']
+	total_private, total_pss = 0, 0
+	for pid in pids:
+		memory = memory_usage(pid)
+		if memory is None:
+			continue
+		total_private += memory['private']
+		total_pss += memory['pss']
+		lines.append(f'{pid:>8} {memory["private"]:>10.1f} {memory["shared"]:>10.1f} {memory["pss"]:>10.1f} {memory["rss"]:>10.1f}')
+	lines.append(f'{"total":>8} {total_private:>10.1f} {"":>10} {total_pss:>10.1f}')
+	return '\n'.join(lines)
+
+
+def main(argv):
+	"""
+	Pass in the directory of the model files and, optionally, the port (default is 8000)
+	and host (default is 127.0.0.1), optionally followed by
+		--workers N: serve from N processes sharing the models (see serve_prefork())
+	"""
+	n_workers = 1
+	if '--workers' in argv:
+		i = argv.index('--workers')
+		n_workers = int(argv[i + 1])
+		argv = argv[:i] + argv[i + 2:]
+	if not argv:
+		print('Please provide the path of the model files')
+		exit()
+	directory = argv[0]
+	port = int(argv[1]) if len(argv) > 1 else 8000
+	host = argv[2] if len(argv) > 2 else '127.0.0.1'
+
+	if n_workers > 1:
+		# every worker records its own metrics
+		serve_prefork(Substitution(directory, metrics=Metrics()), n_workers, host, port)
+		return
+	# the models load in the background, requests arriving before then wait for what they need
+	substitution = Substitution(directory, warm_up=True, metrics=Metrics())
+	asyncio.run(SubstitutionServer(substitution).serve(host, port))
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -1,11 +1,12 @@
 from ingredient_substitution_models import DIISHModel, IngredientSubstitution
 from recipe_similarity_models import TFIDFSimilarity, RecipeSimilarity
-from helper_functions import tokenize, TextCleaner
+from helper_functions import TextCleaner, RecipeStore, Corpus, load_ghg_snapshot, refresh_ghg_snapshot, ghg_array, Metrics
 from gensim.corpora import Dictionary
 from collections import defaultdict
 import numpy as np
-import pandas as pd
-import requests
+import os
+import time
+import threading
 
 
 class Substitution:
@@ -13,11 +14,16 @@ class Substitution:
     Class that encapsulates everything and implements the final ``get_substitutions()``
     method.
     """
+    # every component is loaded on first use (or by load()/the warm-up thread), in this order
+    COMPONENTS = ('dictionary', 'cleaner', 'ghg', 'recipe_store', 'is_model', 'rs_model')
+
     def __init__(
         self,
         directory,
         ingredient_substitution_model: IngredientSubstitution = DIISHModel,
-        recipe_similarity_model: RecipeSimilarity = TFIDFSimilarity
+        recipe_similarity_model: RecipeSimilarity = TFIDFSimilarity,
+        warm_up: bool = False,
+        metrics: Metrics = None
     ):
         """
         Parameters:
@@ -26,41 +32,136 @@ class Substitution:
                 (default is DIISHModel)
             recipe_similarity_model (RecipeSimilarity): the implementation of recipe similarity
                 (default is TFIDFSimilarity)
+            warm_up (bool): load every component in a background thread rather than waiting
+                for their first use
+            metrics (Metrics): records the duration of every phase of get_substitutions() and
+                get_substitutions_batch() along with counters (default is to record nothing)
         """
-        print('Loading recipes...')
-        with open(f'{directory}/recipes_ingredients_only.txt') as f:
-            self.data = f.readlines()
-        self.cleaner = TextCleaner(directory)
-        self.generate_ghg_dict()
-        self.is_model = ingredient_substitution_model(directory)
-        self.rs_model = recipe_similarity_model(directory)
         self.directory = directory
+        self.ingredient_substitution_model = ingredient_substitution_model
+        self.recipe_similarity_model = recipe_similarity_model
+        self.components = dict()
+        self.load_times = dict()
+        self.locks = {name: threading.Lock() for name in self.COMPONENTS}
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.warm_up_thread = None
+        if warm_up:
+            self.warm_up_thread = threading.Thread(target=self.load, daemon=True)
+            self.warm_up_thread.start()
+
+    def load(self, components=COMPONENTS):
+        """
+        Loads the components that haven't been loaded yet
+
+        Returns:
+            self
+        """
+        for name in components:
+            self.component(name)
+        return self
+
+    def component(self, name):
+        """
+        Returns a component, loading it first if it hasn't been loaded
+        """
+        if name not in self.components:
+            with self.locks[name]:
+                if name not in self.components:
+                    start = time.perf_counter()
+                    self.components[name] = getattr(self, f'load_{name}')()
+                    self.load_times[name] = time.perf_counter() - start
+        return self.components[name]
+
+    def load_report(self):
+        """
+        Returns the seconds every component took to load (None for the ones not loaded yet)
+        """
+        return {name: self.load_times.get(name) for name in self.COMPONENTS}
+
+    @property
+    def dictionary(self) -> Dictionary:
+        return self.component('dictionary')
+
+    @property
+    def cleaner(self) -> TextCleaner:
+        return self.component('cleaner')
+
+    @property
+    def ghg(self) -> defaultdict:
+        return self.component('ghg')[0]
+
+    @property
+    def ghg_values(self) -> np.ndarray:
+        """
+        The ghg values aligned to the ingredient ids
+        """
+        return self.component('ghg')[1]
+
+    @property
+    def recipe_store(self) -> RecipeStore:
+        return self.component('recipe_store')
+
+    @property
+    def is_model(self) -> IngredientSubstitution:
+        return self.component('is_model')
+
+    @property
+    def rs_model(self) -> RecipeSimilarity:
+        return self.component('rs_model')
+
+    def load_dictionary(self):
+        return Dictionary.load_from_text(f'{self.directory}/dictionary.txt')
+
+    def load_cleaner(self):
+        return TextCleaner(self.directory)
+
+    def load_is_model(self):
+        return self.ingredient_substitution_model(self.directory)
 
-    def generate_ghg_dict(self):
+    def load_rs_model(self):
+        return self.recipe_similarity_model(self.directory)
+
+    def load_recipe_store(self):
+        """
+        Loads the integer-encoded recipes generated by generate_recipe_store(), or indexes the
+        ones of the corpus (see generate_corpus()), or encodes recipes_ingredients_only.txt if
+        neither has been generated
         """
-        Loads dictionary with ghg values from the KB
+        print('Loading recipes...')
+        if os.path.exists(f'{self.directory}/recipe_store'):
+            return RecipeStore.load(f'{self.directory}/recipe_store', self.dictionary)
+        if os.path.exists(f'{self.directory}/corpus'):
+            return RecipeStore.from_corpus(Corpus.load(f'{self.directory}/corpus'))
+        with open(f'{self.directory}/recipes_ingredients_only.txt') as f:
+            return RecipeStore.build(f, self.dictionary)
+
+    def load_ghg(self, refresh=False):
+        """
+        Loads the ghg values from the snapshot of the KB in the directory (ghg_snapshot.json),
+        fetching and saving the snapshot first if it doesn't exist or refresh is set
+        (see refresh_ghg.py)
+
+        Returns:
+            (ingredient name -> ghg value defaultdict, ghg values aligned to the ingredient ids)
         """
         print('Loading ghg dictionary...')
-        self.ghg = defaultdict(float)
-        ids = requests.get(
-            'https://ecarekb.schlegel-online.de/foodon_ids').json()
-        for ing in ids:
-            name = self.cleaner.filter_ingredient(ing['ingredient'])
-            if name:
-                req = requests.get(
-                    f'https://ecarekb.schlegel-online.de/ingredient?ingredient={"+".join(ing["ingredient"].split())}')
-                ghg = req.json()['ghg']
-                self.ghg[name] = ghg
-            else:
-                continue
-            for alt_name in ing['alternate_names']:
-                alt_name_f = self.cleaner.filter_ingredient(alt_name)
-                if alt_name_f and alt_name_f not in self.ghg:
-                    self.ghg[alt_name_f] = ghg
+        path = f'{self.directory}/ghg_snapshot.json'
+        if refresh or not os.path.exists(path):
+            print('Fetching ghg values from the KB...')
+            ghg = refresh_ghg_snapshot(path, self.cleaner)
+        else:
+            ghg = load_ghg_snapshot(path)['ghg']
+        names = [self.dictionary[i] for i in range(len(self.dictionary))]
         print('ghg dictionary loaded!')
+        return defaultdict(float, ghg), ghg_array(ghg, names)
 
-
-    
+    def generate_ghg_dict(self, refresh=True):
+        """
+        Reloads the ghg values, fetching them from the KB again unless refresh is False
+        """
+        start = time.perf_counter()
+        self.components['ghg'] = self.load_ghg(refresh=refresh)
+        self.load_times['ghg'] = time.perf_counter() - start
 
     def get_substitutions(self,
                           ingredients : [(str, bool)],
@@ -96,8 +197,98 @@ class Substitution:
         sorted by confidence
         """
 
-        # filter ingredients and instructions and then tokenize them
-        ingredients = [(self.cleaner.filter_ingredient(ing), hc) for ing, hc in ingredients]
+        with self.metrics.phase('total'):
+            self.metrics.count('requests')
+            with self.metrics.phase('cleaning'):
+                ingredients, recipe = self.clean_recipe(ingredients, instructions)
+
+            # get the most similar recipes
+            with self.metrics.phase('similarity'):
+                similar_recipes = self.rs_model.get_most_similar(recipe, k=k_similar_recipes)
+            # if verbose:
+            #     print('Similar recipes (index, confidence):')
+            #     print(similar_recipes)
+
+            return self.substitutions_from_similar(
+                ingredients, similar_recipes,
+                k_top_candidates=k_top_candidates,
+                important_threshold=important_threshold,
+                total_ghg=total_ghg,
+                verbose=verbose)
+
+    def get_substitutions_batch(self,
+                                recipes: [[(str, bool)]],
+                                instructions: [[str]] = None,
+                                k_similar_recipes: int = 100,
+                                k_top_candidates: int = 5,
+                                important_threshold: float = 0.8,
+                                total_ghgs: [int] = None,
+                                verbose=False):
+        """
+        Gets substitution suggestions for many recipes at once. The recipes are cleaned
+        together (every distinct ingredient string is filtered once), vectorised and searched
+        in one batch, and the candidates of every high carbon ingredient are looked up once.
+        The results are the same as calling get_substitutions() on every recipe.
+
+        Parameters:
+            recipes: a list of recipes, each a list of (ingredient, isHighCarbon) tuples
+            instructions: a list of the instructions of every recipe (optional)
+            total_ghgs: the total_ghg of every recipe (optional)
+            k_similar_recipes, k_top_candidates, important_threshold: see get_substitutions()
+
+        Returns:
+            a list of get_substitutions() results
+        """
+        start = time.perf_counter()
+        if instructions is None:
+            instructions = [[] for _ in recipes]
+        if total_ghgs is None:
+            total_ghgs = [-1 for _ in recipes]
+
+        self.metrics.count('requests', len(recipes))
+        self.metrics.count('batches')
+        filtered = dict()
+        # the cleaning and similarity phases of a batch are recorded once for the whole batch
+        with self.metrics.phase('batch_cleaning'):
+            cleaned = [self.clean_recipe(ingredients, insts, filtered)
+                       for ingredients, insts in zip(recipes, instructions)]
+        with self.metrics.phase('batch_similarity'):
+            similar = self.rs_model.get_most_similar_batch(
+                [recipe for _, recipe in cleaned], k=k_similar_recipes)
+
+        candidates = dict()
+        results = [
+            self.substitutions_from_similar(
+                ingredients, similar_recipes,
+                k_top_candidates=k_top_candidates,
+                important_threshold=important_threshold,
+                total_ghg=total_ghg,
+                verbose=verbose,
+                candidates=candidates)
+            for (ingredients, _), similar_recipes, total_ghg in zip(cleaned, similar, total_ghgs)
+        ]
+        self.metrics.observe('batch_total', time.perf_counter() - start)
+        if verbose:
+            elapsed = time.perf_counter() - start
+            print(f'{len(recipes)} recipes in {elapsed:.2f}s ({len(recipes) / elapsed:.1f} recipes/s)')
+        return results
+
+    def clean_recipe(self, ingredients: [(str, bool)], instructions: [str] = [], filtered=None):
+        """
+        Filters the ingredients and instructions of a recipe and tokenizes them
+
+        Parameters:
+            filtered: dict used to cache the filtered ingredient strings (optional)
+
+        Returns:
+            (the filtered (ingredient, isHighCarbon) tuples, the recipe tokens)
+        """
+        if filtered is None:
+            filtered = dict()
+        for ing, _ in ingredients:
+            if ing not in filtered:
+                filtered[ing] = self.cleaner.filter_ingredient(ing)
+        ingredients = [(filtered[ing], hc) for ing, hc in ingredients]
         instructions = self.cleaner.filter_instruction(" || ".join(instructions)).split()
 
         # concatenate the two using @@ if there are instructions
@@ -105,46 +296,76 @@ class Substitution:
             recipe = " ".join([ing for ing, _ in ingredients]).split() + ['@@'] + instructions
         else:
             recipe = " ".join([ing for ing, _ in ingredients]).split()
-        
-        # get the most similar recipes
-        similar_recipes = self.rs_model.get_most_similar(recipe, k=k_similar_recipes)
-        # if verbose:
-        #     print('Similar recipes (index, confidence):')
-        #     print(similar_recipes)
+        return ingredients, recipe
+
+    def substitutions_from_similar(self,
+                                   ingredients: [(str, bool)],
+                                   similar_recipes,
+                                   k_top_candidates: int = 5,
+                                   important_threshold: float = 0.8,
+                                   total_ghg: int = -1,
+                                   verbose=False,
+                                   candidates=None):
+        """
+        Gets the substitution suggestions of a cleaned recipe (see clean_recipe()) from its
+        most similar recipes (see get_substitutions())
 
+        Parameters:
+            similar_recipes: (index, distance) tuples of the most similar recipes
+            candidates: dict used to cache the top candidates of every ingredient (optional)
+        """
+        metrics = self.metrics
         ings_only = " ".join([ing for ing, _ in ingredients]).split() 
-        recipes = [self.data[index].split() for index, _ in similar_recipes
-                    # only consider recipes that aren't a superset of the input recipe
-                    # because we care about what can be substituted rather than added
-                    if not set(self.data[index].split()).issuperset(ings_only)]
+        with metrics.phase('superset_filter'):
+            similar_ids = np.array([index for index, _ in similar_recipes], dtype=np.int64)
+            # only consider recipes that aren't a superset of the input recipe
+            # because we care about what can be substituted rather than added
+            supersets = self.recipe_store.contains_all(similar_ids, self.recipe_store.encode(ings_only))
+            similar_ids = similar_ids[~supersets]
+        metrics.count('similar_recipes', len(supersets))
+        metrics.count('superset_recipes_filtered', int(supersets.sum()))
 
         # if verbose:
         #     print('Recipe ingredients: ', recipes)
 
         # get the important and substitutable ingredients
-        imp, subs = self.get_substitutable_ings(
-            recipes, no_above=important_threshold)
+        with metrics.phase('substitutable_split'):
+            imp, subs = self.get_substitutable_ings(
+                similar_ids, no_above=important_threshold)
+            substitutable = np.zeros(len(self.recipe_store.names), dtype=bool)
+            substitutable[subs] = True
 
         if verbose:
-            print("Important: ", imp)
-            print("Substitutable: ", subs)
+            print("Important: ", [self.recipe_store.names[i] for i in imp])
+            print("Substitutable: ", [self.recipe_store.names[i] for i in subs])
             print()
 
+        if candidates is None:
+            candidates = dict()
         substitutions = []
-        # loop through every ingredient
-        for ingredient, hc in ingredients:
-            # if it's high carbon,
-            if hc:
-                for ing in ingredient.split():
-                    # check if the ingredient substitution model outputs something that
-                    # is substitutable in the recipe cluster
-                    similar_ingredients = self.is_model.get_top_candidates(
-                        ing, k=k_top_candidates)
-                    for sim_ing, confidence in similar_ingredients:
-                        # add it to the list of possible substitutions if it is
-                        if sim_ing in subs and sim_ing not in ingredients:
-                            substitutions.append(
-                                {'from': ing, 'to': sim_ing, 'confidence': confidence})
+        n_considered, n_hits = 0, 0
+        with metrics.phase('candidates'):
+            # loop through every ingredient
+            for ingredient, hc in ingredients:
+                # if it's high carbon,
+                if hc:
+                    for ing in ingredient.split():
+                        # check if the ingredient substitution model outputs something that
+                        # is substitutable in the recipe cluster
+                        if ing not in candidates:
+                            candidates[ing] = self.is_model.get_top_candidates(
+                                ing, k=k_top_candidates)
+                        else:
+                            n_hits += 1
+                        n_considered += len(candidates[ing])
+                        for sim_ing, confidence in candidates[ing]:
+                            # add it to the list of possible substitutions if it is
+                            sim_id = self.recipe_store.token2id.get(sim_ing, -1)
+                            if sim_id >= 0 and substitutable[sim_id] and sim_ing not in ingredients:
+                                substitutions.append(
+                                    {'from': ing, 'to': sim_ing, 'confidence': confidence})
+        metrics.count('candidates_considered', n_considered)
+        metrics.count('candidate_cache_hits', n_hits)
 
         # remove duplicates
         substitutions = [dict(t)
@@ -153,49 +374,65 @@ class Substitution:
         # sort by how confident we are of the substitution being a viable one
         substitutions.sort(key=lambda x: x['confidence'], reverse=True)
 
-        # calculate total ghg if not passed in
-        if total_ghg == -1:
-            total_ghg = self.calculate_total_ghg(ings_only)
-
-        # only return substitutions of ingredients that are high
-        # carbon and if the subtitute has a less ghg
-        substitutions = list(filter(
-            lambda sub: self.ghg[sub['from']] >= self.ghg[sub['to']],
-            substitutions
-        )
-        )
-
-        # add ghg difference and percent reduction to substitutions
-        for sub in substitutions:
-            sub['ghg_difference'] = self.ghg[sub['from']] - self.ghg[sub['to']]
-            if total_ghg == 0:
-                sub['percent_reduction'] = 0
-            else:
-                sub['percent_reduction'] = sub['ghg_difference'] / total_ghg * 100
+        with metrics.phase('ghg_filter'):
+            # calculate total ghg if not passed in
+            if total_ghg == -1:
+                total_ghg = self.calculate_total_ghg(ings_only)
+
+            # only return substitutions of ingredients that are high
+            # carbon and if the subtitute has a less ghg
+            values = self.ghg_of([name for sub in substitutions for name in (sub['from'], sub['to'])]).reshape(-1, 2)
+            differences = values[:, 0] - values[:, 1]
+            keep = np.flatnonzero(values[:, 0] >= values[:, 1])
+            substitutions = [substitutions[i] for i in keep]
+
+            # add ghg difference and percent reduction to substitutions
+            for sub, difference in zip(substitutions, differences[keep].tolist()):
+                sub['ghg_difference'] = difference
+                if total_ghg == 0:
+                    sub['percent_reduction'] = 0
+                else:
+                    sub['percent_reduction'] = sub['ghg_difference'] / total_ghg * 100
+        metrics.count('substitutions_returned', len(substitutions))
 
         return substitutions
 
-    def get_substitutable_ings(self, recipes, no_above=0.7):
+    def get_substitutable_ings(self, recipe_ids, no_above=0.7):
         """
-        Separates the important ingredients from the substitutable one
+        Separates the important ingredients from the substitutable one: an ingredient is
+        important if it occurs in more than int(no_above * len(recipe_ids)) of the recipes
+        (what gensim's Dictionary.filter_extremes(no_below=0, no_above) filters out)
 
         Parameters:
-            recipes: list of *tokenized* recipes
+            recipe_ids: ids of the recipes in the recipe store
             no_above: the minimum fraction to be considered important
 
         Returns
-            (important_ings, subs_ings)
+            (important ingredient ids, substitutable ingredient ids), both in the order the
+            ingredients first occur in the recipes (by name within a recipe)
         """
-        id2word = Dictionary(recipes)
-        all_ings = list(id2word.values())
-        id2word.filter_extremes(no_below=0, no_above=no_above)
-        # after filtering (substitutable)
-        subs_ings = list(id2word.values())
-        important_ings = list(filter(lambda x: x not in subs_ings, all_ings))
-        return important_ings, subs_ings
+        _, ids = self.recipe_store.ingredients_of(recipe_ids)
+        # document frequencies
+        dfs = np.bincount(ids, minlength=len(self.recipe_store.names))
+        _, first = np.unique(ids, return_index=True)
+        ids = ids[np.sort(first)]
+        substitutable = dfs[ids] <= int(no_above * len(recipe_ids))
+        return ids[~substitutable], ids[substitutable]
 
     def calculate_total_ghg(self, ingredients: [str]):
-        return sum([self.ghg[ing] for ing in ingredients])
+        return sum(self.ghg_of(ingredients).tolist())
+
+    def ghg_of(self, names: [str]) -> np.ndarray:
+        """
+        Returns the ghg values of the ingredients names (0 for ingredients without one), read
+        from ghg_values by dictionary id (from the ghg dictionary for names outside the vocabulary)
+        """
+        token2id = self.dictionary.token2id
+        ids = np.array([token2id.get(name, -1) for name in names], dtype=np.int64)
+        values = self.ghg_values[np.maximum(ids, 0)] if len(self.ghg_values) else np.zeros(len(ids))
+        for i in np.flatnonzero(ids < 0):
+            values[i] = self.ghg.get(names[i], 0.0)
+        return values
     
     
     def get_substitutions_is_model_only(self,
@@ -235,9 +472,10 @@ class Substitution:
                 continue
             if hc:
                 candidates = self.is_model.get_top_candidates(name, k_top_candidates)
-                for sim_ing, confidence in candidates:
-                    if self.ghg[name] >= self.ghg[sim_ing]:
-                        difference = self.ghg[name] - self.ghg[sim_ing] 
+                values = self.ghg_of([name] + [sim_ing for sim_ing, _ in candidates]).tolist()
+                for (sim_ing, confidence), value in zip(candidates, values[1:]):
+                    if values[0] >= value:
+                        difference = values[0] - value
                         subs.append(
                                 {'from': name, 'to': sim_ing, 'confidence': confidence,
                                 'ghg_difference': difference,
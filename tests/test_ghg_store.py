@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+pytest.importorskip('requests')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helper_functions.ghg_store import SNAPSHOT_VERSION, refresh_ghg_snapshot, load_ghg_snapshot
+
+
+class StubCleaner:
+	"""
+	Stands in for TextCleaner: every ingredient is defined except the ones starting with 'unknown'
+	"""
+	def filter_ingredient(self, ing):
+		ing = ing.lower().strip()
+		return '' if ing.startswith('unknown') else ing
+
+
+class StubKB:
+	"""
+	Serves /foodon_ids and /ingredient?ingredient= like the KB, from a dict of
+	ingredient -> (alternate names, ghg)
+	"""
+	def __init__(self, ingredients):
+		self.ingredients = ingredients
+		kb = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				url = urlparse(self.path)
+				if url.path == '/foodon_ids':
+					body = [{'ingredient': name, 'alternate_names': alt_names}
+						for name, (alt_names, _) in kb.ingredients.items()]
+				elif url.path == '/ingredient':
+					name = parse_qs(url.query)['ingredient'][0]
+					if name not in kb.ingredients:
+						self.send_error(404)
+						return
+					body = {'ghg': kb.ingredients[name][1]}
+				else:
+					self.send_error(404)
+					return
+				payload = json.dumps(body).encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type', 'application/json')
+				self.send_header('Content-Length', str(len(payload)))
+				self.end_headers()
+				self.wfile.write(payload)
+
+			def log_message(self, *args):
+				pass
+
+		self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+	def __enter__(self):
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		return self
+
+	def __exit__(self, *args):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+def test_refresh_from_a_stub_kb(tmp_path):
+	path = str(tmp_path / 'ghg_snapshot.json')
+	ingredients = {
+		'beef': (['ground beef', 'minced beef'], 27.0),
+		'chicken': (['chicken breast', 'beef'], 6.9),
+		'tofu': ([], 2.0),
+		'unknown thing': (['thing'], 100.0),
+	}
+	with StubKB(ingredients) as kb:
+		ghg = refresh_ghg_snapshot(path, StubCleaner(), base_url=kb.url, n_workers=4)
+
+		# an ingredient's own name wins over another's alternate name, undefined ones are skipped
+		assert ghg == {'beef': 27.0, 'ground beef': 27.0, 'minced beef': 27.0, 'chicken': 6.9, 'chicken breast': 6.9, 'tofu': 2.0}
+		snapshot = load_ghg_snapshot(path)
+		assert snapshot['version'] == SNAPSHOT_VERSION
+		assert snapshot['source'] == kb.url
+		assert snapshot['ghg'] == ghg
+		assert [record['ingredient'] for record in snapshot['records']] == ['beef', 'chicken', 'tofu']
+		assert snapshot['records'][0]['alternate_names'] == ['ground beef', 'minced beef']
+
+		# a refresh replaces the snapshot with the KB's current values
+		ingredients['tofu'] = (['bean curd'], 3.0)
+		refresh_ghg_snapshot(path, StubCleaner(), base_url=kb.url, n_workers=4)
+	snapshot = load_ghg_snapshot(path)
+	assert snapshot['ghg']['tofu'] == 3.0 and snapshot['ghg']['bean curd'] == 3.0
+	assert not os.path.exists(f'{path}.tmp')
+
+	# snapshots written by a newer version of the format are refused
+	snapshot['version'] = SNAPSHOT_VERSION + 1
+	with open(path, 'w') as f:
+		json.dump(snapshot, f)
+	with pytest.raises(ValueError):
+		load_ghg_snapshot(path)
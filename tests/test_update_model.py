@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import copy
+
+import pytest
+
+# the build needs the whole NLP stack, including the spaCy model and the NLTK data it uses
+spacy = pytest.importorskip('spacy')
+pytest.importorskip('gensim')
+if not spacy.util.is_package('en_core_web_lg'):
+	pytest.skip('the en_core_web_lg spaCy model is needed', allow_module_level=True)
+nltk = pytest.importorskip('nltk')
+try:
+	nltk.data.find('corpora/stopwords')
+	nltk.data.find('corpora/wordnet')
+except LookupError:
+	pytest.skip('the NLTK stopwords and wordnet corpora are needed', allow_module_level=True)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _lines(path):
+	with open(path, 'r') as f:
+		return f.read().splitlines()
+
+
+def test_added_recipes_survive_a_rebuild(tmp_path, monkeypatch):
+	from benchmark import generate_synthetic_corpus, build_model
+	from generate_model import build_stages
+	from helper_functions import BuildGraph
+	from update_model import update_model
+
+	generate_synthetic_corpus(str(tmp_path), 200, n_ingredients=100)
+	build_model(str(tmp_path))
+	monkeypatch.chdir(tmp_path)
+	with open('layer1.json', 'r') as f:
+		recipes = json.load(f)
+
+	# recipes made of known ingredients, so no full rebuild is needed to add them
+	added = copy.deepcopy(recipes[:3])
+	for i, recipe in enumerate(added):
+		recipe['id'] = f'added-{i}'
+		recipe['instructions'] = [{'text': f'added recipe number {i}'}]
+	update_model(added, n_jobs=1)
+	after_update = _lines('build/recipes_ingredients_and_instructions.txt')
+	assert len(after_update) == len(recipes) + len(added)
+
+	stages = [stage for stage in build_stages('layer1.json') if stage.name != 'food_names']
+	BuildGraph(stages).run(n_jobs=1)
+
+	rebuilt = _lines('build/recipes_ingredients_and_instructions.txt')
+	assert len(rebuilt) == len(recipes) + len(added)
+	assert rebuilt[-len(added):] == after_update[-len(added):]
+	assert len(_lines('build/recipes_ingredients_only.txt')) == len(recipes) + len(added)
+
+
+def test_an_interrupted_update_is_finished_once(tmp_path, monkeypatch):
+	from benchmark import generate_synthetic_corpus, build_model
+	from helper_functions import load_array, load_sparse
+	import update_model
+
+	generate_synthetic_corpus(str(tmp_path), 200, n_ingredients=100)
+	build_model(str(tmp_path))
+	monkeypatch.chdir(tmp_path)
+	with open('layer1.json', 'r') as f:
+		recipes = json.load(f)
+	added = copy.deepcopy(recipes[:3])
+	for i, recipe in enumerate(added):
+		recipe['id'] = f'added-{i}'
+
+	def interrupt(*args, **kwargs):
+		raise KeyboardInterrupt
+	with monkeypatch.context() as patch:
+		patch.setattr(update_model, 'update_recipe_indexes', interrupt)
+		with pytest.raises(KeyboardInterrupt):
+			update_model.update_model(added, n_jobs=1)
+	# other recipes can't be added until the update has finished
+	with pytest.raises(RuntimeError):
+		update_model.update_model(recipes[3:4], n_jobs=1)
+
+	update_model.update_model(added, n_jobs=1)
+	update_model.update_model(added, n_jobs=1)
+	n = len(recipes) + len(added)
+	assert len(_lines('build/recipes_ingredients_only.txt')) == n
+	assert len(_lines('build/recipes_ingredients_and_instructions.txt')) == n
+	assert len(update_model.load_added_recipes()) == len(added)
+	assert len(load_array(update_model.RECIPE_VECTORS['doc2vec'])) == n
+	assert load_sparse(update_model.RECIPE_VECTORS['tfidf']).shape[0] == n
+	assert not [name for name in os.listdir('build') if name.endswith(('.staged', '.old'))]
@@ -0,0 +1,332 @@
+import sys
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from scipy import sparse
+from helper_functions import (
+	RecipeStore, Corpus, tokenize, save_array, append_array, load_array, read_header, dictionary_hash, save_sparse, load_sparse,
+	count_cooccurrences, normalise_cooccurrence, build_fic_counts
+)
+from vectorizers import TFIDFVectorizer, Doc2VecVectorizer
+from recipe_similarity_models import IVFIndex, QuantizedIndex, InvertedIndex
+from ingredient_substitution_models import diish_block
+from generate_model import (
+	DIISH, RECIPE_VECTORS, load_recipe_vectors, load_dictionary, clean_recipes, generate_DIISH_top_candidates,
+	load_added_recipes, save_added_recipes
+)
+
+
+def main(argv):
+	"""
+	Adds new recipes to the model in the "build" directory without rebuilding it.
+	Pass in the path of a JSON file of recipes in the format of Recipe1M's layer1.json.
+	"""
+	if not argv:
+		print('Please provide the path of the new recipes')
+		exit()
+	with open(argv[0], 'r') as f:
+		data = json.load(f)
+	update_model(data)
+
+
+JOURNAL = 'build/update_journal.json'
+DATASETS = ('build/recipes_ingredients_only.txt', 'build/recipes_ingredients_and_instructions.txt')
+UPDATE_STEPS = (
+	'datasets', 'corpus', 'dictionary', 'recipe_store', 'cooccurrence', 'DIISH', 'DIISH_top_candidates',
+	'tfidf_vectors', 'doc2vec_vectors', 'recipe_indexes'
+)
+
+
+def update_model(data, n_jobs=None):
+	"""
+	Cleans the new recipes in data (Recipe1M formatted) and folds them into every artifact:
+
+	* the recipes are saved to build/added_recipes.json, so full builds keep them, and appended
+	  to both corpora, their integer-encoded corpus and the recipe store
+	* the dictionary's document frequencies are updated
+	* their counts are added to the co-occurrence, fc and fic matrices
+	* the DIISH rows (and columns) of the ingredients they contain are recomputed and the top
+	  candidate table regenerated
+	* their TF-IDF and Doc2Vec vectors are appended to the recipe vectors and added to the ANN indexes
+
+	The word2vec, Doc2Vec and TF-IDF models themselves aren't retrained, and the P scores
+	between ingredients that aren't in the new recipes only catch up with the new context
+	counts on the next full build (generate_model.py). Recipes with ingredients that aren't in
+	the dictionary need a full build.
+
+	Every step writes its outputs next to the artifacts (path.staged) and moves them into place
+	once they're all written, and the steps that are done are recorded in build/update_journal.json
+	along with what the artifacts held before the update. If the update is interrupted, running
+	it again with the same recipes finishes it without adding them twice, and running it again
+	once it's done changes nothing. Other recipes can only be added once it has finished.
+	"""
+	print(f'---- Adding {len(data)} recipes ----')
+	batch = hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+	recipes = list(clean_recipes(data, n_jobs=n_jobs))
+	ingredient_lines = [ingredients for ingredients, _ in recipes]
+	lines = [rec for _, rec in recipes]
+
+	dictionary = load_dictionary()
+	unknown = {ing for line in ingredient_lines for ing in line.split()} - set(dictionary.token2id)
+	if unknown:
+		raise ValueError(f'{", ".join(sorted(unknown))} aren\'t in the dictionary, the model needs a full rebuild (generate_model.py)')
+
+	journal = start_update(batch, dictionary)
+	if len(journal['done']) == len(UPDATE_STEPS):
+		print('These recipes have already been added')
+		return
+	base = journal['base']
+	steps = {
+		'datasets': lambda: append_datasets(data, ingredient_lines, lines, base),
+		'corpus': lambda: update_corpus(ingredient_lines, lines),
+		'dictionary': lambda: update_dictionary(ingredient_lines),
+		'recipe_store': lambda: update_recipe_store(ingredient_lines),
+		'cooccurrence': lambda: update_cooccurrence_matrices(ingredient_lines, np.array(base['recipe_counts'], dtype=np.int64)),
+		'DIISH': lambda: update_DIISH_matrix(ingredient_lines),
+		'DIISH_top_candidates': generate_DIISH_top_candidates,
+		'tfidf_vectors': lambda: update_tfidf_vectors(ingredient_lines),
+		'doc2vec_vectors': lambda: update_doc2vec_vectors(lines, base['doc2vec']),
+		'recipe_indexes': lambda: update_recipe_indexes(base)
+	}
+	for name in UPDATE_STEPS:
+		if name not in journal['done']:
+			run_update_step(journal, name, steps[name])
+	print('Done!')
+
+
+def start_update(batch, dictionary):
+	"""
+	Returns the journal of the update adding the recipes batch (their hash), which is either
+	resumed or started, recording what the artifacts hold before it
+	"""
+	if os.path.exists(JOURNAL):
+		with open(JOURNAL, 'r') as f:
+			journal = json.load(f)
+		if journal['batch'] == batch:
+			if len(journal['done']) < len(UPDATE_STEPS):
+				print(f'Resuming the update after {", ".join(journal["done"]) or "no steps"}...')
+			return journal
+		if len(journal['done']) < len(UPDATE_STEPS):
+			raise RuntimeError(f'The previous update was interrupted after {", ".join(journal["done"]) or "no steps"}, run it again with the same recipes first')
+	journal = {
+		'batch': batch,
+		'done': [],
+		'staged': dict(),
+		'base': {
+			'datasets': {path: os.path.getsize(path) for path in DATASETS},
+			'added_recipes': len(load_added_recipes()),
+			'recipe_counts': [dictionary.dfs.get(i, 0) for i in range(len(dictionary))],
+			'doc2vec': len(load_array(RECIPE_VECTORS['doc2vec'])),
+			'tfidf': load_sparse(RECIPE_VECTORS['tfidf']).shape[0]
+		}
+	}
+	save_journal(journal)
+	return journal
+
+
+def save_journal(journal):
+	with open(f'{JOURNAL}.tmp', 'w') as f:
+		json.dump(journal, f)
+	os.replace(f'{JOURNAL}.tmp', JOURNAL)
+
+
+def run_update_step(journal, name, step):
+	"""
+	Runs step, which returns the (staged path, path) pairs of the outputs it wrote, and moves
+	them into place. Once the pairs are in the journal, they are moved even if the update is
+	interrupted and resumed.
+	"""
+	if name not in journal['staged']:
+		journal['staged'][name] = step() or []
+		save_journal(journal)
+	for staged, path in journal['staged'][name]:
+		commit_staged(staged, path)
+	journal['done'].append(name)
+	del journal['staged'][name]
+	save_journal(journal)
+
+
+def staged_path(path):
+	"""
+	Returns the path to stage the new version of path at, clearing what an interrupted update
+	may have left there
+	"""
+	staged = f'{path}.staged'
+	if os.path.isdir(staged):
+		shutil.rmtree(staged)
+	elif os.path.exists(staged):
+		os.remove(staged)
+	return staged
+
+
+def commit_staged(staged, path):
+	"""
+	Replaces path with staged. A directory is moved aside first (path.old) since it can't be
+	replaced in one step; if staged is gone, it has already been moved into place.
+	"""
+	old = f'{path}.old'
+	if os.path.exists(staged):
+		if os.path.isdir(staged):
+			if os.path.exists(path):
+				if os.path.exists(old):
+					shutil.rmtree(old)
+				os.rename(path, old)
+			os.rename(staged, path)
+		else:
+			os.replace(staged, path)
+	if os.path.isdir(old):
+		shutil.rmtree(old)
+
+
+def append_datasets(data, ingredient_lines, lines, base):
+	"""
+	Appends the recipes to the text corpora and build/added_recipes.json, after cutting them
+	back to what they held before the update
+	"""
+	print('Appending to the datasets...')
+	save_added_recipes(load_added_recipes()[:base['added_recipes']] + list(data))
+	for path, new_lines in zip(DATASETS, (ingredient_lines, lines)):
+		with open(path, 'r+') as f:
+			f.truncate(base['datasets'][path])
+			f.seek(0, os.SEEK_END)
+			f.writelines(line + '\n' for line in new_lines)
+
+
+def update_corpus(ingredient_lines, lines):
+	if not os.path.exists('build/corpus'):
+		return []
+	print('Updating integer-encoded corpus...')
+	staged = staged_path('build/corpus')
+	Corpus.load('build/corpus').append(ingredient_lines, lines).save(staged)
+	return [(staged, 'build/corpus')]
+
+
+def update_dictionary(lines):
+	print('Updating dictionary...')
+	dictionary = load_dictionary()
+	dictionary.add_documents(tokenize(lines))
+	staged = staged_path('build/dictionary.txt')
+	dictionary.save_as_text(staged)
+	return [(staged, 'build/dictionary.txt')]
+
+
+def update_recipe_store(lines):
+	print('Updating recipe store...')
+	dictionary = load_dictionary()
+	store = RecipeStore.load('build/recipe_store', dictionary).append(lines, dictionary)
+	staged = staged_path('build/recipe_store')
+	store.save(staged, vocab_hash=dictionary_hash(dictionary))
+	return [(staged, 'build/recipe_store')]
+
+
+def update_cooccurrence_matrices(lines, recipe_counts):
+	"""
+	Adds the counts of the recipes in lines to the co-occurrence, fc and fic matrices
+
+	Parameters:
+		recipe_counts: the number of recipes every ingredient occurred in before the update
+	"""
+	dictionary = load_dictionary()
+	vocab_hash = dictionary_hash(dictionary)
+	n = len(dictionary)
+	print('Updating co-occurrence and fc matrices...')
+	counts, fc, new_recipe_counts = count_cooccurrences(lines, dictionary.token2id, n, verbose=False)
+	# the co-occurrence matrix is stored divided by the recipe counts
+	cooccurrence = sparse.diags(recipe_counts.astype(np.float64)) @ load_sparse('build/cooccurrence_matrix.csr', vocab_hash=vocab_hash)
+	cooccurrence = normalise_cooccurrence(cooccurrence + counts, recipe_counts + new_recipe_counts)
+	matrices = {
+		'build/cooccurrence_matrix.csr': cooccurrence,
+		'build/fc_matrix.csr': load_sparse('build/fc_matrix.csr', vocab_hash=vocab_hash) + fc
+	}
+	print('Updating fic matrix...')
+	fic = build_fic_counts(lines, dictionary.token2id, n, verbose=False)
+	matrices['build/fic_matrix.csr'] = load_sparse('build/fic_matrix.csr', vocab_hash=vocab_hash) + fic
+	staged = []
+	for path, matrix in matrices.items():
+		save_sparse(staged_path(path), matrix, vocab_hash=vocab_hash)
+		staged.append((f'{path}.staged', path))
+	return staged
+
+
+def update_DIISH_matrix(lines):
+	"""
+	Recomputes the DIISH scores of the ingredients in lines against every ingredient
+	"""
+	print('Initialising DIISH...')
+	diish = DIISH()
+	vocab_hash = dictionary_hash(diish.dictionary)
+	ingredient_ids = np.unique(np.array([diish.dictionary.token2id[ing] for line in lines for ing in line.split()], dtype=np.int64))
+	print(f'Updating DIISH matrix... ({len(ingredient_ids)} ingredients)')
+	matrix = load_array('build/DIISH_matrix.bin', vocab_hash=vocab_hash, mmap=False)
+	block = diish_block(*diish.component_vectors(), rows=ingredient_ids)
+	matrix[ingredient_ids] = block
+	matrix[:, ingredient_ids] = block.T
+	staged = staged_path('build/DIISH_matrix.bin')
+	save_array(staged, matrix, vocab_hash=vocab_hash)
+	return [(staged, 'build/DIISH_matrix.bin')]
+
+
+def update_tfidf_vectors(lines):
+	"""
+	Appends the TF-IDF vectors of the new recipes and rebuilds the TF-IDF inverted index
+	"""
+	print('Generating TF-IDF vectors...')
+	model = TFIDFVectorizer(model_path='build/tfidf_model_ingredients_only', dict_path='build/dictionary.txt')
+	tfidf = model.transform_sparse(tokenize(lines))
+	vocab_hash = dictionary_hash(model.id2word)
+	vectors = sparse.vstack([load_sparse(RECIPE_VECTORS['tfidf'], vocab_hash=vocab_hash), tfidf])
+	staged = staged_path(RECIPE_VECTORS['tfidf'])
+	save_sparse(staged, vectors, vocab_hash=vocab_hash)
+	return [(staged, RECIPE_VECTORS['tfidf'])]
+
+
+def update_doc2vec_vectors(lines, start):
+	"""
+	Appends the Doc2Vec vectors of the new recipes to the start vectors there were before the update
+	"""
+	n = len(load_array(RECIPE_VECTORS['doc2vec']))
+	if n == start + len(lines):
+		return
+	if n != start:
+		raise RuntimeError(f'{RECIPE_VECTORS["doc2vec"]} holds {n} vectors, expected {start} or {start + len(lines)}')
+	print('Inferring Doc2Vec vectors...')
+	doc2vec = Doc2VecVectorizer('build/doc2vec_ingredients_and_instructions.model', seed=1)
+	# append_array replaces the file in one step
+	append_array(RECIPE_VECTORS['doc2vec'], np.array(list(doc2vec.transform(tokenize(lines))), dtype=np.float32))
+
+
+def update_recipe_indexes(base):
+	"""
+	Rebuilds the TF-IDF inverted index and the quantized indexes that have been built and adds
+	the new vectors to the ANN indexes
+
+	Parameters:
+		base: the number of TF-IDF and Doc2Vec vectors before the update
+	"""
+	print('Updating TF-IDF inverted index...')
+	InvertedIndex.build(load_sparse(RECIPE_VECTORS['tfidf'])).save('build/tfidf_inverted_index')
+	staged = []
+	for name in ('tfidf', 'doc2vec'):
+		for codec in QuantizedIndex.CODECS:
+			if os.path.exists(f'build/{name}_{codec}_index'):
+				print(f'Updating {name} {codec} index...')
+				# the quantization range may have changed, so every vector is requantized
+				rerank = read_header(f'build/{name}_{codec}_index/codes.bin')[0].get('rerank', 4)
+				QuantizedIndex.build(load_recipe_vectors(name, dense=True), codec=codec, rerank=rerank).save(f'build/{name}_{codec}_index')
+		try:
+			index = IVFIndex.load(f'build/{name}_ivf_index')
+		except FileNotFoundError:
+			continue
+		print(f'Updating {name} ANN index...')
+		vectors = load_recipe_vectors(name)[base[name]:]
+		vectors = vectors.toarray() if sparse.issparse(vectors) else np.asarray(vectors)
+		path = staged_path(f'build/{name}_ivf_index')
+		index.add(vectors, np.arange(base[name], base[name] + len(vectors))).save(path)
+		staged.append((path, f'build/{name}_ivf_index'))
+	return staged
+
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
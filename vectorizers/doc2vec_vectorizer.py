@@ -1,4 +1,5 @@
 import os
+import copy
 from gensim.corpora import Dictionary
 from gensim.matutils import sparse2full
 from gensim.models.doc2vec import TaggedDocument, Doc2Vec
@@ -6,13 +7,33 @@ from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.neighbors import NearestNeighbors
 import numpy as np
 import time
+import threading
+from collections import OrderedDict
 
 
 class Doc2VecVectorizer(BaseEstimator, TransformerMixin):
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, epochs=None, seed=None, cache_size=0):
+        """
+        Parameters:
+            path: the Doc2Vec model file
+            epochs: number of epochs vectors are inferred with (default is the model's), the
+                latency/quality knob of inference
+            seed: makes inference deterministic, every document being inferred with a random
+                generator seeded with it (default is to use the model's own random state)
+            cache_size: number of inferred vectors kept, keyed on the document's tokens (the
+                least recently used one is dropped first)
+        """
         self.path = path
+        self.epochs = epochs
+        self.seed = seed
+        self.cache_size = cache_size
         self.model = None
+        self.cache = OrderedDict()
+        self.cache_hits, self.cache_misses = 0, 0
+        self.lock = threading.Lock()
+        # the thread's shallow copy of the model seeded inference runs on
+        self.local = threading.local()
         self.load()
 
     def load(self):
@@ -47,6 +68,47 @@ class Doc2VecVectorizer(BaseEstimator, TransformerMixin):
                                  workers=workers)
         return self
 
+    def infer(self, document):
+        """
+        Returns the (read-only) vector of a tokenized document
+        """
+        key = tuple(document)
+        if self.cache_size:
+            with self.lock:
+                vector = self.cache.get(key)
+                if vector is not None:
+                    self.cache.move_to_end(key)
+                    self.cache_hits += 1
+                    return vector
+                self.cache_misses += 1
+
+        if self.seed is None:
+            vector = self.model.infer_vector(list(document), epochs=self.epochs)
+        else:
+            vector = self.seeded_model().infer_vector(list(document), epochs=self.epochs)
+        vector.setflags(write=False)
+
+        if self.cache_size:
+            with self.lock:
+                self.cache[key] = vector
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return vector
+
+    def seeded_model(self):
+        """
+        Returns the calling thread's shallow copy of the model (sharing its weights, which
+        inference only reads) with its random generator, which gensim draws the random numbers
+        of inference from, freshly seeded, so threads can infer at the same time without
+        touching the shared model
+        """
+        local = self.local
+        if getattr(local, 'source', None) is not self.model:
+            local.model, local.source = copy.copy(self.model), self.model
+        local.model.random = np.random.default_rng(self.seed) if isinstance(self.model.random, np.random.Generator) \
+            else np.random.RandomState(self.seed)
+        return local.model
+
     def transform(self, documents):
         for document in documents:
-            yield self.model.infer_vector(document)
+            yield self.infer(document)
@@ -1,9 +1,11 @@
 import os
+from array import array
 from gensim.corpora import Dictionary
 from gensim.matutils import sparse2full
 from gensim.models import TfidfModel
 from sklearn.base import BaseEstimator, TransformerMixin
 import numpy as np
+from scipy import sparse
 
 
 class TFIDFVectorizer(BaseEstimator, TransformerMixin):
@@ -27,8 +29,11 @@ class TFIDFVectorizer(BaseEstimator, TransformerMixin):
     if self.model_path != None:
       self.tfidf.save(self.model_path)
 
-  def fit(self, documents, labels=None):
-    self.id2word = Dictionary(documents)
+  def fit(self, documents=None, labels=None, dictionary=None):
+    """
+    Fits the model to the documents, or to a Dictionary already built from them
+    """
+    self.id2word = Dictionary(documents) if dictionary is None else dictionary
     # filter ingredients that occur less than 5 times or in more than 70% of the
     # recipes, then keep only the 1500 most frequent ingredients
     # self.id2word.filter_extremes(no_below=5, no_above=0.8, keep_n=400)
@@ -39,4 +44,40 @@ class TFIDFVectorizer(BaseEstimator, TransformerMixin):
   def transform(self, documents):
     for document in documents:
       docvec = self.tfidf[self.id2word.doc2bow(document)]
-      yield sparse2full(docvec, len(self.id2word))
\ No newline at end of file
+      yield sparse2full(docvec, len(self.id2word))
+
+  def transform_sparse(self, documents):
+    """
+    Returns the TF-IDF vectors of documents as a (len(documents), len(id2word)) float32 CSR
+    matrix (a recipe only has a handful of non-zero ingredients)
+    """
+    indptr, indices, data = array('q', [0]), array('i'), array('f')
+    for document in documents:
+      docvec = self.tfidf[self.id2word.doc2bow(document)]
+      indices.extend(i for i, _ in docvec)
+      data.extend(weight for _, weight in docvec)
+      indptr.append(len(indices))
+    return sparse.csr_matrix(
+      (np.frombuffer(data, dtype=np.float32), np.frombuffer(indices, dtype=np.int32), np.frombuffer(indptr, dtype=np.int64)),
+      shape=(len(indptr) - 1, len(self.id2word)))
+
+  def transform_counts(self, counts):
+    """
+    Returns the TF-IDF vectors of the rows of a (n_documents, len(id2word)) CSR matrix of
+    token counts (see Corpus.counts()), the same as transform_sparse() of the documents
+    """
+    counts = sparse.csr_matrix(counts)
+    counts.sum_duplicates()
+    idfs = np.zeros(len(self.id2word))
+    idfs[np.fromiter(self.tfidf.idfs.keys(), dtype=np.int64)] = np.fromiter(self.tfidf.idfs.values(), dtype=np.float64)
+    # tokens with an idf of 0 (in every document) are dropped before normalising, like gensim does
+    weights = sparse.csr_matrix((counts.data * idfs[counts.indices], counts.indices, counts.indptr), shape=counts.shape)
+    weights.eliminate_zeros()
+    lengths = np.diff(weights.indptr)
+    squares = np.zeros(len(lengths))
+    nonempty = lengths > 0
+    squares[nonempty] = np.add.reduceat(weights.data ** 2, weights.indptr[:-1][nonempty])
+    weights.data /= np.repeat(np.sqrt(squares), lengths)
+    weights.data[np.abs(weights.data) <= 1e-12] = 0
+    weights.eliminate_zeros()
+    return sparse.csr_matrix(weights, dtype=np.float32)